@@ -0,0 +1,190 @@
+"""
+Offline end-to-end crawl benchmark.
+
+Runs ecom_product_spider against a recorded archive served by ecom_crawler.replay.ReplayDownloadHandler
+(no network, no browser) and reports pages/s, products/s, CPU time and peak RSS. With --baseline
+the numbers are compared to a stored run and the script exits with status 1 when one of them is
+worse by more than --tolerance, so it can gate changes.
+
+Record an archive from a real crawl (bodies are stored decoded, Playwright renders included):
+    scrapy crawl ecom_product_spider -a domains=virgio.com -s REPLAY_RECORD_FILE=fixtures.warc.gz -s EARLY_ABORT_ENABLED=False
+
+Then from the repo root:
+    python benchmarks/bench_crawl.py --archive fixtures.warc.gz --domains virgio.com
+    python benchmarks/bench_crawl.py --archive fixtures.warc.gz --domains virgio.com --save-baseline benchmarks/my_baseline.json
+    python benchmarks/bench_crawl.py --archive fixtures.warc.gz --domains virgio.com --baseline benchmarks/my_baseline.json
+
+Without --archive a synthetic two-store site (listings with pagination, JSON-LD product pages)
+is generated, benchmarks/crawl_baseline.json is a run of it. Wall-clock numbers depend on the
+machine and on REPLAY_LATENCY / REPLAY_JITTER, compare baselines taken on the same box.
+Extra settings go with -s NAME=VALUE like scrapy crawl.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))  # scrapy.cfg -> ecom_crawler.settings
+
+from scrapy.crawler import CrawlerProcess  # noqa: E402
+from scrapy.utils.project import get_project_settings  # noqa: E402
+
+from ecom_crawler.replay import ArchiveWriter  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join('benchmarks', 'crawl_baseline.json')
+
+# metric -> True when higher is better
+METRICS = {
+    'products': True,
+    'pages_per_sec': True,
+    'products_per_sec': True,
+    'cpu_ms_per_page': False,
+    'peak_rss_mb': False,
+}
+
+
+def _page(title, body):
+    # inline state blob the size of a typical storefront's, the parsers have to wade through it
+    state = json.dumps({'k%d' % i: 'v' * 40 for i in range(400)})
+    return (f'<html><head><title>{title}</title><script>window.__STATE__ = {state};</script></head>'
+            f'<body><header><a href="/">Home</a> <a href="/pages/about">About</a></header>{body}</body></html>').encode()
+
+
+def synthetic_archive(path, domains, collections=8, pages=5, per_page=24):
+    """Writes a synthetic store per domain: home -> collections (paginated) -> product pages."""
+    writer = ArchiveWriter(path)
+    headers = {'Content-Type': 'text/html; charset=utf-8'}
+    for domain in domains:
+        root = f'https://{domain}'
+        nav = ''.join(f'<li><a href="/collections/cat-{c}">Category {c}</a></li>' for c in range(collections))
+        writer.write(f'{root}/', 200, headers, _page('Home', f'<ul>{nav}</ul>'))
+        for c in range(collections):
+            for p in range(1, pages + 1):
+                handles = [f'item-{c}-{p}-{i}' for i in range(per_page)]
+                cards = ''.join(f'<div class="card"><a href="/products/{h}">{h}</a><span class="price">Rs. 999</span></div>' for h in handles)
+                more = f'<a href="/collections/cat-{c}?page={p + 1}">Next</a>' if p < pages else ''
+                url = f'{root}/collections/cat-{c}' + (f'?page={p}' if p > 1 else '')
+                writer.write(url, 200, headers, _page(f'Category {c}', f'<ul>{nav}</ul><main>{cards}</main>{more}'))
+                for i, handle in enumerate(handles):
+                    product_ld = json.dumps({'@context': 'https://schema.org', '@type': 'Product', 'name': handle,
+                                             'offers': {'@type': 'Offer', 'price': '999'}})
+                    related = ''.join(f'<a href="/products/{h}">{h}</a>' for h in handles[i + 1:i + 5])
+                    product_headers = {**headers, 'ETag': f'"{handle}-v1"'} # lets incremental recrawls get 304s
+                    writer.write(f'{root}/products/{handle}', 200, product_headers, _page(handle, (
+                        f'<main><h1>Synthetic Cotton Dress {handle}</h1><span class="price">Rs. 999</span>'
+                        f'<form action="/cart/add" method="post"><button>Add to Bag</button></form>'
+                        f'<script type="application/ld+json">{product_ld}</script></main><aside>{related}</aside>'
+                    )))
+    writer.close()
+    return writer.records
+
+
+def run_crawl(archive, domains, overrides, workdir):
+    settings = get_project_settings()
+    settings.setdict({
+        'DOWNLOAD_HANDLERS': {
+            'http': 'ecom_crawler.replay.ReplayDownloadHandler',
+            'https': 'ecom_crawler.replay.ReplayDownloadHandler',
+        },
+        'REPLAY_ARCHIVE': archive,
+        'DOWNLOAD_DELAY': 0,
+        'AUTOTHROTTLE_ENABLED': False,
+        'GROUPED_OUTPUT_FILE': os.path.join(workdir, 'grouped_products.json'),
+        'GROUPED_OUTPUT_SEGMENT_DIR': os.path.join(workdir, 'segments'),
+        'METRICS_PROMETHEUS_FILE': os.path.join(workdir, 'metrics.prom'),
+        'METRICS_JSON_FILE': os.path.join(workdir, 'metrics.json'),
+        'RENDER_DECISIONS_FILE': '',  # every run learns from scratch
+        'RETRY_ENABLED': False,  # a replayed error comes back the same, retries would only repeat it
+    }, priority='cmdline')
+    settings.setdict(overrides, priority='cmdline')
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler('ecom_product_spider')
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = usage.ru_utime + usage.ru_stime
+    started = time.perf_counter()
+    process.crawl(crawler, domains=','.join(domains))
+    process.start()
+    elapsed = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    stats = crawler.stats.get_stats()
+
+    pages = stats.get('response_received_count', 0)
+    products = stats.get('item_scraped_count', 0)
+    return {
+        'pages': pages,
+        'products': products,
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(pages / elapsed, 2),
+        'products_per_sec': round(products / elapsed, 2),
+        'cpu_ms_per_page': round((usage.ru_utime + usage.ru_stime - cpu_before) * 1000 / max(pages, 1), 3),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),  # ru_maxrss is in KiB on Linux
+        'replay_misses': stats.get('replay/miss', 0),
+        'finish_reason': stats.get('finish_reason'),
+        'settings': {
+            'archive': os.path.basename(archive),
+            'domains': domains,
+            'REPLAY_LATENCY': settings.getfloat('REPLAY_LATENCY'),
+            'REPLAY_JITTER': settings.getfloat('REPLAY_JITTER'),
+            'REPLAY_RENDER_LATENCY': settings.getfloat('REPLAY_RENDER_LATENCY'),
+            **overrides,
+        },
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Returns the list of regressions of result against baseline."""
+    if baseline.get('settings') != result['settings']:
+        print(f"warning: baseline was taken with other settings: {baseline.get('settings')}")
+    regressions = []
+    for name, higher_is_better in METRICS.items():
+        old, new = baseline.get(name), result.get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change < -tolerance if higher_is_better else change > tolerance
+        print(f"{name:<18} {old:>12,.2f} -> {new:>12,.2f}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--archive', help='recorded archive, a synthetic one is generated when missing')
+    parser.add_argument('--domains', default='virgio.com,westside.com')
+    parser.add_argument('--baseline', help=f'compare with this run, e.g. {DEFAULT_BASELINE}')
+    parser.add_argument('--save-baseline', help='write the result to this file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as a regression')
+    parser.add_argument('-s', dest='settings', action='append', default=[], metavar='NAME=VALUE')
+    args = parser.parse_args()
+
+    domains = [d.strip() for d in args.domains.split(',') if d.strip()]
+    overrides = dict(s.split('=', 1) for s in args.settings)
+    with tempfile.TemporaryDirectory() as workdir:
+        archive = args.archive
+        if not archive:
+            archive = os.path.join(workdir, 'synthetic.warc.gz')
+            records = synthetic_archive(archive, domains)
+            print(f'Synthetic archive: {records} records, {os.path.getsize(archive) / 1024:,.0f} KiB')
+        result = run_crawl(archive, domains, overrides, workdir)
+
+    print(json.dumps({k: v for k, v in result.items() if k != 'settings'}, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
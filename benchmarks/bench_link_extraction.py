@@ -0,0 +1,141 @@
+"""
+Benchmark for the spider's link extraction.
+
+Runs the two LinkExtractor rules the spider used to have (kept here verbatim as the
+baseline, links shared between rules counted once like CrawlSpider does) and the single
+pass of PageLinkExtractor over the same pages, checks they find the same links and
+prints pages per second. PageLinkExtractor runs once with a fresh href cache per page
+(every link resolved), then the way the spider uses it, one instance for the whole crawl
+(menu / footer links resolved once), and last with the default follow policies, where
+product pages only lead to related products and next pages.
+
+Run from the repo root:
+    python benchmarks/bench_link_extraction.py [--html-dir DIR] [--rounds N]
+
+DIR should contain saved pages (*.html), their URL is taken as https://<domain>/<file name>
+with --domain (default virgio.com). Without it a synthetic listing and product page are used.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scrapy import Request  # noqa: E402
+from scrapy.http import HtmlResponse  # noqa: E402
+from scrapy.linkextractors import LinkExtractor  # noqa: E402
+
+from ecom_crawler.link_extraction import ALL_KINDS, PAGE, SITEMAP, PageLinkExtractor  # noqa: E402
+
+DENY = (
+    r'/customer/', r'/account/', r'/login', r'/cart', r'/checkout',
+    r'/policy', r'/terms', r'/about', r'/contact', r'/apps/buy/',
+    r'\.jpg$', r'\.png$', r'\.pdf$', r'\.css$', r'\.js$'
+)
+
+
+def old_extractors(domains):
+    return [
+        LinkExtractor(allow_domains=domains, deny=DENY, canonicalize=True, unique=True),
+        LinkExtractor(allow=(r'sitemap.*\.xml',), allow_domains=domains),
+    ]
+
+
+def old_links(extractors, response):
+    seen = set()
+    for extractor in extractors:
+        for link in extractor.extract_links(response):
+            if link not in seen:
+                seen.add(link)
+    return {link.url for link in seen}
+
+
+def new_links(extractor, response):
+    return {link.url for view in (PAGE, SITEMAP) for link in extractor.view(view).extract_links(response)}
+
+
+def _chrome(body):
+    nav = ''.join(f'<li><a href="/collections/cat-{i}">Category {i}</a></li>' for i in range(150))
+    footer = (
+        '<a href="/pages/about-us">About</a><a href="/account/login">Login</a><a href="/cart">Cart</a>'
+        '<a href="/policies/terms-of-service">Terms</a><a href="/sitemap.xml">Sitemap</a>'
+        '<a href="https://www.instagram.com/shop">Instagram</a><a href="mailto:care@example.com">Mail</a>'
+        '<a href="/files/lookbook.pdf">Lookbook</a><a href="javascript:void(0)">Menu</a>'
+    )
+    return (f'<html><head><title>Shop</title></head><body><header><ul>{nav}</ul></header>{body}'
+            f'<footer><ul>{nav}</ul>{footer}</footer></body></html>')
+
+
+def synthetic_pages():
+    cards = ''.join(
+        f'<div class="card"><a href="/collections/dresses/products/item-{i}?variant={i}">'
+        f'<img src="/cdn/item-{i}.jpg"></a><a href="/products/item-{i}">Item {i}</a></div>'
+        for i in range(48)
+    )
+    listing = _chrome(f'<main><h1>Dresses</h1>{cards}<a href="/collections/dresses?page=2">Next</a></main>')
+    related = ''.join(f'<a href="/products/item-{i}">Item {i}</a>' for i in range(12))
+    product = _chrome(f'<main><h1>Cotton Midi Dress</h1><div class="related">{related}</div>'
+                      '<a href="/products/cotton-midi-dress?page=2#reviews">More reviews</a></main>')
+    return [
+        ('synthetic-listing.html', 'https://www.virgio.com/collections/dresses', listing.encode()),
+        ('synthetic-product.html', 'https://www.virgio.com/products/cotton-midi-dress', product.encode()),
+    ]
+
+
+def saved_pages(html_dir, domain):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(html_dir, '*.html'))):
+        with open(path, 'rb') as f:
+            pages.append((os.path.basename(path), f'https://{domain}/' + os.path.basename(path), f.read()))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--html-dir')
+    parser.add_argument('--domain', default='virgio.com')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    pages = saved_pages(args.html_dir, args.domain) if args.html_dir else synthetic_pages()
+    domains = [args.domain]
+    old = old_extractors(domains)
+    follow_all = {page_type: ALL_KINDS for page_type in ('product', 'listing', 'unknown')}
+    # one extractor for the whole run like the spider has, its href cache warms up over the pages of a site
+    one_pass = PageLinkExtractor(domains, DENY, follow_policies=follow_all)
+    with_policies = PageLinkExtractor(domains, DENY)
+
+    def fresh_responses():
+        # new response objects so no side benefits from a cached parse (or from the shared pass)
+        return [HtmlResponse(url, body=body, encoding='utf-8', request=Request(url)) for _, url, body in pages]
+
+    for (name, _, body), response in zip(pages, fresh_responses()):
+        before = old_links(old, response)
+        after = new_links(PageLinkExtractor(domains, DENY, follow_policies=follow_all), response)
+        policy = new_links(PageLinkExtractor(domains, DENY), response)
+        flag = '' if before == after else f'  <-- MISMATCH {sorted(before ^ after)}'
+        print(f'{name:<32} {len(body):>8} bytes  LinkExtractor={len(before)} one pass={len(after)} with policies={len(policy)}{flag}')
+
+    runs = (
+        ('before (2 LinkExtractors)', lambda response: old_links(old, response)),
+        ('after, cold href cache', lambda response: new_links(PageLinkExtractor(domains, DENY, follow_policies=follow_all), response)),
+        ('after (one pass)', lambda response: new_links(one_pass, response)),
+        ('after, follow policies', lambda response: new_links(with_policies, response)),
+    )
+    for label, fn in runs:
+        elapsed = 0.0
+        for _ in range(args.rounds):
+            responses = fresh_responses()
+            for response in responses:
+                response.selector  # parse outside the timed section, the spider has it parsed already
+            start = time.perf_counter()
+            for response in responses:
+                fn(response)
+            elapsed += time.perf_counter() - start
+        print(f'{label:<28} {len(pages) * args.rounds / elapsed:>10,.0f} pages/s')
+
+
+if __name__ == '__main__':
+    main()
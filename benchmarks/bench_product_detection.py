@@ -0,0 +1,162 @@
+"""
+Benchmark for the product page detection engine.
+
+Runs the old is_product_page selector cascade (kept here verbatim as the baseline) and
+ProductDetector over saved HTML pages, checks they agree and prints the time per page.
+
+Run from the repo root:
+    python benchmarks/bench_product_detection.py [--html-dir DIR] [--rounds N]
+
+DIR should contain saved pages (*.html). Without it the storefront fixtures of the tests
+(tests/fixtures/pages, small pages) plus a generated Shopify-like product page and a 48-card
+listing page (full-size chrome) are used. Each page is timed on its own, both detectors
+alternating on freshly parsed responses with the garbage collector off, and the best of
+--rounds runs is kept, so reruns on one machine give the same numbers within a few percent.
+tests/test_product_detection.py pins the verdicts of both detectors on the fixtures.
+"""
+import argparse
+import gc
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scrapy.http import HtmlResponse  # noqa: E402
+
+from ecom_crawler.product_detection import (  # noqa: E402
+    ADD_TO_CART_SELECTORS,
+    PRICE_SELECTORS,
+    PRODUCT_SCHEMA_SELECTOR,
+    ProductDetector,
+)
+
+
+def old_extract_json_ld_product(response):
+    scripts = response.css('script[type="application/ld+json"]::text').getall()
+    for script in scripts:
+        try:
+            data = json.loads(script)
+            if isinstance(data, list):
+                for entry in data:
+                    if isinstance(entry, dict) and entry.get('@type') == 'Product':
+                        return True
+            elif isinstance(data, dict) and data.get('@type') == 'Product':
+                return True
+        except json.JSONDecodeError:
+            continue
+    return False
+
+
+def old_is_product_page(response):
+    if response.css(PRODUCT_SCHEMA_SELECTOR):
+        return True
+    if old_extract_json_ld_product(response):
+        return True
+    for selector in ADD_TO_CART_SELECTORS:
+        if ":contains" in selector:
+            element_text = selector.split(':contains(')[1].strip(')"\'')
+            button_selector = selector.split(':contains(')[0]
+            if response.css(button_selector).xpath(f'.//text()[contains(., "{element_text}")]'):
+                return True
+        elif response.css(selector):
+            return True
+    has_price = False
+    for selector in PRICE_SELECTORS:
+        if response.css(selector):
+            has_price = True
+            break
+    h1_text = response.css('h1::text').get()
+    has_plausible_title = h1_text and len(h1_text.split()) > 1 and len(h1_text.split()) < 15
+    return bool(has_price and has_plausible_title)
+
+
+def _chrome(body):
+    nav = ''.join(f'<li><a href="/collections/cat-{i}">Category {i}</a></li>' for i in range(150))
+    script = '<script>window.__STATE__ = %s;</script>' % json.dumps({'k%d' % i: 'v' * 40 for i in range(3000)})
+    org = json.dumps({'@context': 'https://schema.org', '@type': 'Organization', 'name': 'Shop',
+                      'sameAs': ['https://social.example/%d' % i for i in range(200)]})
+    return (f'<html><head><title>Shop</title>{script}'
+            f'<script type="application/ld+json">{org}</script></head>'
+            f'<body><header><ul>{nav}</ul></header>{body}<footer>{nav}</footer></body></html>')
+
+
+def synthetic_pages():
+    product_ld = json.dumps({'@context': 'https://schema.org', '@type': 'Product', 'name': 'Cotton Midi Dress',
+                             'offers': {'@type': 'Offer', 'price': '1999'}})
+    product = _chrome(
+        '<main><h1>Cotton Midi Dress With Belt</h1>'
+        '<div class="product__price"><span class="price-item">Rs. 1,999</span></div>'
+        '<form action="/cart/add" method="post"><button type="submit">Add to Bag</button></form>'
+        f'<script type="application/ld+json">{product_ld}</script></main>'
+    )
+    cards = ''.join(
+        f'<div class="card"><a href="/products/item-{i}">Item {i}</a><span class="price">Rs. {i}99</span></div>'
+        for i in range(48)
+    )
+    listing = _chrome(f'<main><h1>Dresses</h1><div class="grid">{cards}</div></main>')
+    return [
+        ('synthetic-product.html', 'https://www.virgio.com/products/cotton-midi-dress', product.encode()),
+        ('synthetic-listing.html', 'https://www.virgio.com/collections/dresses', listing.encode()),
+    ]
+
+
+def saved_pages(html_dir):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(html_dir, '*.html'))):
+        with open(path, 'rb') as f:
+            pages.append((os.path.basename(path), 'https://example.com/' + os.path.basename(path), f.read()))
+    return pages
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'pages')
+
+
+def best_times(functions, pages, rounds):
+    """Best seconds per call of every function on every page over rounds: {function: [seconds per page]}."""
+    best = {fn: [float('inf')] * len(pages) for fn in functions}
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            for i, (_, url, body) in enumerate(pages):
+                for fn in functions:
+                    # a new parsed response per call so no side benefits from the other's work
+                    response = HtmlResponse(url, body=body, encoding='utf-8')
+                    response.selector
+                    start = time.perf_counter()
+                    fn(response)
+                    best[fn][i] = min(best[fn][i], time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--html-dir')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    pages = saved_pages(args.html_dir) if args.html_dir else saved_pages(FIXTURES_DIR) + synthetic_pages()
+    detector = ProductDetector()
+    best = best_times((old_is_product_page, detector.detect), pages, args.rounds)
+
+    print(f"{'page':<36} {'bytes':>8}  {'old':<5} {'new':<5} {'old us':>8} {'new us':>8} {'speedup':>8}")
+    for i, (name, url, body) in enumerate(pages):
+        response = HtmlResponse(url, body=body, encoding='utf-8')
+        old = old_is_product_page(response)
+        verdict = detector.detect(response)
+        flag = '' if old == bool(verdict) else '  <-- MISMATCH'
+        old_us, new_us = best[old_is_product_page][i] * 1e6, best[detector.detect][i] * 1e6
+        print(f'{name:<36} {len(body):>8}  {old!s:<5} {bool(verdict)!s:<5} {old_us:>8.1f} {new_us:>8.1f} {old_us / new_us:>7.2f}x{flag}')
+
+    for label, fn in (('before (selector cascade)', old_is_product_page), ('after (one XPath union)', detector.detect)):
+        print(f'{label:<28} {len(pages) / sum(best[fn]):>10,.0f} pages/s (best of {args.rounds})')
+
+
+if __name__ == '__main__':
+    main()
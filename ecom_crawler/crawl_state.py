@@ -0,0 +1,166 @@
+import sqlite3
+import time
+
+PENDING = 0
+DONE = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    domain TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (domain, url)
+);
+CREATE TABLE IF NOT EXISTS collections (
+    url TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    url TEXT NOT NULL,
+    callback TEXT NOT NULL,
+    playwright INTEGER NOT NULL DEFAULT 0,
+    state INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (url, callback)
+);
+CREATE INDEX IF NOT EXISTS frontier_pending ON frontier (state);
+"""
+
+
+class CrawlState:
+    """
+    Disk-backed crawl state (SQLite, WAL journal) that lets a crawl resume after a restart.
+
+    Holds the products already found, the collection pages already rendered and the
+    frontier of scheduled requests with their pending / done state. Known sets are only
+    read from disk the first time they are used, writes go through immediately but are
+    committed in batches (every commit_every writes or commit_interval seconds).
+    """
+
+    def __init__(self, path, commit_every=1000, commit_interval=5.0):
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def _wrote(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    # --- products / collections ---
+
+    def iter_products(self, domain):
+        for (url,) in self.db.execute('SELECT url FROM products WHERE domain = ?', (domain,)):
+            yield url
+
+    def add_product(self, domain, url):
+        self.db.execute('INSERT OR IGNORE INTO products (domain, url) VALUES (?, ?)', (domain, url))
+        self._wrote()
+
+    def iter_collections(self):
+        for (url,) in self.db.execute('SELECT url FROM collections'):
+            yield url
+
+    def add_collection(self, url):
+        self.db.execute('INSERT OR IGNORE INTO collections (url) VALUES (?)', (url,))
+        self._wrote()
+
+    def product_set(self, domain, items=None):
+        return PersistentSet(lambda: self.iter_products(domain), lambda url: self.add_product(domain, url), items)
+
+    def collection_set(self, items=None):
+        return PersistentSet(self.iter_collections, self.add_collection, items)
+
+    # --- frontier ---
+
+    def add_request(self, url, callback, playwright=False):
+        self.db.execute(
+            'INSERT OR IGNORE INTO frontier (url, callback, playwright, state) VALUES (?, ?, ?, ?)',
+            (url, callback, int(bool(playwright)), PENDING),
+        )
+        self._wrote()
+
+    def mark_done(self, url, callback=None):
+        if callback is None:
+            self.db.execute('UPDATE frontier SET state = ? WHERE url = ?', (DONE, url))
+        else:
+            self.db.execute('UPDATE frontier SET state = ? WHERE url = ? AND callback = ?', (DONE, url, callback))
+        self._wrote()
+
+    def is_done(self, url, callback):
+        row = self.db.execute(
+            'SELECT 1 FROM frontier WHERE url = ? AND callback = ? AND state = ?', (url, callback, DONE)
+        ).fetchone()
+        return row is not None
+
+    def pending_requests(self, batch_size=1000):
+        """Yields (url, callback, playwright) of the saved frontier, in batches so the table can change meanwhile."""
+        last_rowid = 0
+        while True:
+            rows = self.db.execute(
+                'SELECT rowid, url, callback, playwright FROM frontier WHERE state = ? AND rowid > ? ORDER BY rowid LIMIT ?',
+                (PENDING, last_rowid, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            for rowid, url, callback, playwright in rows:
+                last_rowid = rowid
+                yield url, callback, bool(playwright)
+
+    def is_empty(self):
+        """True for a new state file: nothing to resume from."""
+        for table in ('products', 'collections', 'frontier'):
+            if self.db.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is not None:
+                return False
+        return True
+
+    def counts(self):
+        products = self.db.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        pending = self.db.execute('SELECT COUNT(*) FROM frontier WHERE state = ?', (PENDING,)).fetchone()[0]
+        return products, pending
+
+
+class PersistentSet:
+    """
+    Set of strings mirrored to a CrawlState table. The saved content is loaded on first
+    use into items (a plain set by default, or any set-like such as a dedup FingerprintSet),
+    adds are written through to the state.
+    """
+
+    def __init__(self, load, persist, items=None):
+        self._load = load
+        self._persist = persist
+        self._target = set() if items is None else items
+        self._items = None
+
+    def _ensure_loaded(self):
+        if self._items is None:
+            for value in self._load():
+                self._target.add(value)
+            self._items = self._target
+        return self._items
+
+    def __contains__(self, value):
+        return value in self._ensure_loaded()
+
+    def __len__(self):
+        return len(self._ensure_loaded())
+
+    def add(self, value):
+        items = self._ensure_loaded()
+        if value not in items:
+            items.add(value)
+            self._persist(value)
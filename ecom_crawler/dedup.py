@@ -0,0 +1,192 @@
+import math
+from array import array
+from hashlib import blake2b
+
+EXACT = 'exact'
+BLOOM = 'bloom'
+
+_MASK64 = (1 << 64) - 1
+
+
+def fingerprint(url):
+    """64-bit fingerprint of a URL (never 0, that is the empty slot marker)."""
+    return int.from_bytes(blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+
+class FingerprintSet:
+    """
+    Exact set of URLs stored as 64-bit fingerprints in one array('Q') hash table
+    (open addressing, linear probing), 8 bytes per slot instead of a full string and a
+    set entry per URL. Two different URLs sharing a fingerprint are counted once,
+    at 64 bits that takes billions of URLs per set to become likely.
+    """
+
+    def __init__(self, capacity=1024, max_load=0.75):
+        self.max_load = max_load
+        size = 8
+        while size * max_load < capacity:
+            size <<= 1
+        self._slots = array('Q', [0]) * size
+        self._mask = size - 1
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, url):
+        return self.contains_fingerprint(fingerprint(url))
+
+    def add(self, url):
+        """Adds url, returns True if it wasn't in the set yet."""
+        return self.add_fingerprint(fingerprint(url))
+
+    def contains_fingerprint(self, fp):
+        slots, mask = self._slots, self._mask
+        i = fp & mask
+        while True:
+            current = slots[i]
+            if current == fp:
+                return True
+            if current == 0:
+                return False
+            i = (i + 1) & mask
+
+    def add_fingerprint(self, fp):
+        if (self._count + 1) > len(self._slots) * self.max_load:
+            self._grow()
+        if _insert(self._slots, self._mask, fp):
+            self._count += 1
+            return True
+        return False
+
+    def _grow(self):
+        old = self._slots
+        self._slots = array('Q', [0]) * (len(old) * 2)
+        self._mask = len(self._slots) - 1
+        for fp in old:
+            if fp:
+                _insert(self._slots, self._mask, fp)
+
+    def memory_bytes(self):
+        return len(self._slots) * self._slots.itemsize
+
+
+def _insert(slots, mask, fp):
+    i = fp & mask
+    while True:
+        current = slots[i]
+        if current == 0:
+            slots[i] = fp
+            return True
+        if current == fp:
+            return False
+        i = (i + 1) & mask
+
+
+class BloomFilter:
+    """
+    Probabilistic URL set sized up front for capacity entries at error_rate false positives
+    (about 1.2 bytes per URL at 0.1%). Never forgets a URL, but may claim an unseen one was
+    seen, so it trades a few skipped URLs for a fixed memory ceiling. Past capacity the
+    false-positive rate climbs.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, url):
+        return self.contains_fingerprint(fingerprint(url))
+
+    def add(self, url):
+        return self.add_fingerprint(fingerprint(url))
+
+    def _positions(self, fp):
+        # double hashing: bit i is h1 + i * h2, both halves of the 64-bit fingerprint
+        h1, h2 = fp & 0xffffffff, (fp >> 32) | 1
+        num_bits = self.num_bits
+        return [((h1 + i * h2) & _MASK64) % num_bits for i in range(self.num_hashes)]
+
+    def contains_fingerprint(self, fp):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fp))
+
+    def add_fingerprint(self, fp):
+        bits = self._bits
+        new = False
+        for pos in self._positions(fp):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self._count += 1
+        return new
+
+    def memory_bytes(self):
+        return len(self._bits)
+
+
+class DedupStore:
+    """
+    Named URL sets (one per domain, plus e.g. 'collections') backed by fingerprints.
+
+    mode is 'exact' (FingerprintSet, grows as needed) or 'bloom' (BloomFilter, fixed size
+    of capacity entries per set at error_rate). Reports its memory use into the crawl stats.
+    """
+
+    def __init__(self, mode=EXACT, capacity=100000, error_rate=0.001):
+        if mode not in (EXACT, BLOOM):
+            raise ValueError(f"Unknown dedup mode {mode!r}, use '{EXACT}' or '{BLOOM}'")
+        self.mode = mode
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sets = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            mode=settings.get('DEDUP_MODE', EXACT),
+            capacity=settings.getint('DEDUP_CAPACITY', 100000),
+            error_rate=settings.getfloat('DEDUP_ERROR_RATE', 0.001),
+        )
+
+    def new_set(self, scale=1):
+        """scale: entries per URL of a domain the set holds (e.g. 2 for raw + normalized URLs)."""
+        if self.mode == BLOOM:
+            return BloomFilter(self.capacity * scale, self.error_rate)
+        # exact sets start small, they double on their own
+        return FingerprintSet(min(self.capacity * scale, 1024))
+
+    def get(self, name, scale=1):
+        urls = self.sets.get(name)
+        if urls is None:
+            urls = self.sets[name] = self.new_set(scale)
+        return urls
+
+    def add(self, name, url):
+        return self.get(name).add(url)
+
+    def seen(self, name, url):
+        urls = self.sets.get(name)
+        return urls is not None and url in urls
+
+    def memory_bytes(self):
+        return sum(urls.memory_bytes() for urls in self.sets.values())
+
+    def report(self, stats, prefix='dedup'):
+        stats.set_value(f'{prefix}/mode', self.mode)
+        stats.set_value(f'{prefix}/entries', sum(len(urls) for urls in self.sets.values()))
+        stats.set_value(f'{prefix}/memory_bytes', self.memory_bytes())
+        for name, urls in self.sets.items():
+            stats.set_value(f'{prefix}/{name}/entries', len(urls))
+            if isinstance(urls, BloomFilter) and len(urls) > urls.capacity:
+                # past capacity the false-positive rate climbs, new URLs start being taken for seen ones
+                stats.set_value(f'{prefix}/{name}/over_capacity', len(urls) - urls.capacity)
@@ -0,0 +1,89 @@
+import re
+
+from ecom_crawler.dedup import FingerprintSet
+from ecom_crawler.url_classifier import LISTING, PRODUCT, UNKNOWN, classify_url, url_domain
+
+# ?page=2, &p=3, /page/4 ... paginated listings rank with listings even when no listing pattern matches
+_PAGINATION = re.compile(r'[?&](?:page|p|pg|pageno|start|offset)=\d+|/page/\d+', re.IGNORECASE)
+
+DEFAULT_PRIORITIES = {PRODUCT: 100, LISTING: 50, UNKNOWN: 0}
+
+
+def is_pagination(url):
+    return _PAGINATION.search(url) is not None
+
+
+def url_kind(url):
+    kind = classify_url(url).kind
+    if kind == UNKNOWN and is_pagination(url):
+        return LISTING
+    return kind
+
+
+class FrontierScorer:
+    """
+    Scrapy priority for extracted requests: product URLs first, then listings / pagination,
+    then everything else, adjusted by live yield feedback.
+
+    For every (domain, kind) the scorer counts pages fetched and the ones that paid off: a
+    product page, or the page that linked to a product (its Referer, typically a listing). It
+    adds yield_weight * (smoothed share of pages that paid off) to the base priority, so a kind
+    of URL that keeps paying off on a site climbs while a barren one stays at its base. Deeper
+    pages lose depth_penalty per level. An optional per-domain budget caps how many requests
+    a domain may schedule. Fairness across domains comes from the downloader-aware priority
+    queue (see SCHEDULER_PRIORITY_QUEUE), which round-robins over domains.
+    """
+
+    def __init__(self, priorities=None, yield_weight=50, depth_penalty=1, domain_budget=0):
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+        self.yield_weight = yield_weight
+        self.depth_penalty = depth_penalty
+        self.domain_budget = domain_budget
+        self.fetched = {} # (domain, kind) -> pages fetched
+        self.products = {} # (domain, kind) -> pages that were or led to a product
+        self.credited = FingerprintSet() # those pages, each one counts once
+        self.scheduled = {} # domain -> requests scheduled
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            priorities=settings.getdict('FRONTIER_PRIORITIES'),
+            yield_weight=settings.getfloat('FRONTIER_YIELD_WEIGHT', 50),
+            depth_penalty=settings.getfloat('FRONTIER_DEPTH_PENALTY', 1),
+            domain_budget=settings.getint('FRONTIER_DOMAIN_BUDGET', 0),
+        )
+
+    def yield_rate(self, domain, kind):
+        # Laplace smoothed so a handful of pages can't swing it to 0 or 1
+        return (self.products.get((domain, kind), 0) + 1) / (self.fetched.get((domain, kind), 0) + 2)
+
+    def score(self, url, depth=0):
+        """Returns (kind, priority) of a URL."""
+        kind = url_kind(url)
+        priority = self.priorities.get(kind, 0) + self.yield_weight * self.yield_rate(url_domain(url), kind)
+        return kind, int(round(priority - self.depth_penalty * depth))
+
+    def admit(self, url):
+        """Counts a request against its domain budget, False once the budget is spent."""
+        domain = url_domain(url)
+        scheduled = self.scheduled.get(domain, 0)
+        if self.domain_budget and scheduled >= self.domain_budget:
+            return False
+        self.scheduled[domain] = scheduled + 1
+        return True
+
+    def record_fetch(self, url):
+        key = (url_domain(url), url_kind(url))
+        self.fetched[key] = self.fetched.get(key, 0) + 1
+
+    def record_product(self, url, referrer=None):
+        """Counts a product found on the page at url, and credits the page that linked to it."""
+        self._credit(url)
+        if referrer:
+            self._credit(referrer)
+
+    def _credit(self, url):
+        if not self.credited.add(url):
+            return
+        key = (url_domain(url), url_kind(url))
+        self.products[key] = self.products.get(key, 0) + 1
@@ -0,0 +1,89 @@
+import json
+import re
+import weakref
+
+PRODUCT_TYPES = ('Product', 'ProductGroup')
+
+# "@type": "Product", "@type": ["Product", ...], "@type": "https://schema.org/ProductGroup"
+# (slashes may be escaped in JSON). Only scripts matching this are ever handed to json.loads
+_TYPE_TOKEN = r'"@type"\s*:\s*(?:\[[^\]]*?)?"(?:https?:\\?/\\?/schema\.org\\?/)?(?:Product|ProductGroup)"'
+PRODUCT_TOKEN = re.compile(_TYPE_TOKEN)
+PRODUCT_TOKEN_BYTES = re.compile(_TYPE_TOKEN.encode('ascii'))
+
+JSON_LD_SCRIPTS_XPATH = '//script[@type="application/ld+json"]/text()'
+
+# Encodings where an ASCII token can't be searched for in the raw body
+_WIDE_ENCODINGS = ('utf16', 'utf32', 'utf_16', 'utf_32')
+
+_products_by_response = weakref.WeakKeyDictionary()
+
+
+def is_product_type(value):
+    """Accepts '@type' values given as a string or a list, bare or as a schema.org URL."""
+    values = value if isinstance(value, list) else [value]
+    for v in values:
+        if isinstance(v, str) and v.rsplit('/', 1)[-1] in PRODUCT_TYPES:
+            return True
+    return False
+
+
+def find_product(data):
+    """Returns the first Product / ProductGroup node in decoded JSON-LD, looking into lists and @graph."""
+    stack = [data]
+    while stack:
+        node = stack.pop(0)
+        if isinstance(node, list):
+            stack[0:0] = node
+        elif isinstance(node, dict):
+            if is_product_type(node.get('@type')):
+                return node
+            graph = node.get('@graph')
+            if isinstance(graph, (list, dict)):
+                stack.insert(0, graph)
+    return None
+
+
+def sniff_product(scripts):
+    """
+    Returns the first Product found in a list of JSON-LD script texts, or None.
+    Scripts without a Product type token are skipped without being decoded.
+    """
+    for script in scripts:
+        if not script or not PRODUCT_TOKEN.search(script):
+            continue
+        try:
+            data = json.loads(script)
+        except ValueError:
+            continue
+        product = find_product(data)
+        if product is not None:
+            return product
+    return None
+
+
+def body_may_contain_product(response):
+    encoding = (getattr(response, 'encoding', None) or '').lower().replace('-', '')
+    if encoding.startswith(_WIDE_ENCODINGS):
+        return True
+    return PRODUCT_TOKEN_BYTES.search(response.body) is not None
+
+
+def json_ld_product(response, scripts=None):
+    """
+    Product JSON-LD entry of a response (or None), memoized per response object.
+
+    When the caller already pulled the JSON-LD texts out of the tree they are passed
+    as scripts and only those are scanned. Otherwise the raw body is scanned for a
+    Product type token first, and pages without one never have their scripts extracted.
+    """
+    try:
+        return _products_by_response[response]
+    except KeyError:
+        pass
+    product = None
+    if scripts is None and body_may_contain_product(response):
+        scripts = response.xpath(JSON_LD_SCRIPTS_XPATH).getall()
+    if scripts:
+        product = sniff_product(scripts)
+    _products_by_response[response] = product
+    return product
@@ -0,0 +1,191 @@
+import time
+
+from scrapy import signals
+from scrapy.core.downloader import Slot
+from scrapy.exceptions import NotConfigured
+
+from ecom_crawler.url_classifier import url_domain
+
+HTTP = 'http'
+BROWSER = 'browser'
+
+# lane -> limits, see DOWNLOAD_LANES in settings.py. The http lane's concurrency and target_concurrency
+# default to CONCURRENT_REQUESTS_PER_DOMAIN and AUTOTHROTTLE_TARGET_CONCURRENCY
+DEFAULT_LANES = {
+    HTTP: {'target_latency': 3.0},
+    BROWSER: {'concurrency': 2, 'target_concurrency': 2.0, 'target_latency': 20.0},
+}
+
+_LATENCY_WEIGHT = 0.3 # weight of the newest response in a slot's average latency
+
+
+def lane_of(request):
+    return BROWSER if request.meta.get('playwright') else HTTP
+
+
+def lane_slot_key(request):
+    # virgio.com:http / virgio.com:browser
+    return f'{url_domain(request.url)}:{lane_of(request)}'
+
+
+class Lane:
+    def __init__(self, name, concurrency, target_concurrency=None, target_latency=None, start_delay=1.0, min_delay=0.0, max_delay=30.0):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.target_concurrency = float(target_concurrency or concurrency)
+        self.target_latency = target_latency
+        self.start_delay = max(min_delay, start_delay)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+
+class _LaneState:
+    """What a lane slot has learnt, kept when Scrapy garbage-collects the idle downloader slot."""
+
+    def __init__(self, lane, delay):
+        self.lane = lane
+        self.concurrency = lane.concurrency
+        self.delay = delay
+        self.latency = None # moving average of the download latency
+        self.adjusted = 0.0 # last concurrency change (monotonic)
+
+
+class DownloadLaneMiddleware:
+    """
+    Splits every domain's downloads into two lanes with their own downloader slot:
+    '<domain>:http' for plain fetches and '<domain>:browser' for Playwright renders. Each lane
+    has its own concurrency (DOWNLOAD_LANES), so renders that take seconds can't hold the
+    slots plain product pages go through, and DownloaderAwarePriorityQueue balances between
+    the lane slots like it does between domains.
+
+    The slot is picked when the request is scheduled (request_scheduled signal), so the
+    scheduler queues and the downloader agree on it. Requests with a download_slot of their
+    own are left alone.
+
+    With AUTOTHROTTLE_ENABLED, the lanes replace AutoThrottle for their slots. The delay
+    follows AutoThrottle's rule with the lane's target_concurrency. The concurrency is halved
+    when the slot's average latency goes over the lane's target_latency and grows back by one
+    when it's under it again, at most once per round trip. The state of every slot goes in the
+    crawl stats under lanes/.
+    """
+
+    def __init__(self, crawler, lanes, throttle=True):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.lanes = lanes
+        self.throttle = throttle
+        self.randomize_delay = crawler.settings.getbool('RANDOMIZE_DOWNLOAD_DELAY')
+        self.states = {} # slot key -> _LaneState
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DOWNLOAD_LANES_ENABLED', True):
+            raise NotConfigured
+        throttle = settings.getbool('AUTOTHROTTLE_ENABLED')
+        min_delay = settings.getfloat('DOWNLOAD_DELAY')
+        defaults = {
+            'start_delay': settings.getfloat('AUTOTHROTTLE_START_DELAY') if throttle else min_delay,
+            'min_delay': min_delay,
+            'max_delay': settings.getfloat('AUTOTHROTTLE_MAX_DELAY'),
+        }
+        lane_defaults = {
+            HTTP: {
+                'concurrency': settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'),
+                'target_concurrency': settings.getfloat('AUTOTHROTTLE_TARGET_CONCURRENCY'),
+            },
+            BROWSER: {},
+        }
+        overrides = settings.getdict('DOWNLOAD_LANES')
+        lanes = {}
+        for name in (HTTP, BROWSER):
+            lanes[name] = Lane(name, **{**defaults, **lane_defaults[name], **DEFAULT_LANES[name], **(overrides.get(name) or {})})
+        mw = cls(crawler, lanes, throttle)
+        crawler.signals.connect(mw.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(mw.response_downloaded, signal=signals.response_downloaded)
+        return mw
+
+    def assign(self, request):
+        slot = request.meta.get('download_slot')
+        if slot is not None and slot != request.meta.get('lane_slot'):
+            return # someone else's slot
+        # recomputed every time: redirects and request.replace() copies keep the meta of the original
+        key = lane_slot_key(request)
+        request.meta['download_slot'] = request.meta['lane_slot'] = key
+        if self.throttle:
+            request.meta['autothrottle_dont_adjust_delay'] = True
+
+    def request_scheduled(self, request, spider):
+        self.assign(request)
+
+    def process_request(self, request, spider):
+        # requests downloaded without being scheduled (robots.txt) get their lane here
+        self.assign(request)
+        key = request.meta.get('lane_slot')
+        if key is None or request.meta.get('download_slot') != key:
+            return None
+        state = self._state(key, request)
+        slots = self.crawler.engine.downloader.slots
+        if key not in slots:
+            slots[key] = Slot(state.concurrency, state.delay, self.randomize_delay)
+        return None
+
+    def _state(self, key, request):
+        state = self.states.get(key)
+        if state is None:
+            lane = self.lanes[lane_of(request)]
+            state = self.states[key] = _LaneState(lane, lane.start_delay)
+            self._report(key, state)
+        return state
+
+    def response_downloaded(self, response, request, spider):
+        key = request.meta.get('lane_slot')
+        latency = request.meta.get('download_latency')
+        if key is None or request.meta.get('download_slot') != key or latency is None:
+            return
+        state = self._state(key, request)
+        self.stats.inc_value(f'lanes/{state.lane.name}/responses')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            # downloads of the slot in progress, this one included (slot.active counts queued requests too)
+            self.stats.max_value(f'lanes/{key}/max_transferring', len(slot.transferring))
+        if not self.throttle:
+            return
+        if state.latency is None:
+            state.latency = latency
+        else:
+            state.latency += _LATENCY_WEIGHT * (latency - state.latency)
+        self._adjust_delay(state, latency, response)
+        self._adjust_concurrency(state)
+        if slot is not None:
+            slot.delay = state.delay
+            slot.concurrency = state.concurrency
+        self._report(key, state)
+
+    def _adjust_delay(self, state, latency, response):
+        # AutoThrottle's rule: one request every latency / N seconds keeps N of them in flight
+        lane = state.lane
+        target_delay = latency / lane.target_concurrency
+        new_delay = max(target_delay, (state.delay + target_delay) / 2.0)
+        new_delay = min(max(lane.min_delay, new_delay), lane.max_delay)
+        if response.status != 200 and new_delay <= state.delay:
+            return # error pages and redirects are small, they would pull the delay down
+        state.delay = new_delay
+
+    def _adjust_concurrency(self, state):
+        lane = state.lane
+        now = time.monotonic()
+        if not lane.target_latency or now - state.adjusted < state.latency:
+            return
+        if state.latency > lane.target_latency and state.concurrency > 1:
+            state.concurrency = max(1, state.concurrency // 2)
+            state.adjusted = now
+        elif state.latency < lane.target_latency and state.concurrency < lane.concurrency:
+            state.concurrency += 1
+            state.adjusted = now
+
+    def _report(self, key, state):
+        self.stats.set_value(f'lanes/{key}/concurrency', state.concurrency)
+        self.stats.set_value(f'lanes/{key}/delay_ms', int(state.delay * 1000))
+        if state.latency is not None:
+            self.stats.set_value(f'lanes/{key}/latency_ms', int(state.latency * 1000))
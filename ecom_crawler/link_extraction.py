@@ -0,0 +1,162 @@
+import re
+from urllib.parse import urljoin
+from weakref import WeakKeyDictionary
+
+from scrapy.link import Link
+from scrapy.linkextractors import IGNORED_EXTENSIONS
+from scrapy.utils.response import get_base_url
+from w3lib.html import strip_html5_whitespace
+from w3lib.url import canonicalize_url, safe_url_string
+
+from ecom_crawler.frontier import is_pagination, url_kind
+from ecom_crawler.url_classifier import LISTING, PRODUCT, UNKNOWN, url_domain
+
+PAGE = 'page'
+SITEMAP = 'sitemap'
+
+PAGINATION = 'pagination'
+ALL_KINDS = frozenset([PRODUCT, LISTING, UNKNOWN])
+
+SITEMAP_PATTERNS = (r'sitemap.*\.xml',)
+
+# page type -> link kinds followed from it (product / listing / unknown, or pagination alone)
+DEFAULT_FOLLOW_POLICIES = {
+    PRODUCT: [PRODUCT, PAGINATION], # related products and the next page, not the whole menu again
+    LISTING: [PRODUCT, LISTING, UNKNOWN],
+    UNKNOWN: [PRODUCT, LISTING, UNKNOWN],
+}
+
+
+class LinkMatcher:
+    """
+    Decides with precompiled regexes what a link is: SITEMAP, PAGE or None (dropped).
+
+    Links must be http(s) and on one of the domains (or a subdomain). Sitemap links are
+    recognized before the deny patterns apply, everything else is dropped when it matches
+    a deny pattern or ends with one of the ignored file extensions (LinkExtractor's list),
+    which share a single regex search.
+    """
+
+    def __init__(self, allow_domains, deny=(), sitemap=SITEMAP_PATTERNS, deny_extensions=IGNORED_EXTENSIONS):
+        domains = '|'.join(re.escape(d.lower()) for d in allow_domains)
+        self.domain_re = re.compile(rf'(?:^|\.)(?:{domains})$') if domains else None
+        self.sitemap_re = re.compile('|'.join(f'(?:{p})' for p in sitemap)) if sitemap else None
+        rejects = [f'(?:{p})' for p in deny]
+        extensions = [re.escape(e) for e in deny_extensions if '.' not in e]
+        if extensions:
+            rejects.append(r'(?i:^[a-z]+://[^/?#]+/[^?#]*\.(?:%s)(?:[?#]|$))' % '|'.join(extensions))
+        self.reject_re = re.compile('|'.join(rejects)) if rejects else None
+
+    def match(self, url):
+        if not url.startswith(('http://', 'https://')):
+            return None
+        if self.domain_re is not None and self.domain_re.search(url_domain(url)) is None:
+            return None
+        if self.sitemap_re is not None and self.sitemap_re.search(url):
+            return SITEMAP
+        if self.reject_re is not None and self.reject_re.search(url):
+            return None
+        return PAGE
+
+
+class PageLinkExtractor:
+    """
+    One pass over the <a>/<area> hrefs of a page (on the lxml tree the response already
+    parsed), split by LinkMatcher into the link lists the crawl rules follow. The pass runs
+    once per response and is shared by every view(), so each Rule gets its slice of it.
+
+    Links are canonicalized and unique, like LinkExtractor(canonicalize=True, unique=True),
+    without the anchor text. Page links are then filtered by the follow policy of the page
+    type: response.meta['page_type'] when the callback set it, else the kind of its URL.
+    """
+
+    def __init__(self, allow_domains, deny=(), sitemap=SITEMAP_PATTERNS, follow_policies=None, cache_size=100000):
+        self.matcher = LinkMatcher(allow_domains, deny, sitemap)
+        self.use_follow_policies(follow_policies)
+        self.cache_size = cache_size
+        self._pages = WeakKeyDictionary() # response -> {PAGE: [...], SITEMAP: [...]}
+        # (absolute href, encoding) -> (category, canonical url): menus and footers repeat on every page of a site,
+        # their links are resolved, matched and canonicalized once
+        self._resolved = {}
+
+    def use_follow_policies(self, follow_policies=None):
+        """Page type -> link kinds, on top of DEFAULT_FOLLOW_POLICIES (see LINK_FOLLOW_POLICIES in settings.py)."""
+        self.follow_policies = {}
+        for page_type, kinds in {**DEFAULT_FOLLOW_POLICIES, **(follow_policies or {})}.items():
+            self.follow_policies[page_type] = frozenset(kinds)
+
+    def view(self, category):
+        return LinkView(self, category)
+
+    def page_links(self, response):
+        links = self._pages.get(response)
+        if links is None:
+            links = self._pages[response] = self._extract(response)
+        return links
+
+    def _extract(self, response):
+        links = {PAGE: [], SITEMAP: []}
+        root = getattr(getattr(response, 'selector', None), 'root', None)
+        if root is None or not hasattr(root, 'iter'):
+            return links
+        base_url = get_base_url(response)
+        origin = '/'.join(base_url.split('/', 3)[:3]) # https://www.virgio.com
+        encoding = response.encoding
+        resolved = self._resolved
+        if len(resolved) > self.cache_size:
+            resolved.clear()
+        seen_hrefs = set()
+        seen_urls = set()
+        for el in root.iter('a', 'area'):
+            href = el.get('href')
+            if not href or href in seen_hrefs:
+                continue
+            seen_hrefs.add(href)
+            href = strip_html5_whitespace(href)
+            if href.startswith(('http://', 'https://')):
+                key = (href, encoding)
+            elif href.startswith('/') and not href.startswith('//'):
+                key = (origin + href, encoding)
+            else: # relative to the page, or protocol-relative
+                key = (base_url, href, encoding)
+            found = resolved.get(key)
+            if found is None:
+                found = resolved[key] = self._resolve(base_url, href, encoding)
+            category, url = found
+            if category is not None and url not in seen_urls:
+                seen_urls.add(url)
+                links[category].append(url)
+        return links
+
+    def _resolve(self, base_url, href, encoding):
+        try:
+            url = safe_url_string(urljoin(base_url, href), encoding=encoding)
+        except ValueError:
+            return None, None # bogus link
+        category = self.matcher.match(url)
+        if category is None:
+            return None, None
+        return category, canonicalize_url(url)
+
+    def follow_kinds(self, response):
+        page_type = response.meta.get('page_type') or url_kind(response.url)
+        return self.follow_policies.get(page_type, ALL_KINDS)
+
+    def extract_links(self, response, category):
+        urls = self.page_links(response)[category]
+        if category == PAGE:
+            kinds = self.follow_kinds(response)
+            if not ALL_KINDS <= kinds:
+                urls = [url for url in urls if url_kind(url) in kinds or (PAGINATION in kinds and is_pagination(url))]
+        return [Link(url) for url in urls]
+
+
+class LinkView:
+    """The link_extractor of one crawl Rule: its category of the page's shared link pass."""
+
+    def __init__(self, extractor, category):
+        self.extractor = extractor
+        self.category = category
+
+    def extract_links(self, response):
+        return self.extractor.extract_links(response, self.category)
@@ -0,0 +1,160 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+PHASE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+PREFIX = 'ecom_'
+
+
+class Histogram:
+    """Fixed-bucket histogram, counts are kept per bucket and made cumulative on export."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield le, total
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class CrawlMetrics:
+    """
+    In-process counters and histograms of the crawl, cheap enough to stay on: recording is a
+    dict lookup and an add. Exported as a Prometheus text file and a JSON snapshot
+    (see EcomCrawlerSpiderMiddleware for the periodic export).
+
+    One instance per crawler, shared by the middlewares and the spider through for_crawler().
+    """
+
+    def __init__(self):
+        self.counters = {} # name -> {labels key: value}
+        self.histograms = {} # name -> {labels key: Histogram}
+        self.histogram_buckets = {}
+        self.started = time.time()
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        metrics = getattr(crawler, 'crawl_metrics', None)
+        if metrics is None:
+            metrics = crawler.crawl_metrics = cls()
+        return metrics
+
+    def inc(self, name, value=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=PHASE_BUCKETS, **labels):
+        series = self.histograms.get(name)
+        if series is None:
+            series = self.histograms[name] = {}
+            self.histogram_buckets[name] = buckets
+        key = _labels_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self.histogram_buckets[name])
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name, **labels):
+        return self.counters.get(name, {}).get(_labels_key(labels), 0)
+
+    def product_yield(self):
+        """Products per response, per domain."""
+        responses = self.counters.get('responses', {})
+        products = self.counters.get('products', {})
+        return {dict(key).get('domain'): products.get(key, 0) / count for key, count in responses.items() if count}
+
+    def to_prometheus(self, stats=None):
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f'# TYPE {PREFIX}{name}_total counter')
+            for key, value in sorted(series.items()):
+                lines.append(f'{PREFIX}{name}_total{_format_labels(key)} {value}')
+        lines.append(f'# TYPE {PREFIX}product_yield gauge')
+        for domain, value in sorted(self.product_yield().items()):
+            lines.append(f'{PREFIX}product_yield{_format_labels((("domain", domain),))} {value:.6f}')
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f'# TYPE {PREFIX}{name} histogram')
+            for key, histogram in sorted(series.items()):
+                for le, count in histogram.cumulative():
+                    le = '+Inf' if le == float('inf') else repr(le)
+                    lines.append(f'{PREFIX}{name}_bucket{_format_labels(key, [("le", le)])} {count}')
+                lines.append(f'{PREFIX}{name}_sum{_format_labels(key)} {histogram.sum:.6f}')
+                lines.append(f'{PREFIX}{name}_count{_format_labels(key)} {histogram.count}')
+        if stats:
+            # numeric Scrapy stats (dupefilter/filtered, downloader/response_count...) ride along
+            lines.append(f'# TYPE {PREFIX}scrapy_stat gauge')
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'{PREFIX}scrapy_stat{_format_labels((("name", key),))} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self, stats=None):
+        def series_list(series, render):
+            return [{**dict(key), **render(value)} for key, value in sorted(series.items())]
+        return {
+            'uptime_seconds': round(time.time() - self.started, 3),
+            'counters': {name: series_list(series, lambda v: {'value': v}) for name, series in self.counters.items()},
+            'histograms': {
+                name: series_list(series, lambda h: {
+                    'count': h.count, 'sum': round(h.sum, 6),
+                    'buckets': {('+Inf' if le == float('inf') else str(le)): c for le, c in h.cumulative()},
+                })
+                for name, series in self.histograms.items()
+            },
+            'product_yield': self.product_yield(),
+            'stats': {k: v for k, v in (stats or {}).items() if isinstance(v, (int, float, str))},
+        }
+
+    def export(self, prometheus_path=None, json_path=None, stats=None):
+        if prometheus_path:
+            _write_atomic(prometheus_path, self.to_prometheus(stats))
+        if json_path:
+            _write_atomic(json_path, json.dumps(self.to_json(stats), indent=2, default=str))
+
+
+def _write_atomic(path, text):
+    # scrapers (node_exporter textfile collector...) must never see half a file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -3,22 +3,60 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import re
+import weakref
+import zlib
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured, StopDownload
+from twisted.internet import task
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from ecom_crawler.jsonld import PRODUCT_TOKEN_BYTES
+from ecom_crawler.metrics import FETCH_BUCKETS, CrawlMetrics
+from ecom_crawler.url_classifier import classify_url, url_domain
+
+# Streamed product signals: JSON-LD Product type, schema.org Product microdata, add to cart form
+PRODUCT_SIGNAL_BYTES = re.compile(
+    PRODUCT_TOKEN_BYTES.pattern
+    + rb'|itemtype\s*=\s*["\']?https?://schema\.org/Product'
+    + rb'|<form[^>]+action\s*=\s*["\'][^"\']*cart/add',
+    re.IGNORECASE
+)
+_SCRIPT_END = re.compile(rb'</script', re.IGNORECASE)
+_OVERLAP = 512
+
 
 class EcomCrawlerSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the spider middleware does not modify the
     # passed objects.
+    #
+    # Counts responses and products per domain for the crawl metrics (ecom_crawler/metrics.py)
+    # and exports them every METRICS_EXPORT_INTERVAL seconds and when the spider closes.
+
+    def __init__(self, metrics=None, stats=None, prometheus_path=None, json_path=None, interval=60.0):
+        self.metrics = metrics or CrawlMetrics()
+        self.stats = stats
+        self.prometheus_path = prometheus_path
+        self.json_path = json_path
+        self.interval = interval
+        self.export_loop = None
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(
+            CrawlMetrics.for_crawler(crawler),
+            crawler.stats,
+            crawler.settings.get('METRICS_PROMETHEUS_FILE') or None,
+            crawler.settings.get('METRICS_JSON_FILE') or None,
+            crawler.settings.getfloat('METRICS_EXPORT_INTERVAL', 60.0),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
     def process_spider_input(self, response, spider):
@@ -26,14 +64,26 @@ class EcomCrawlerSpiderMiddleware:
         # middleware and into the spider.
 
         # Should return None or raise an exception.
+        self.metrics.inc('responses', domain=url_domain(response.url))
         return None
 
+    def _count(self, i):
+        if is_item(i):
+            self.metrics.inc('products', domain=ItemAdapter(i).get('domain') or '')
+
     def process_spider_output(self, response, result, spider):
         # Called with the results returned from the Spider, after
         # it has processed the response.
 
         # Must return an iterable of Request, or item objects.
         for i in result:
+            self._count(i)
+            yield i
+
+    async def process_spider_output_async(self, response, result, spider):
+        # same for async callbacks (parse_collections_playwright)
+        async for i in result:
+            self._count(i)
             yield i
 
     def process_spider_exception(self, response, exception, spider):
@@ -54,17 +104,37 @@ class EcomCrawlerSpiderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+        if self.interval > 0 and (self.prometheus_path or self.json_path):
+            self.export_loop = task.LoopingCall(self.export, spider)
+            self.export_loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.export_loop is not None and self.export_loop.running:
+            self.export_loop.stop()
+        self.export(spider)
+
+    def export(self, spider):
+        try:
+            stats = self.stats.get_stats() if self.stats is not None else None
+            self.metrics.export(self.prometheus_path, self.json_path, stats)
+        except (IOError, OSError) as e:
+            spider.logger.error(f"Error writing metrics: {e}")
 
 
 class EcomCrawlerDownloaderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the downloader middleware does not modify the
     # passed objects.
+    #
+    # Records fetch latency histograms per domain, split between plain HTTP and Playwright renders.
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics or CrawlMetrics()
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(CrawlMetrics.for_crawler(crawler))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
@@ -87,6 +157,10 @@ class EcomCrawlerDownloaderMiddleware:
         # - return a Response object
         # - return a Request object
         # - or raise IgnoreRequest
+        latency = request.meta.get('download_latency') # set by the download handler (whole render for Playwright)
+        if latency is not None:
+            mode = 'browser' if request.meta.get('playwright') else 'http'
+            self.metrics.observe('fetch_seconds', latency, buckets=FETCH_BUCKETS, domain=url_domain(request.url), mode=mode)
         return response
 
     def process_exception(self, request, exception, spider):
@@ -101,3 +175,125 @@ class EcomCrawlerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class _Stream:
+    """Per-response state of EarlyAbortDownloaderMiddleware."""
+
+    def __init__(self, kind, cap, watch_signals, encoding):
+        self.kind = kind
+        self.cap = cap
+        self.watch_signals = watch_signals
+        self.decompressor = None
+        if encoding in (b'gzip', b'x-gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == b'deflate':
+            self.decompressor = zlib.decompressobj()
+        self.decoded = 0 # page bytes seen so far (after decompression)
+        self.tail = b'' # end of the previous chunk, so tokens split over two chunks are still found
+        self.signal_at = None # page offset where a product signal was seen
+        self.needs_script_end = False
+
+
+class EarlyAbortDownloaderMiddleware:
+    """
+    Stops downloads as soon as the spider has what it needs, using the headers_received and
+    bytes_received signals (Scrapy's StopDownload with fail=False, the partial body still
+    reaches the callback).
+
+    - Content types outside EARLY_ABORT_ALLOWED_TYPES (images, pdf, video...) are dropped
+      as soon as the headers arrive.
+    - HTML bodies are cut at EARLY_ABORT_BYTE_CAPS[page type] (page type from the URL patterns).
+    - For product-pattern URLs the (gunzipped) stream is scanned for product signals:
+      JSON-LD Product, schema.org/Product itemtype, a cart/add form. Once one is seen, and its
+      JSON-LD script has closed, EARLY_ABORT_TAIL_BYTES more are read (for the h1 and the
+      elements around it) and the download stops there.
+
+    Bodies with an encoding other than gzip / deflate / identity are never cut, since a
+    truncated brotli stream can't be decoded.
+    """
+
+    def __init__(self, stats, allowed_types, byte_caps, tail_bytes):
+        self.stats = stats
+        self.allowed_types = tuple(t.encode('ascii') for t in allowed_types)
+        self.byte_caps = byte_caps
+        self.tail_bytes = tail_bytes
+        self.streams = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('EARLY_ABORT_ENABLED', True):
+            raise NotConfigured
+        s = cls(
+            crawler.stats,
+            crawler.settings.getlist('EARLY_ABORT_ALLOWED_TYPES'),
+            crawler.settings.getdict('EARLY_ABORT_BYTE_CAPS'),
+            crawler.settings.getint('EARLY_ABORT_TAIL_BYTES', 32 * 1024),
+        )
+        crawler.signals.connect(s.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(s.bytes_received, signal=signals.bytes_received)
+        return s
+
+    def headers_received(self, headers, body_length, request, spider):
+        if request.meta.get('playwright') or request.meta.get('dont_early_abort'):
+            return
+        content_type = (headers.get(b'Content-Type') or b'').split(b';', 1)[0].strip().lower()
+        if content_type and not content_type.startswith(self.allowed_types):
+            request.meta['early_abort'] = 'content_type'
+            self.stats.inc_value('early_abort/content_type')
+            raise StopDownload(fail=False)
+        if content_type not in (b'text/html', b'application/xhtml+xml'):
+            return
+        encoding = (headers.get(b'Content-Encoding') or b'').strip().lower()
+        if encoding not in (b'', b'identity', b'gzip', b'x-gzip', b'deflate'):
+            return
+        url_class = classify_url(request.url)
+        cap = self.byte_caps.get(url_class.kind, 0)
+        if cap or url_class.is_product:
+            self.streams[request] = _Stream(url_class.kind, cap, url_class.is_product, encoding)
+
+    def bytes_received(self, data, request, spider):
+        stream = self.streams.get(request)
+        if stream is None:
+            return
+        if stream.decompressor is not None:
+            try:
+                data = stream.decompressor.decompress(data)
+            except zlib.error:
+                # broken encoding, let HttpCompressionMiddleware deal with it
+                del self.streams[request]
+                return
+        start = stream.decoded
+        stream.decoded += len(data)
+        if stream.cap and stream.decoded >= stream.cap:
+            self._stop(request, stream, f'byte_cap/{stream.kind}')
+        if stream.watch_signals:
+            window = stream.tail + data
+            offset = start - len(stream.tail)
+            if stream.signal_at is None:
+                m = PRODUCT_SIGNAL_BYTES.search(window)
+                if m is not None:
+                    stream.signal_at = offset + m.start()
+                    stream.needs_script_end = m.group().startswith(b'"@type"')
+            if stream.signal_at is not None:
+                if stream.needs_script_end and _SCRIPT_END.search(window, max(0, stream.signal_at - offset)):
+                    stream.needs_script_end = False
+                if not stream.needs_script_end and stream.decoded >= stream.signal_at + self.tail_bytes:
+                    self._stop(request, stream, 'product_signals')
+            stream.tail = window[-_OVERLAP:]
+
+    def _stop(self, request, stream, reason):
+        del self.streams[request]
+        request.meta['early_abort'] = reason
+        self.stats.inc_value(f'early_abort/{reason}')
+        self.stats.inc_value('early_abort/bytes_read', stream.decoded)
+        raise StopDownload(fail=False)
+
+    def process_response(self, request, response, spider):
+        self.streams.pop(request, None)
+        if request.meta.get('early_abort') == 'content_type':
+            raise IgnoreRequest(f"Not a page ({response.headers.get(b'Content-Type')}): {request.url}")
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.streams.pop(request, None)
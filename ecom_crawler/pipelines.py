@@ -1,8 +1,28 @@
+import heapq
 import json
+import os
+import shutil
+import tempfile
+import time
 from itemadapter import ItemAdapter
 from collections import defaultdict
+from urllib.parse import quote, unquote
+
+from twisted.internet import defer, threads
+
+from ecom_crawler.dedup import DedupStore
+from ecom_crawler.recrawl import ProductDelta
+
+DEFAULT_OUTPUT_FILENAME = 'grouped_products.json'
+
 
 class GroupedOutputPipeline:
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls()
+        pipeline.output_filename = crawler.settings.get('GROUPED_OUTPUT_FILE', DEFAULT_OUTPUT_FILENAME)
+        return pipeline
+
     def open_spider(self, spider):
         # Use defaultdict to easily collect URLs per domain
         self.products_by_domain = defaultdict(set) # Use set for automatic uniqueness
@@ -14,8 +34,7 @@ class GroupedOutputPipeline:
             # Convert set to sorted list for consistent output
             output_data[domain] = sorted(list(urls))
 
-        # Define output filename (could be passed via settings or spider args)
-        output_filename = 'grouped_products.json'
+        output_filename = getattr(self, 'output_filename', DEFAULT_OUTPUT_FILENAME)
         try:
             with open(output_filename, 'w', encoding='utf-8') as f:
                 json.dump(output_data, f, ensure_ascii=False, indent=4)
@@ -38,4 +57,270 @@ class GroupedOutputPipeline:
         # We don't return the item because this pipeline handles the final output
         return item # Return item if you want other pipelines (like default FeedExporter) to see it too
                    # If ONLY using this pipeline for output, dropping is fine. Let's return it
-                   # to allow flexibility (e.g., using FEEDS for a flat CSV alongside this grouped JSON).
\ No newline at end of file
+                   # to allow flexibility (e.g., using FEEDS for a flat CSV alongside this grouped JSON).
+
+
+def segment_path(segment_dir, domain):
+    return os.path.join(segment_dir, quote(domain, safe='') + '.jsonl')
+
+
+def segment_domains(segment_dir):
+    """Domains that have a segment file in segment_dir, sorted."""
+    if not os.path.isdir(segment_dir):
+        return []
+    return sorted(unquote(name[:-len('.jsonl')]) for name in os.listdir(segment_dir) if name.endswith('.jsonl'))
+
+
+def _read_segment(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # torn last line after a crash
+                continue
+
+
+def _write_run(urls, run_dir):
+    fd, path = tempfile.mkstemp(suffix='.run', dir=run_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        previous = None
+        for url in sorted(urls):
+            if url != previous:
+                f.write(json.dumps(url, ensure_ascii=False) + '\n')
+                previous = url
+    return path
+
+
+def _read_run(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def sorted_unique_urls(segment_files, run_dir, run_size=100000):
+    """
+    External merge sort: yields the URLs of the given JSONL segments sorted and without
+    duplicates, holding at most run_size URLs in memory at a time.
+    """
+    runs = []
+    chunk = []
+    for path in segment_files:
+        for url in _read_segment(path):
+            chunk.append(url)
+            if len(chunk) >= run_size:
+                runs.append(_write_run(chunk, run_dir))
+                chunk = []
+    if chunk:
+        runs.append(_write_run(chunk, run_dir))
+    previous = None
+    for url in heapq.merge(*(_read_run(path) for path in runs)):
+        if url != previous:
+            yield url
+            previous = url
+
+
+def write_grouped_json(output_filename, domain_urls):
+    """
+    Streams (domain, sorted urls iterator) pairs into the grouped JSON format, byte for byte
+    what json.dump(indent=4, ensure_ascii=False) writes for the same dict. The file is written
+    next to the target and renamed over it, so a crash never leaves a truncated output.
+    """
+    tmp_path = output_filename + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            wrote_domain = False
+            for domain, urls in domain_urls:
+                f.write(',\n' if wrote_domain else '{\n')
+                wrote_domain = True
+                f.write(f'    {json.dumps(domain, ensure_ascii=False)}: [')
+                first = True
+                for url in urls:
+                    f.write('\n        ' if first else ',\n        ')
+                    f.write(json.dumps(url, ensure_ascii=False))
+                    first = False
+                f.write(']' if first else '\n    ]')
+            f.write('\n}' if wrote_domain else '{}')
+        os.replace(tmp_path, output_filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def merge_segments(segment_dir, output_filename, domains=None, run_size=100000, segment_files=None, track=None):
+    """
+    Finalizer of the streaming mode: merges per-domain JSONL segments into the grouped JSON file.
+    domains gives the output order (domains only present on disk are appended, sorted),
+    segment_files can map a domain to several segment files (e.g. one per worker).
+    track(domain, urls), when given, wraps each domain's sorted URL stream (see ProductDelta).
+    """
+    ordered = list(domains or [])
+    ordered += [d for d in segment_domains(segment_dir) if d not in ordered]
+    segment_files = segment_files or {}
+    os.makedirs(segment_dir, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix='merge-', dir=segment_dir)
+    try:
+        def domain_urls():
+            for domain in ordered:
+                files = segment_files.get(domain) or [segment_path(segment_dir, domain)]
+                files = [path for path in files if os.path.exists(path)]
+                if files:
+                    urls = sorted_unique_urls(files, run_dir, run_size)
+                    yield domain, track(domain, urls) if track is not None else urls
+        write_grouped_json(output_filename, domain_urls())
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return ordered
+
+
+class StreamingGroupedOutputPipeline:
+    """
+    Crash-safe variant of GroupedOutputPipeline.
+
+    Items are appended to one JSONL segment per domain instead of being kept in memory.
+    They are buffered and written in batches from a thread (one batch at a time, in order)
+    so the reactor never waits on the disk, and segments are fsynced every
+    GROUPED_OUTPUT_FSYNC_INTERVAL seconds. On close the segments are merge-sorted into the
+    usual grouped JSON file without loading them in memory. Segments left by a crashed run
+    are kept and merged when GROUPED_OUTPUT_RESUME is set or the spider resumes saved crawl state
+    (-a resume=... with a state file that isn't empty), otherwise they are discarded.
+    Runs with -a resume=... keep their own segments for the next run. URLs already written in this run are remembered as
+    fingerprints (see dedup.py) and not written again. When more than max_pending_batches
+    batches wait for the writer, process_item returns a deferred that fires once they are
+    written, so Scrapy slows the crawl down instead of piling batches up in memory.
+    """
+
+    def __init__(self, output_filename=DEFAULT_OUTPUT_FILENAME, segment_dir='.crawl_segments',
+                 flush_items=500, fsync_interval=30.0, run_size=100000, resume=False, dedup=None, stats=None,
+                 delta=None, max_pending_batches=4):
+        self.output_filename = output_filename
+        self.segment_dir = segment_dir
+        self.flush_items = flush_items
+        self.fsync_interval = fsync_interval
+        self.run_size = run_size
+        self.resume = resume
+        self.dedup = dedup or DedupStore()
+        self.stats = stats
+        self.delta = delta # ProductDelta, written after the merge
+        self.max_pending_batches = max(1, max_pending_batches)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            output_filename=settings.get('GROUPED_OUTPUT_FILE', DEFAULT_OUTPUT_FILENAME),
+            segment_dir=settings.get('GROUPED_OUTPUT_SEGMENT_DIR', '.crawl_segments'),
+            flush_items=settings.getint('GROUPED_OUTPUT_FLUSH_ITEMS', 500),
+            fsync_interval=settings.getfloat('GROUPED_OUTPUT_FSYNC_INTERVAL', 30.0),
+            run_size=settings.getint('GROUPED_OUTPUT_MERGE_RUN_SIZE', 100000),
+            resume=settings.getbool('GROUPED_OUTPUT_RESUME', False),
+            dedup=DedupStore.from_settings(settings),
+            stats=crawler.stats,
+            delta=ProductDelta.from_settings(settings),
+            max_pending_batches=settings.getint('GROUPED_OUTPUT_MAX_PENDING_BATCHES', 4),
+        )
+
+    def open_spider(self, spider):
+        # segments of an earlier run only belong to this one when the spider resumed its crawl state,
+        # a new -a resume=... file starts from scratch
+        if not (self.resume or getattr(spider, 'resumed', False)):
+            shutil.rmtree(self.segment_dir, ignore_errors=True)
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.domains = [] # first-seen order, same as the in-memory pipeline's dict
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.files = {} # only touched from the writer chain
+        self.last_fsync = time.monotonic()
+        self.writing = defer.succeed(None)
+        self.pending_batches = 0 # queued on the writer chain, not written yet
+        self.spider = spider
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        domain = adapter.get('domain')
+        url = adapter.get('url')
+
+        if domain and url:
+            if not self.dedup.add(domain, url):
+                return item # already written
+            if domain not in self.buffers and domain not in self.domains:
+                self.domains.append(domain)
+            self.buffers[domain].append(json.dumps(url, ensure_ascii=False) + '\n')
+            self.buffered += 1
+            fsync_due = time.monotonic() - self.last_fsync >= self.fsync_interval
+            if self.buffered >= self.flush_items or fsync_due:
+                self.flush(fsync=fsync_due)
+                if self.pending_batches > self.max_pending_batches:
+                    return self._wait_for_writer(item)
+        else:
+            spider.logger.warning(f"Item missing domain or URL: {item}")
+        return item
+
+    def flush(self, fsync=False):
+        """Queues the buffered lines for the writer thread, returns the writer chain."""
+        batch, self.buffers, self.buffered = self.buffers, defaultdict(list), 0
+        if fsync:
+            self.last_fsync = time.monotonic()
+        if batch or fsync:
+            self.pending_batches += 1
+            self.writing.addCallback(lambda _: threads.deferToThread(self._write_batch, batch, fsync))
+            self.writing.addErrback(self._log_write_error)
+            self.writing.addBoth(self._batch_written)
+        return self.writing
+
+    def _batch_written(self, result):
+        self.pending_batches -= 1
+        return result
+
+    def _wait_for_writer(self, item):
+        # the writer thread lags behind: hold this item until everything queued is on disk
+        if self.stats is not None:
+            self.stats.inc_value('pipeline/writer_backpressure')
+        d = defer.Deferred()
+
+        def written(result):
+            d.callback(item)
+            return result
+
+        self.writing.addBoth(written)
+        return d
+
+    def _write_batch(self, batch, fsync):
+        for domain, lines in batch.items():
+            f = self.files.get(domain)
+            if f is None:
+                f = self.files[domain] = open(segment_path(self.segment_dir, domain), 'a', encoding='utf-8')
+            f.write(''.join(lines))
+            f.flush()
+        if fsync:
+            for f in self.files.values():
+                os.fsync(f.fileno())
+
+    def _log_write_error(self, failure):
+        self.spider.logger.error(f"Error writing product segment: {failure.getErrorMessage()}")
+
+    def _finalize(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        track = self.delta.track if self.delta is not None else None
+        merge_segments(self.segment_dir, self.output_filename, self.domains, self.run_size, track=track)
+        if self.delta is not None:
+            for domain, (added, removed) in self.delta.write().items():
+                self.spider.logger.info(f"Product delta for {domain}: {added} added, {removed} removed")
+        if not (self.resume or getattr(self.spider, 'resume', None)):
+            # resumable runs keep their segments so the next run's output still has these products
+            shutil.rmtree(self.segment_dir, ignore_errors=True)
+
+    def close_spider(self, spider):
+        if self.stats is not None:
+            self.dedup.report(self.stats, prefix='dedup/pipeline')
+        d = self.flush(fsync=True)
+        d.addCallback(lambda _: threads.deferToThread(self._finalize))
+        d.addCallback(lambda _: spider.logger.info(f"Successfully saved grouped product URLs to {self.output_filename}"))
+        d.addErrback(lambda failure: spider.logger.error(f"Error writing grouped output file: {failure.getErrorMessage()}"))
+        return d
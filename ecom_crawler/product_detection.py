@@ -0,0 +1,221 @@
+from collections import namedtuple
+
+from cssselect import parse as parse_css
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+from ecom_crawler.jsonld import json_ld_product
+from ecom_crawler.url_classifier import url_domain
+
+ADD_TO_CART_SELECTORS = [
+    'button[id*="add-to-cart"]',
+    'button[class*="add-to-cart"]',
+    'button[data-action*="add-to-cart"]',
+    'input[type="submit"][value*="Add to Cart"]',
+    'button:contains("Add to Bag")',
+    'button:contains("Buy Now")',
+    'form[action*="cart/add"]'
+]
+PRICE_SELECTORS = [
+    '[class*="price"]', '[id*="price"]',
+    '[itemprop="price"]',
+    '.product-price', '.Price--final', '.selling-price' # Add site-specific ones
+]
+PRODUCT_SCHEMA_SELECTOR = '[itemtype*="schema.org/Product"]'
+
+SCHEMA = 'schema'
+JSON_LD = 'json_ld'
+ADD_TO_CART = 'add_to_cart'
+PRICE = 'price'
+TITLE = 'title'
+SIGNALS = (SCHEMA, JSON_LD, ADD_TO_CART, PRICE, TITLE)
+
+# Same decisions the old selector cascade made: any strong signal on its own,
+# price only together with a plausible title
+DEFAULT_POLICY = {
+    'weights': {SCHEMA: 1.0, JSON_LD: 1.0, ADD_TO_CART: 1.0, PRICE: 0.5, TITLE: 0.5},
+    'threshold': 1.0,
+}
+
+_JSON_LD_XPATH = "descendant-or-self::script[@type='application/ld+json']"
+_TITLE_XPATH = "(descendant-or-self::h1/text())[1]"
+
+_translator = HTMLTranslator()
+
+
+class ProductVerdict(namedtuple('ProductVerdict', ['is_product', 'score', 'signals', 'evidence'])):
+    """
+    Result of a detection run. signals is the tuple of signals that fired, evidence maps
+    each of them to the selector (or title text) that triggered it. Truthy when it is a product.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.is_product
+
+
+# One compiled selector. Selectors ending in an attribute test are queried on the attribute
+# axis (attr is set, value_test checks the attribute value in python, owner_check the
+# element it belongs to), the others (:contains) are plain element branches matched with owner_check
+Indicator = namedtuple('Indicator', ['signal', 'selector', 'xpath', 'attr', 'value_test', 'owner_check'])
+
+
+def _value(token):
+    return getattr(token, 'value', token)
+
+
+def _self_check(element, condition):
+    if element == '*' and not condition:
+        return None
+    expr = f'self::{element}[{condition}]' if condition else f'self::{element}'
+    return etree.XPath(f'boolean({expr})')
+
+
+def compile_indicator(signal, selector):
+    if ':contains(' in selector:
+        # 'button:contains("Add to Bag")' -> button with a descendant text node containing the text
+        element, text = selector.split(':contains(', 1)
+        text = _translator.xpath_literal(text.rstrip(')').strip('"\''))
+        condition = f'.//text()[contains(., {text})]'
+        xpath = f'(descendant-or-self::{element or "*"}[{condition}])[1]'
+        return Indicator(signal, selector, xpath, None, None, _self_check(element or '*', condition))
+
+    tree = parse_css(selector)[0].parsed_tree
+    kind = type(tree).__name__
+    owner = _translator.xpath(tree.selector)
+    step = f'descendant-or-self::{owner.element}' + (f'[{owner.condition}]' if owner.condition else '')
+    if kind == 'Class':
+        needle = tree.class_name
+        attr, literal = 'class', _translator.xpath_literal(needle)
+        predicate = f"contains(., {literal}) and contains(concat(' ', normalize-space(.), ' '), {_translator.xpath_literal(' ' + needle + ' ')})"
+        value_test = lambda value, needle=needle: needle in value.split()
+    elif kind == 'Attrib' and tree.operator in ('*=', '='):
+        needle = _value(tree.value)
+        attr, literal = tree.attrib, _translator.xpath_literal(needle)
+        if tree.operator == '*=':
+            predicate = f'contains(., {literal})'
+            value_test = lambda value, needle=needle: needle in value
+        else:
+            predicate = f'. = {literal}'
+            value_test = lambda value, needle=needle: value == needle
+    else:
+        # anything fancier runs as an element branch with the full translated condition
+        expr = _translator.xpath(tree)
+        condition = expr.condition
+        xpath = f'(descendant-or-self::{expr.element}' + (f'[{condition}])[1]' if condition else ')[1]')
+        return Indicator(signal, selector, xpath, None, None, _self_check(expr.element, condition))
+
+    xpath = f'({step}/@{attr}[{predicate}])[1]'
+    return Indicator(signal, selector, xpath, attr, value_test, _self_check(owner.element, owner.condition))
+
+
+def _subsumes(general, specific):
+    """True when every node matching specific also matches general (simple [attr*=v] case only)."""
+    if general is specific or general.signal != specific.signal or ':contains(' in general.selector + specific.selector:
+        return False
+    g = parse_css(general.selector)[0].parsed_tree
+    if type(g).__name__ != 'Attrib' or g.operator != '*=' or _translator.xpath(g.selector).element != '*':
+        return False
+    if _translator.xpath(g.selector).condition:
+        return False
+    s = parse_css(specific.selector)[0].parsed_tree
+    needle = _value(g.value)
+    if type(s).__name__ == 'Class':
+        return g.attrib == 'class' and needle in s.class_name
+    if type(s).__name__ == 'Attrib' and s.attrib == g.attrib and s.operator in ('*=', '=', '~='):
+        return needle in _value(s.value)
+    return False
+
+
+def plausible_title(text):
+    # title exists and isn't too generic like "Search Results"
+    return bool(text) and 1 < len(text.split()) < 15
+
+
+class ProductDetector:
+    """
+    Computes every product signal of a page with one XPath evaluation.
+
+    All selectors are compiled at start-up into a single union, selectors already implied
+    by a broader one of the same signal are dropped (.product-price by [class*="price"]).
+    Attribute selectors query the attribute axis (//@class[contains(., 'price')]), which
+    libxml2 walks far faster than element predicates, and every branch keeps only its
+    first hit, so a page yields a handful of nodes that are mapped back to their selector
+    in python. Scoring is a weighted sum compared to a threshold, both overridable per domain.
+    """
+
+    def __init__(self, policies=None):
+        selectors = [(SCHEMA, PRODUCT_SCHEMA_SELECTOR)]
+        selectors += [(ADD_TO_CART, s) for s in ADD_TO_CART_SELECTORS]
+        selectors += [(PRICE, s) for s in PRICE_SELECTORS]
+        indicators = [compile_indicator(signal, selector) for signal, selector in selectors]
+        self.indicators = tuple(
+            ind for ind in indicators
+            if not any(_subsumes(other, ind) for other in indicators)
+        )
+        self._by_attr = {}
+        self._element_indicators = []
+        for ind in self.indicators:
+            if ind.attr:
+                self._by_attr.setdefault(ind.attr, []).append(ind)
+            else:
+                self._element_indicators.append(ind)
+        self._union = etree.XPath(' | '.join([ind.xpath for ind in self.indicators] + [_JSON_LD_XPATH, _TITLE_XPATH]))
+
+        self.metrics = None # optional CrawlMetrics, times the JSON-LD step
+
+        self.policies = {'default': DEFAULT_POLICY}
+        for domain, policy in (policies or {}).items():
+            self.policies[domain] = {
+                'weights': {**DEFAULT_POLICY['weights'], **policy.get('weights', {})},
+                'threshold': policy.get('threshold', DEFAULT_POLICY['threshold']),
+            }
+
+    def policy_for(self, url):
+        return self.policies.get(url_domain(url), self.policies['default'])
+
+    def _match_attribute(self, result, evidence):
+        owner = result.getparent()
+        for ind in self._by_attr.get(result.attrname, ()):
+            if ind.signal in evidence or not ind.value_test(result):
+                continue
+            if ind.owner_check is None or ind.owner_check(owner):
+                evidence[ind.signal] = ind.selector
+
+    def collect_signals(self, root):
+        """Returns {signal: evidence} for everything found under root, plus the JSON-LD texts."""
+        evidence = {}
+        json_ld_texts = []
+        for node in self._union(root):
+            if isinstance(node, str):
+                if node.is_attribute:
+                    self._match_attribute(node, evidence)
+                elif TITLE not in evidence and plausible_title(node):
+                    evidence[TITLE] = str(node).strip()
+                continue
+            if node.tag == 'script' and node.get('type') == 'application/ld+json':
+                json_ld_texts.append(node.text or '')
+                continue
+            for ind in self._element_indicators:
+                if ind.signal not in evidence and ind.owner_check(node):
+                    evidence[ind.signal] = ind.selector
+        return evidence, json_ld_texts
+
+    def detect(self, response):
+        evidence, json_ld_texts = self.collect_signals(response.selector.root)
+        if json_ld_texts:
+            if self.metrics is not None:
+                with self.metrics.timer('phase_seconds', phase='json_ld'):
+                    product = json_ld_product(response, json_ld_texts)
+            else:
+                product = json_ld_product(response, json_ld_texts)
+            if product is not None:
+                evidence[JSON_LD] = product.get('@type')
+        return self.score(response.url, evidence)
+
+    def score(self, url, evidence):
+        policy = self.policy_for(url)
+        weights = policy['weights']
+        score = sum(weights.get(signal, 0.0) for signal in evidence)
+        signals = tuple(signal for signal in SIGNALS if signal in evidence)
+        return ProductVerdict(score >= policy['threshold'], score, signals, evidence)
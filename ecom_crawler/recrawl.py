@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from hashlib import blake2b
+from urllib.parse import quote
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    body_hash TEXT,
+    is_product INTEGER,
+    updated REAL NOT NULL
+);
+"""
+
+
+def body_hash(body):
+    return blake2b(body, digest_size=16).hexdigest()
+
+
+class RecrawlStore:
+    """
+    What the last runs learnt about every page (SQLite, WAL journal): its ETag / Last-Modified
+    validators, a hash of its body and whether it was a product page. Writes are committed in
+    batches like CrawlState. One store per crawler, shared by RecrawlMiddleware and the spider.
+    """
+
+    def __init__(self, path, commit_every=1000, commit_interval=5.0):
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        """The crawler's store, None when RECRAWL_STATE_FILE isn't set."""
+        store = getattr(crawler, 'recrawl_store', None)
+        if store is None and crawler.settings.get('RECRAWL_STATE_FILE'):
+            store = crawler.recrawl_store = cls(crawler.settings.get('RECRAWL_STATE_FILE'))
+        return store
+
+    def _wrote(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        if self.db is not None:
+            self.commit()
+            self.db.close()
+            self.db = None
+
+    def get(self, url):
+        """(etag, last_modified, body_hash, is_product) of url, None when it was never fetched."""
+        return self.db.execute('SELECT etag, last_modified, body_hash, is_product FROM pages WHERE url = ?', (url,)).fetchone()
+
+    def update_validators(self, url, etag, last_modified, body_hash):
+        self.db.execute(
+            'INSERT INTO pages (url, etag, last_modified, body_hash, updated) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified, '
+            'body_hash = excluded.body_hash, updated = excluded.updated',
+            (url, etag, last_modified, body_hash, time.time()),
+        )
+        self._wrote()
+
+    def record_verdict(self, url, is_product):
+        self.db.execute(
+            'INSERT INTO pages (url, is_product, updated) VALUES (?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET is_product = excluded.is_product, updated = excluded.updated',
+            (url, int(bool(is_product)), time.time()),
+        )
+        self._wrote()
+
+    def is_product(self, url):
+        """Stored verdict of url: True / False, None when it was never classified."""
+        row = self.db.execute('SELECT is_product FROM pages WHERE url = ?', (url,)).fetchone()
+        return None if row is None or row[0] is None else bool(row[0])
+
+
+class RecrawlMiddleware:
+    """
+    Incremental recrawls (RECRAWL_STATE_FILE): known product pages are requested with
+    If-None-Match / If-Modified-Since, and a 304 reaches the spider (handle_httpstatus_list)
+    with meta['recrawl_unchanged'] set so it reuses the stored verdict. A 200 whose body hash
+    matches the last run's is flagged the same way. Listing pages are always fetched in full,
+    they are where new products show up.
+
+    Sits below HttpCompressionMiddleware so bodies are hashed decoded. Bodies cut short by
+    EarlyAbortDownloaderMiddleware aren't hashed, the validators from their headers are kept.
+    """
+
+    def __init__(self, store, stats):
+        self.store = store
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        store = RecrawlStore.for_crawler(crawler)
+        if store is None:
+            raise NotConfigured
+        mw = cls(store, crawler.stats)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def process_request(self, request, spider):
+        if request.method != 'GET' or request.meta.get('playwright'):
+            return None
+        row = self.store.get(request.url)
+        if row is None or not row[3]:
+            return None
+        etag, last_modified = row[0], row[1]
+        if not (etag or last_modified):
+            return None
+        if etag:
+            request.headers.setdefault('If-None-Match', etag)
+        if last_modified:
+            request.headers.setdefault('If-Modified-Since', last_modified)
+        request.meta['handle_httpstatus_list'] = list(request.meta.get('handle_httpstatus_list', ())) + [304]
+        request.meta['recrawl_conditional'] = True
+        self.stats.inc_value('recrawl/conditional_requests')
+        return None
+
+    def process_response(self, request, response, spider):
+        if response.status == 304 and request.meta.get('recrawl_conditional'):
+            request.meta['recrawl_unchanged'] = True
+            self.stats.inc_value('recrawl/not_modified')
+            return response
+        if response.status != 200 or request.meta.get('playwright'):
+            return response
+        digest = None if request.meta.get('early_abort') else body_hash(response.body)
+        row = self.store.get(response.url)
+        if digest is not None and row is not None and row[2] == digest:
+            request.meta['recrawl_unchanged'] = True
+            self.stats.inc_value('recrawl/unchanged_body')
+        etag = response.headers.get(b'ETag')
+        last_modified = response.headers.get(b'Last-Modified')
+        self.store.update_validators(
+            response.url,
+            etag.decode('latin-1') if etag else None,
+            last_modified.decode('latin-1') if last_modified else None,
+            digest,
+        )
+        return response
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+
+def _snapshot_path(snapshot_dir, domain):
+    return os.path.join(snapshot_dir, quote(domain, safe='') + '.jsonl')
+
+
+def _read_urls(path):
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def diff_sorted(previous, current):
+    """Streaming merge of two sorted URL iterators, yields ('added' | 'removed', url)."""
+    previous, current = iter(previous), iter(current)
+    old, new = next(previous, None), next(current, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old < new):
+            yield 'removed', old
+            old = next(previous, None)
+        elif old is None or new < old:
+            yield 'added', new
+            new = next(current, None)
+        else:
+            old, new = next(previous, None), next(current, None)
+
+
+class ProductDelta:
+    """
+    Change feed of the product output (RECRAWL_DELTA_FILE). While the final merge streams the
+    sorted URLs of each domain, track() copies them to a new snapshot; write() then diffs every
+    snapshot with the previous run's by a streaming merge, writes the added / removed URLs per
+    domain as JSON and makes the new snapshots the reference of the next run. Nothing is held
+    in memory but the two cursors.
+
+    A domain that ended up with no products at all is left out (its old snapshot is kept), a
+    failed crawl shouldn't report the whole catalog as removed.
+    """
+
+    def __init__(self, snapshot_dir, delta_path):
+        self.snapshot_dir = snapshot_dir
+        self.delta_path = delta_path
+        self.tracked = [] # domains with a complete new snapshot
+
+    @classmethod
+    def from_settings(cls, settings):
+        if not settings.get('RECRAWL_DELTA_FILE'):
+            return None
+        return cls(settings.get('RECRAWL_SNAPSHOT_DIR', '.product_snapshots'), settings.get('RECRAWL_DELTA_FILE'))
+
+    def track(self, domain, urls):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        new_path = _snapshot_path(self.snapshot_dir, domain) + '.new'
+        count = 0
+        with open(new_path, 'w', encoding='utf-8') as f:
+            for url in urls:
+                f.write(json.dumps(url, ensure_ascii=False) + '\n')
+                count += 1
+                yield url
+        if count:
+            self.tracked.append(domain)
+        else:
+            logger.warning(f"No products for {domain} in this run, keeping its previous snapshot out of the delta")
+            os.remove(new_path)
+
+    def write(self):
+        """Writes the delta file, returns {domain: (added, removed)}."""
+        counts = {}
+        tmp_path = self.delta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('{')
+            for i, domain in enumerate(self.tracked):
+                old_path = _snapshot_path(self.snapshot_dir, domain)
+                new_path = old_path + '.new'
+                f.write(',\n' if i else '\n')
+                f.write(f'    {json.dumps(domain, ensure_ascii=False)}: {{')
+                domain_counts = []
+                for j, change in enumerate(('added', 'removed')):
+                    f.write(',\n' if j else '\n')
+                    f.write(f'        "{change}": [')
+                    n = 0
+                    for kind, url in diff_sorted(_read_urls(old_path), _read_urls(new_path)):
+                        if kind == change:
+                            f.write(',\n            ' if n else '\n            ')
+                            f.write(json.dumps(url, ensure_ascii=False))
+                            n += 1
+                    f.write('\n        ]' if n else ']')
+                    domain_counts.append(n)
+                f.write('\n    }')
+                counts[domain] = tuple(domain_counts)
+            f.write('\n}' if self.tracked else '}')
+        os.replace(tmp_path, self.delta_path)
+        for domain in self.tracked:
+            old_path = _snapshot_path(self.snapshot_dir, domain)
+            os.replace(old_path + '.new', old_path)
+        self.tracked = []
+        return counts
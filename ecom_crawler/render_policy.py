@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import re
+import time
+from urllib.parse import urljoin
+
+from ecom_crawler.url_classifier import url_domain
+
+logger = logging.getLogger(__name__)
+
+HTTP = 'http'
+BROWSER = 'browser'
+SAMPLE = 'sample'
+
+# Path segments kept as they are in a template, everything else becomes a wildcard
+_TEMPLATE_KEYWORDS = frozenset([
+    'c', 'category', 'categories', 'collections', 'collection', 'shop', 'all', 'products', 'product', 'p', 'search',
+])
+# 'c-msh1014' -> 'c-*' (tatacliq style short prefix codes)
+_PREFIXED_ID = re.compile(r'^([a-z]{1,3})-[\w.-]+$')
+
+
+def url_template(url, depth=3):
+    """'https://www.tatacliq.com/womens-clothing/c-msh1014?q=1' -> 'tatacliq.com/*/c-*'."""
+    path = url.split('//', 1)[-1].split('/', 1)
+    path = path[1] if len(path) > 1 else ''
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    shape = []
+    for segment in [s for s in path.lower().split('/') if s][:depth]:
+        if segment in _TEMPLATE_KEYWORDS:
+            shape.append(segment)
+        else:
+            m = _PREFIXED_ID.match(segment)
+            shape.append(f'{m.group(1)}-*' if m else '*')
+    return url_domain(url) + '/' + '/'.join(shape)
+
+
+def count_links(base_url, hrefs):
+    """Distinct absolute URLs (fragment dropped) among hrefs, how both sides of a sample are counted."""
+    return len({urljoin(base_url, href.strip()).split('#', 1)[0] for href in hrefs if href and href.strip()})
+
+
+class RenderPolicy:
+    """
+    Decides per URL template whether listing pages need a browser render.
+
+    Until a template has `samples` measurements its listings are rendered and the product
+    links found by the browser are compared with the ones in the plain HTTP HTML, both
+    counted with count_links(). At most
+    `samples` renders of a template are in flight at once, other listings of an undecided
+    template go the HTTP way meanwhile (so do listings without an HTTP page to compare). The
+    browser is kept only when it finds clearly more (min_gain relative and min_extra_links
+    absolute), otherwise the template goes the cheap HTTP way. Decided templates are
+    re-sampled every resample_every pages, and decisions are saved to a JSON file so the
+    next run starts from them (entries older than max_age_days are dropped).
+    """
+
+    def __init__(self, path=None, samples=2, resample_every=500, max_age_days=30, min_gain=0.2, min_extra_links=3):
+        self.path = path
+        self.samples = max(1, samples)
+        self.resample_every = resample_every
+        self.max_age_days = max_age_days
+        self.min_gain = min_gain
+        self.min_extra_links = min_extra_links
+        self.templates = {} # template -> {'decision', 'samples', 'updated'}
+        self.uses = {} # template -> pages decided since the last sample
+        self.pending = {} # template -> sample renders not recorded yet
+        self.dirty = False
+
+    @classmethod
+    def from_settings(cls, settings):
+        policy = cls(
+            path=settings.get('RENDER_DECISIONS_FILE') or None,
+            samples=settings.getint('RENDER_SAMPLES', 2),
+            resample_every=settings.getint('RENDER_RESAMPLE_EVERY', 500),
+            max_age_days=settings.getint('RENDER_DECISION_MAX_AGE_DAYS', 30),
+            min_gain=settings.getfloat('RENDER_MIN_GAIN', 0.2),
+            min_extra_links=settings.getint('RENDER_MIN_EXTRA_LINKS', 3),
+        )
+        policy.load()
+        return policy
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable render decisions {self.path}: {e}")
+            return
+        oldest = time.time() - self.max_age_days * 86400
+        self.templates = {t: entry for t, entry in saved.items() if entry.get('updated', 0) >= oldest}
+        logger.info(f"Loaded {len(self.templates)} render decisions from {self.path}")
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.templates, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def decide(self, url, can_sample=True):
+        """
+        HTTP, BROWSER, or SAMPLE (render it, call sample_started() and report both link counts
+        with record()). can_sample is False when there is no HTTP page to compare the render with.
+        """
+        template = url_template(url)
+        entry = self.templates.get(template)
+        sampling = can_sample and self.pending.get(template, 0) < self.samples
+        if entry is None or entry.get('decision') is None:
+            return SAMPLE if sampling else HTTP
+        uses = self.uses.get(template, 0) + 1
+        if sampling and self.resample_every and uses >= self.resample_every:
+            self.uses[template] = 0
+            return SAMPLE
+        self.uses[template] = uses
+        return entry['decision']
+
+    def sample_started(self, url):
+        template = url_template(url)
+        self.pending[template] = self.pending.get(template, 0) + 1
+
+    def record(self, url, http_links, browser_links):
+        """Adds one measurement of a template and returns its (possibly new) decision."""
+        template = url_template(url)
+        if self.pending.get(template, 0) > 1:
+            self.pending[template] -= 1
+        else:
+            self.pending.pop(template, None)
+        entry = self.templates.setdefault(template, {'decision': None, 'samples': []})
+        entry['samples'] = (entry['samples'] + [[http_links, browser_links]])[-self.samples:]
+        entry['updated'] = time.time()
+        decision = entry['decision']
+        if len(entry['samples']) >= self.samples:
+            http_mean = sum(s[0] for s in entry['samples']) / len(entry['samples'])
+            browser_mean = sum(s[1] for s in entry['samples']) / len(entry['samples'])
+            gain = browser_mean - http_mean
+            needs_browser = gain >= self.min_extra_links and browser_mean > http_mean * (1 + self.min_gain)
+            decision = BROWSER if needs_browser else HTTP
+            if decision != entry['decision']:
+                logger.info(f"Render decision for {template}: {decision} (http {http_mean:.0f} vs browser {browser_mean:.0f} product links)")
+        entry['decision'] = decision
+        self.dirty = True
+        return decision
+
+    def decision_counts(self):
+        counts = {HTTP: 0, BROWSER: 0, None: 0}
+        for entry in self.templates.values():
+            counts[entry.get('decision')] = counts.get(entry.get('decision'), 0) + 1
+        return counts
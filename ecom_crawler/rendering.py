@@ -0,0 +1,140 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_LINK_SELECTOR = 'a[href*="/p-"], a[href*="/product/"], a[href*="/products/"], a[href*="productId"]'
+
+# Buttons that append the next batch of products to a listing
+LOAD_MORE_SELECTOR = (
+    'button:has-text("Load More"), button:has-text("Show More"), button:has-text("View More"), '
+    'a:has-text("Load More"), [class*="load-more"], [class*="loadMore"]'
+)
+
+# Nothing a product link depends on: documents, scripts, xhr / fetch keep loading
+BLOCKED_RESOURCE_TYPES = frozenset([
+    'image', 'media', 'font', 'stylesheet', 'texttrack', 'manifest', 'eventsource', 'websocket', 'ping',
+])
+
+# Third party trackers / widgets, blocked whatever their resource type
+BLOCKED_URL_PATTERN = re.compile(
+    r'google-analytics\.com|googletagmanager\.com|doubleclick\.net|facebook\.net|connect\.facebook|'
+    r'hotjar\.com|clarity\.ms|criteo\.|taboola\.|outbrain\.|newrelic\.com|nr-data\.net|'
+    r'moengage\.com|clevertap|branch\.io|youtube\.com/embed|cdn\.segment\.com'
+)
+
+
+def should_abort_request(request):
+    """PLAYWRIGHT_ABORT_REQUEST predicate: drops heavy resources and trackers before they load."""
+    return request.resource_type in BLOCKED_RESOURCE_TYPES or BLOCKED_URL_PATTERN.search(request.url) is not None
+
+
+class ContextPool:
+    """
+    Spreads renders over a few browser contexts per domain and recycles them.
+
+    Every domain gets contexts_per_domain contexts used in turn (so a slow site can't fill
+    the shared browser and cookies don't leak across sites). After max_renders renders a
+    context is retired: new requests go to a fresh one and the old one is closed once its
+    last in-flight render is done, which gives back the memory its pages piled up.
+
+    A domain with no render in flight closes all its contexts too. scrapy-playwright waits for
+    a free context (PLAYWRIGHT_MAX_CONTEXTS) without a timeout, so contexts of a domain that
+    stopped rendering must not hold the slots other domains are waiting for.
+    """
+
+    def __init__(self, contexts_per_domain=2, max_renders=40):
+        self.contexts_per_domain = max(1, contexts_per_domain)
+        self.max_renders = max(1, max_renders)
+        self.next_slot = {} # domain -> slot handed out next
+        self.generations = {} # (domain, slot) -> current generation
+        self.renders = {} # context name -> renders handed out
+        self.in_flight = {} # context name -> renders not released yet
+        self.domain_in_flight = {} # domain -> renders not released yet
+        self.domains = {} # context name -> domain
+        self.contexts = {} # context name -> browser context, once it's open
+        self.retired = set()
+
+    def acquire(self, domain):
+        slot = self.next_slot.get(domain, 0)
+        self.next_slot[domain] = (slot + 1) % self.contexts_per_domain
+        key = (domain, slot)
+        name = f'{domain}-{slot}-{self.generations.get(key, 0)}'
+        self.domains[name] = domain
+        self.renders[name] = self.renders.get(name, 0) + 1
+        self.in_flight[name] = self.in_flight.get(name, 0) + 1
+        self.domain_in_flight[domain] = self.domain_in_flight.get(domain, 0) + 1
+        if self.renders[name] >= self.max_renders:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self.retired.add(name)
+        return name
+
+    def opened(self, name, context):
+        """Remembers the browser context behind name (page.context of one of its renders), so it can be closed later."""
+        if name:
+            self.contexts[name] = context
+
+    def release(self, name):
+        """Marks one render of the context done. Returns the browser contexts that should now be closed."""
+        if not name or name not in self.domains:
+            return []
+        closing = []
+        left = self.in_flight.get(name, 0) - 1
+        if left > 0:
+            self.in_flight[name] = left
+        else:
+            self.in_flight.pop(name, None)
+            if name in self.retired:
+                self.retired.discard(name)
+                closing.append(name)
+        domain = self.domains[name]
+        left = self.domain_in_flight.get(domain, 0) - 1
+        if left > 0:
+            self.domain_in_flight[domain] = left
+        else:
+            # the domain went quiet, none of its contexts keeps a slot of the browser
+            self.domain_in_flight.pop(domain, None)
+            closing += [n for n, d in self.domains.items() if d == domain and n not in self.in_flight and n not in closing]
+        contexts = []
+        for n in closing:
+            self.renders.pop(n, None)
+            self.domains.pop(n, None)
+            context = self.contexts.pop(n, None)
+            if context is not None:
+                contexts.append(context)
+        return contexts
+
+
+async def harvest_product_links(page, selector=PRODUCT_LINK_SELECTOR, load_more_selector=LOAD_MORE_SELECTOR,
+                                max_rounds=20, idle_rounds=2, wait_ms=800):
+    """
+    Callable PageMethod for infinite-scroll / "load more" listings.
+
+    Scrolls to the bottom (clicking a load-more button when there is one) until the number of
+    product anchors stops growing for idle_rounds rounds or max_rounds is reached, and returns
+    every product link seen, in order. Links are collected on each round, so virtualized
+    lists that drop off-screen rows still give all of them.
+    """
+    seen = {}
+    idle = 0
+    for _ in range(max_rounds):
+        hrefs = await page.eval_on_selector_all(selector, 'els => els.map(e => e.href)')
+        before = len(seen)
+        for href in hrefs:
+            if href:
+                seen.setdefault(href, None)
+        if len(seen) == before:
+            idle += 1
+            if idle >= idle_rounds:
+                break
+        else:
+            idle = 0
+        await page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
+        try:
+            button = page.locator(load_more_selector).first
+            if await button.is_visible():
+                await button.click(timeout=1000)
+        except Exception as e: # no button, detached, covered...
+            logger.debug(f"No load more click on {page.url}: {e}")
+        await page.wait_for_timeout(wait_ms)
+    return list(seen)
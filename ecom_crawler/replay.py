@@ -0,0 +1,262 @@
+import gzip
+import json
+import logging
+import random
+import time
+import zlib
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers, Response
+from scrapy.responsetypes import responsetypes
+from twisted.internet.task import deferLater
+from w3lib.url import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+HTTP = 'http'
+BROWSER = 'browser'
+
+# Hop-by-hop / encoding headers that no longer describe the stored (decoded) body
+_DROPPED_HEADERS = (b'Content-Encoding', b'Content-Length', b'Transfer-Encoding')
+
+_GZIP_MEMBER = b'\x1f\x8b\x08' # magic + deflate, the start of every run's gzip member
+
+
+def record_key(url, rendered=False):
+    return f"{BROWSER if rendered else HTTP} {canonicalize_url(url)}"
+
+
+class ArchiveWriter:
+    """
+    Appends responses to a gzipped, WARC-like archive: every record is one JSON header line
+    (url, status, headers, rendered, length, or alias_of for a redirect) followed by the body.
+    A run writes one gzip member, so archives can be appended to. A crash only loses the run's
+    torn last record, the runs appended after it are still read (see iter_archive).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'ab')
+        self.records = 0
+
+    def _write(self, header, body=b''):
+        header['length'] = len(body)
+        self.file.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.file.write(body + b'\n')
+        self.records += 1
+
+    def write(self, url, status, headers, body, rendered=False, page_method_results=None):
+        stored = {}
+        for name, values in (headers or {}).items():
+            name = name if isinstance(name, bytes) else name.encode('latin-1')
+            if name.title() in _DROPPED_HEADERS:
+                continue
+            values = values if isinstance(values, list) else [values]
+            stored[name.decode('latin-1')] = [v.decode('latin-1') if isinstance(v, bytes) else str(v) for v in values]
+        header = {'url': url, 'status': status, 'headers': stored, 'rendered': rendered, 'recorded_at': time.time()}
+        if page_method_results:
+            header['page_method_results'] = page_method_results
+        self._write(header, body)
+
+    def alias(self, url, target_url, rendered=False):
+        """Records that url redirected to target_url."""
+        self._write({'url': url, 'alias_of': target_url, 'rendered': rendered})
+
+    def close(self):
+        self.file.close()
+
+
+def page_method_results(meta):
+    """JSON-able results of the Playwright page methods (e.g. links harvested while scrolling), by position."""
+    results = {}
+    for i, page_method in enumerate(meta.get('playwright_page_methods') or ()):
+        result = getattr(page_method, 'result', None)
+        if isinstance(result, (list, dict, str, int, float)):
+            results[str(i)] = result
+    return results
+
+
+def iter_archive(path):
+    """
+    Yields (header, body) of every record. A gzip member cut short by a crashed run loses its
+    torn record only: reading resyncs on the next member, which the following run appended.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    start = 0
+    while start < len(raw):
+        member = {}
+        yield from _member_records(raw, start, member)
+        if 'end' in member:
+            start = member['end']
+            continue
+        logger.warning(f"Archive {path} has a torn record in the run starting at byte {start}, skipping it")
+        start = raw.find(_GZIP_MEMBER, start + 1)
+        if start < 0:
+            return
+
+
+def _member_records(raw, start, member, chunk_size=1024 * 1024):
+    # records of the gzip member at raw[start:], member['end'] is set when it ended cleanly
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending, pos = b'', start
+    try:
+        while not decompressor.eof:
+            if pos >= len(raw):
+                return # cut short
+            chunk = raw[pos:pos + chunk_size]
+            pos += len(chunk)
+            pending += decompressor.decompress(chunk)
+            offset = 0
+            while True:
+                newline = pending.find(b'\n', offset)
+                if newline < 0:
+                    break
+                header = json.loads(pending[offset:newline])
+                end = newline + 1 + header.get('length', 0)
+                if len(pending) <= end:
+                    break
+                if pending[end:end + 1] != b'\n':
+                    return # not a record boundary
+                yield header, pending[newline + 1:end]
+                offset = end + 1
+            pending = pending[offset:]
+    except (zlib.error, ValueError, AttributeError):
+        return
+    if not pending:
+        member['end'] = pos - len(decompressor.unused_data)
+
+
+class ReplayArchive:
+    def __init__(self, records=None):
+        self.records = records or {} # record_key -> (header, body)
+
+    @classmethod
+    def load(cls, path):
+        records = {}
+        for header, body in iter_archive(path):
+            records[record_key(header['url'], header.get('rendered', False))] = (header, body)
+        return cls(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, url, rendered=False):
+        """Record for url, a rendered request falls back to the plain HTTP capture. None when unknown."""
+        if rendered:
+            found = self.records.get(record_key(url, True))
+            if found is not None:
+                return found
+        return self.records.get(record_key(url, False))
+
+
+class RecordMiddleware:
+    """
+    Downloader middleware capturing every response the spider gets (decoded, Playwright renders
+    included) into REPLAY_RECORD_FILE. Sits before HttpCompressionMiddleware so bodies are
+    stored decompressed. Run with EARLY_ABORT_ENABLED=False to keep full bodies.
+    """
+
+    def __init__(self, path):
+        self.writer = ArchiveWriter(path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('REPLAY_RECORD_FILE')
+        if not path:
+            raise NotConfigured
+        mw = cls(path)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def process_response(self, request, response, spider):
+        rendered = bool(request.meta.get('playwright'))
+        results = page_method_results(request.meta) if rendered else None
+        self.writer.write(response.url, response.status, response.headers, response.body, rendered, results)
+        for url in response.meta.get('redirect_urls', ()):
+            self.writer.alias(url, response.url, rendered)
+        return response
+
+    def spider_closed(self, spider):
+        self.writer.close()
+        spider.logger.info(f"Recorded {self.writer.records} responses to {self.writer.path}")
+
+
+class ReplayDownloadHandler:
+    """
+    Download handler serving every request from a recorded archive (REPLAY_ARCHIVE), for
+    offline runs and benchmarks. Each response is delayed by REPLAY_LATENCY seconds
+    +/- REPLAY_JITTER (REPLAY_RENDER_LATENCY more for Playwright requests), drawn from a
+    generator seeded with REPLAY_SEED so runs are repeatable. Unknown URLs get a 404, and
+    conditional requests matching the recorded ETag / Last-Modified a 304.
+    """
+
+    lazy = False
+
+    def __init__(self, settings, crawler=None):
+        path = settings.get('REPLAY_ARCHIVE')
+        if not path:
+            raise NotConfigured('REPLAY_ARCHIVE is not set')
+        self.archive = ReplayArchive.load(path)
+        self.latency = settings.getfloat('REPLAY_LATENCY', 0.0)
+        self.jitter = settings.getfloat('REPLAY_JITTER', 0.0)
+        self.render_latency = settings.getfloat('REPLAY_RENDER_LATENCY', 0.0)
+        self.random = random.Random(settings.getint('REPLAY_SEED', 0))
+        self.stats = crawler.stats if crawler is not None else None
+        logger.info(f"Replaying {len(self.archive)} records from {path}")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        rendered = bool(request.meta.get('playwright'))
+        delay = self.latency + (self.render_latency if rendered else 0.0)
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        delay = max(0.0, delay)
+        from twisted.internet import reactor # the one Scrapy installed, not a default one at import time
+        return deferLater(reactor, delay, self._response, request, rendered, delay)
+
+    def _response(self, request, rendered, delay):
+        request.meta['download_latency'] = delay
+        found = self.archive.lookup(request.url, rendered)
+        if found is None:
+            self._inc('replay/miss')
+            return responsetypes.from_args(url=request.url)(url=request.url, status=404, request=request, flags=['replay'])
+        header, body = found
+        if 'alias_of' in header:
+            self._inc('replay/redirect')
+            headers = Headers({'Location': header['alias_of']})
+            return responsetypes.from_args(url=request.url)(url=request.url, status=301, headers=headers, request=request, flags=['replay'])
+        headers = Headers(header.get('headers') or {})
+        if not rendered and _not_modified(request.headers, headers):
+            # conditional request of a recrawl (see recrawl.py), answered like the server would
+            self._inc('replay/not_modified')
+            validators = Headers({name: headers.getlist(name) for name in (b'ETag', b'Last-Modified') if name in headers})
+            return Response(url=header['url'], status=304, headers=validators, request=request, flags=['replay'])
+        self._inc('replay/hit')
+        if rendered:
+            # the page methods didn't run, hand back what they returned while recording
+            page_methods = request.meta.get('playwright_page_methods') or ()
+            for i, result in (header.get('page_method_results') or {}).items():
+                if int(i) < len(page_methods):
+                    page_methods[int(i)].result = result
+        respcls = responsetypes.from_args(headers=headers, url=header['url'], body=body)
+        return respcls(url=header['url'], status=header.get('status', 200), headers=headers, body=body, request=request, flags=['replay'])
+
+    def _inc(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+    def close(self):
+        pass
+
+
+def _not_modified(request_headers, headers):
+    etag = request_headers.get(b'If-None-Match')
+    if etag is not None:
+        return etag == headers.get(b'ETag')
+    since = request_headers.get(b'If-Modified-Since')
+    return since is not None and since == headers.get(b'Last-Modified')
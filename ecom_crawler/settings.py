@@ -15,7 +15,7 @@ USER_AGENT = 'ecom_crawler (+http://justCrawlingForFun.com)'
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_5_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 CONCURRENT_REQUESTS = 16 # Depending on the machine, can be adjusted
-CONCURRENT_REQUESTS_PER_DOMAIN = 4 # domains should't be overburdened
+CONCURRENT_REQUESTS_PER_DOMAIN = 4 # domains should't be overburdened (the http lane's concurrency when DOWNLOAD_LANES_ENABLED, see below)
 DOWNLOAD_DELAY = 0.5 # Start with a delay, let AutoThrottle adjust if enabled
 AUTOTHROTTLE_ENABLED = True
 AUTOTHROTTLE_START_DELAY = 1
@@ -24,14 +24,132 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = 4.0 # Aim for average 4 requests/domain concur
 # AUTOTHROTTLE_DEBUG = True # Enable to see throttling decisions
 
 
+# --- Middlewares ---
+DOWNLOADER_MIDDLEWARES = {
+    'ecom_crawler.middlewares.EarlyAbortDownloaderMiddleware': 950,
+    'ecom_crawler.middlewares.EcomCrawlerDownloaderMiddleware': 900, # fetch latency metrics
+    'ecom_crawler.replay.RecordMiddleware': 100, # only active with REPLAY_RECORD_FILE, sees decoded bodies
+    'ecom_crawler.recrawl.RecrawlMiddleware': 580, # only active with RECRAWL_STATE_FILE, hashes decoded bodies
+    'ecom_crawler.lanes.DownloadLaneMiddleware': 960, # http / browser download slots per domain
+}
+SPIDER_MIDDLEWARES = {
+    'ecom_crawler.middlewares.EcomCrawlerSpiderMiddleware': 543, # response / product metrics and their export
+}
+
+# --- Early abort of downloads (ecom_crawler/middlewares.py) ---
+EARLY_ABORT_ENABLED = True
+# anything else (images, pdf, video, css, js...) is dropped as soon as the headers arrive
+EARLY_ABORT_ALLOWED_TYPES = [
+    'text/html', 'application/xhtml+xml', 'text/xml', 'application/xml', 'application/json', 'text/plain',
+    'application/gzip', 'application/x-gzip', 'application/octet-stream', # .xml.gz sitemaps
+]
+# max HTML bytes read per page type, 0 means no cap
+EARLY_ABORT_BYTE_CAPS = {'product': 1024 * 1024, 'listing': 3 * 1024 * 1024, 'unknown': 1536 * 1024}
+EARLY_ABORT_TAIL_BYTES = 32 * 1024 # read after the first product signal of a product URL before stopping
+
+# --- Metrics (ecom_crawler/metrics.py) ---
+METRICS_PROMETHEUS_FILE = 'metrics.prom' # Prometheus text format, e.g. for node_exporter's textfile collector
+METRICS_JSON_FILE = 'metrics.json' # same numbers plus the Scrapy stats as a JSON snapshot
+METRICS_EXPORT_INTERVAL = 60 # seconds between exports, they are also written when the spider closes
+
 # --- Crawling Strategy ---
 DEPTH_LIMIT = 0 # 0 means no limit, you can set > 0 to limit crawl depth if needed(in case its taking too long due to number of products)
 #DEPTH_PRIORITY = 1 # Try=> BFS (Breadth-First Search)
 
+# One priority queue per domain, served round-robin by least busy domain, so a huge domain can't starve the others
+SCHEDULER_PRIORITY_QUEUE = 'scrapy.pqueues.DownloaderAwarePriorityQueue'
+
+# Frontier scoring (ecom_crawler/frontier.py): product URLs first, then listings / pagination, then the rest
+FRONTIER_PRIORITIES = {'product': 100, 'listing': 50, 'unknown': 0}
+FRONTIER_YIELD_WEIGHT = 50 # priority added when every page of the domain / URL kind was or linked to a product
+FRONTIER_DEPTH_PENALTY = 1 # priority lost per link depth
+FRONTIER_DOMAIN_BUDGET = 0 # max requests scheduled per domain, 0 means no limit
+
+# Request-time URL normalization (ecom_crawler/url_normalizer.py): tracking / variant params are stripped and
+# Shopify's /collections/<handle>/products/<product> becomes /products/<product> before a request is scheduled,
+# so the same product isn't downloaded once per link flavour. Keys: '*', a platform ('shopify') or a domain,
+# a key given here replaces the built-in rule of the same key
+URL_NORMALIZATION = True
+URL_NORMALIZATION_RULES = {
+    # 'westside.com': {'strip_params': ['color', 'size'], 'rewrite': [[r'^/(women|men)/products/', '/products/']]},
+}
+
+# Links followed per page type (ecom_crawler/link_extraction.py): product / listing / unknown are URL kinds, pagination
+# is any ?page= style URL. Product pages only lead to related products and next pages by default
+LINK_FOLLOW_POLICIES = {
+    # 'product': ['product', 'pagination'],
+    # 'listing': ['product', 'listing', 'unknown'],
+    # 'unknown': ['product', 'listing', 'unknown'],
+}
+
+# --- Sitemap discovery (-a sitemaps=first|only) ---
+SITEMAP_MAX_DEPTH = 3 # how many levels of sitemap indexes are followed
+SITEMAP_MAX_AGE_DAYS = 0 # skip sitemap URLs whose lastmod is older than this, 0 keeps everything
+SITEMAP_FOLLOW_LISTINGS = False # also schedule collection / category URLs listed in sitemaps
+SITEMAP_SKIP_PATTERNS = [r'blog', r'article', r'news', r'sitemap_pages'] # child sitemaps not worth fetching
+
+# --- Shopify catalog ---
+SHOPIFY_CATALOG = True # harvest /products.json of Shopify stores instead of rendering collections
+SHOPIFY_PAGE_SIZE = 250 # products per products.json page (250 is Shopify's maximum)
+SHOPIFY_MAX_PAGES = 200 # stop paging a catalog / collection after this many pages
+
+# --- Product detection ---
+# Per-domain overrides of the product page scoring (see ecom_crawler/product_detection.py).
+# Signals: schema, json_ld, add_to_cart, price, title. Defaults: strong signals weigh 1.0,
+# price and title 0.5 each, threshold 1.0
+PRODUCT_DETECTION_POLICIES = {
+    # 'tatacliq.com': {'weights': {'price': 0.6}, 'threshold': 1.0},
+}
+
 ITEM_PIPELINES = {
-   'ecom_crawler.pipelines.GroupedOutputPipeline': 300,
+   # Streams products to per-domain segment files and merges them on close,
+   # swap for 'ecom_crawler.pipelines.GroupedOutputPipeline' to keep everything in memory
+   'ecom_crawler.pipelines.StreamingGroupedOutputPipeline': 300,
 }
 
+# --- Grouped output ---
+GROUPED_OUTPUT_FILE = 'grouped_products.json'
+GROUPED_OUTPUT_SEGMENT_DIR = '.crawl_segments' # per-domain JSONL segments of the streaming pipeline
+GROUPED_OUTPUT_FLUSH_ITEMS = 500 # items buffered before a batch is handed to the writer thread
+GROUPED_OUTPUT_MAX_PENDING_BATCHES = 4 # batches waiting for the writer before items are held back (backpressure)
+GROUPED_OUTPUT_FSYNC_INTERVAL = 30 # seconds between fsync checkpoints of the segments
+GROUPED_OUTPUT_MERGE_RUN_SIZE = 100000 # URLs sorted in memory at once by the final merge
+GROUPED_OUTPUT_RESUME = False # True keeps (and merges) segments left behind by a crashed run
+
+# URL dedup of the spider and the output pipeline, stored as 64-bit fingerprints (ecom_crawler/dedup.py)
+DEDUP_MODE = 'exact' # 'exact' (11-21 bytes per URL) or 'bloom' (fixed size, may skip a few unseen URLs)
+DEDUP_CAPACITY = 100000 # bloom mode: expected URLs per domain, memory is sized for this up front
+DEDUP_ERROR_RATE = 0.001 # bloom mode: false-positive rate at capacity
+
+# --- Sharded crawls (python -m ecom_crawler.sharding) ---
+SHARD_POLL_INTERVAL = 1.0 # seconds between polls of the coordinator: claims of new URLs, URLs handed over by other workers
+SHARD_STALE_SECONDS = 60 # a worker silent for this long is considered dead and no longer waited for
+
+# --- Record / replay (ecom_crawler/replay.py) ---
+REPLAY_RECORD_FILE = '' # e.g. fixtures.warc.gz: every response (Playwright renders too) is appended to this archive
+# Replay needs DOWNLOAD_HANDLERS pointed at 'ecom_crawler.replay.ReplayDownloadHandler', see benchmarks/bench_crawl.py
+REPLAY_ARCHIVE = '' # archive served by ReplayDownloadHandler
+REPLAY_LATENCY = 0.05 # seconds added to every replayed response...
+REPLAY_JITTER = 0.02 # ...plus or minus up to this much
+REPLAY_RENDER_LATENCY = 1.0 # extra seconds for Playwright requests
+REPLAY_SEED = 0 # seed of the jitter, same seed same delays
+
+# --- Download lanes (ecom_crawler/lanes.py) ---
+DOWNLOAD_LANES_ENABLED = True # separate downloader slots for plain HTTP and Playwright requests of each domain
+# Per lane: concurrency (max), target_concurrency (AutoThrottle's, for the delay), target_latency (seconds, the
+# concurrency is halved above it), start_delay / min_delay / max_delay (default: AUTOTHROTTLE_START_DELAY,
+# DOWNLOAD_DELAY, AUTOTHROTTLE_MAX_DELAY). Throttling only runs with AUTOTHROTTLE_ENABLED.
+# The http lane defaults to CONCURRENT_REQUESTS_PER_DOMAIN and AUTOTHROTTLE_TARGET_CONCURRENCY.
+DOWNLOAD_LANES = {
+    # 'http': {'concurrency': 4, 'target_concurrency': 4.0, 'target_latency': 3.0},
+    # 'browser': {'concurrency': 2, 'target_concurrency': 2.0, 'target_latency': 20.0},
+}
+
+# --- Incremental recrawls (ecom_crawler/recrawl.py) ---
+RECRAWL_STATE_FILE = '' # e.g. recrawl.sqlite: ETag / Last-Modified / body hash per URL, known products are fetched conditionally
+RECRAWL_DELTA_FILE = '' # e.g. product_delta.json: added / removed product URLs per domain since the last run
+RECRAWL_SNAPSHOT_DIR = '.product_snapshots' # sorted product URLs of the last run, what the delta is computed against
+
 #Playwright settings
 
 DOWNLOAD_HANDLERS = {
@@ -43,6 +161,24 @@ TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 
 PLAYWRIGHT_BROWSER_TYPE = "chromium"
 PLAYWRIGHT_LAUNCH_OPTIONS = {"headless": True}
+PLAYWRIGHT_ABORT_REQUEST = 'ecom_crawler.rendering.should_abort_request' # no images, fonts, css, media or trackers
+PLAYWRIGHT_MAX_CONTEXTS = 6 # browser contexts alive at once: with RENDER_CONTEXTS_PER_DOMAIN 3 domains render together, the others wait for one to go quiet
+PLAYWRIGHT_MAX_PAGES_PER_CONTEXT = 2 # concurrent pages per context
+
+# Rendering layer (ecom_crawler/rendering.py)
+RENDER_CONTEXTS_PER_DOMAIN = 2 # contexts each JS-rendered domain rotates through
+RENDER_CONTEXT_MAX_RENDERS = 40 # renders before a context is closed and replaced by a fresh one
+RENDER_SCROLL_MAX_ROUNDS = 20 # scroll / "load more" rounds per collection render
+RENDER_SCROLL_IDLE_ROUNDS = 2 # stop after this many rounds without new product links
+RENDER_SCROLL_WAIT_MS = 800 # wait after each scroll for the next batch to load
+
+# Render decisions (ecom_crawler/render_policy.py): listing templates are rendered only where the browser finds more products
+RENDER_DECISIONS_FILE = 'render_decisions.json' # decisions kept across runs, '' keeps them in memory only
+RENDER_SAMPLES = 2 # HTTP vs browser comparisons before a template is decided
+RENDER_RESAMPLE_EVERY = 500 # listing pages of a decided template between two re-samples
+RENDER_DECISION_MAX_AGE_DAYS = 30 # saved decisions older than this are measured again
+RENDER_MIN_GAIN = 0.2 # the browser must find 20% more product links...
+RENDER_MIN_EXTRA_LINKS = 3 # ...and at least this many more
 
 # Optional for performance:
 DOWNLOAD_HANDLERS_BASE = {
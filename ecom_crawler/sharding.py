@@ -0,0 +1,280 @@
+"""
+Sharded crawls: one Scrapy process per core, coordinated through a shared SQLite (WAL) file.
+
+    python -m ecom_crawler.sharding --workers 4 --domains virgio.com,westside.com,tatacliq.com --split westside.com
+
+Whole domains are dealt out to the workers. Domains passed with --split are crawled by every
+worker, each one fetching the URLs whose fingerprint falls in its hash range: links owned by
+another shard are handed over through the coordinator's frontier table, which is also the
+seen-set of those domains (a URL is claimed once, by whoever finds it first). When every
+worker is done the per-worker output segments are merged into the usual grouped JSON file.
+"""
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+from w3lib.url import canonicalize_url
+
+from ecom_crawler.dedup import fingerprint
+from ecom_crawler.pipelines import DEFAULT_OUTPUT_FILENAME, merge_segments, segment_domains, segment_path
+from ecom_crawler.recrawl import ProductDelta
+from ecom_crawler.url_classifier import url_domain
+
+logger = logging.getLogger(__name__)
+
+PENDING = 0
+TAKEN = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frontier (
+    url TEXT PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    callback TEXT NOT NULL,
+    playwright INTEGER NOT NULL DEFAULT 0,
+    state INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS frontier_shard ON frontier (shard, state);
+CREATE TABLE IF NOT EXISTS workers (
+    shard INTEGER PRIMARY KEY,
+    busy INTEGER NOT NULL DEFAULT 1,
+    updated REAL NOT NULL
+);
+"""
+
+
+class ShardCoordinator:
+    """
+    Shared seen-set and frontier of the split domains, plus the workers' busy / idle state.
+
+    Every call is its own transaction, so a claim is visible to the other workers right away.
+    A worker that hasn't sent a heartbeat for stale_after seconds is considered dead and stops
+    holding the others back. Workers talk to it from a thread (see sync), a write may wait up
+    to timeout seconds for another worker's lock. Calls must not overlap.
+    """
+
+    def __init__(self, path, shard=0, shards=1, split_domains=(), stale_after=60.0, timeout=30.0):
+        self.path = path
+        self.shard = shard
+        self.shards = max(1, shards)
+        self.split_domains = frozenset(split_domains)
+        self.stale_after = stale_after
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(_SCHEMA)
+
+    def reset(self):
+        """Launcher side: empties the store and registers every worker as busy, so none quits before the others start."""
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.execute('DELETE FROM frontier')
+        self.db.execute('DELETE FROM workers')
+        self.db.executemany('INSERT INTO workers (shard, busy, updated) VALUES (?, 1, ?)', [(s, now) for s in range(self.shards)])
+        self.db.execute('COMMIT')
+
+    def close(self):
+        self.db.close()
+
+    def owner(self, url):
+        """Shard fetching url, None when its domain isn't split (whoever has the domain crawls it)."""
+        if url_domain(url) not in self.split_domains:
+            return None
+        return fingerprint(canonicalize_url(url)) % self.shards
+
+    def starts(self, domain):
+        """Whether this shard fetches the start pages (root, robots.txt, sitemaps) of domain."""
+        return domain not in self.split_domains or fingerprint(domain) % self.shards == self.shard
+
+    def claim(self, url, callback, playwright=False, owner=None):
+        """Adds url to the shared frontier for its owner. False when some worker claimed it already."""
+        return self.claim_many([(url, callback, playwright, owner)])[0]
+
+    def claim_many(self, claims):
+        """claim() for a list of (url, callback, playwright, owner) in one transaction, returns a flag per claim."""
+        if not claims:
+            return []
+        claimed = []
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for url, callback, playwright, owner in claims:
+                owner = self.owner(url) if owner is None else owner
+                cursor = self.db.execute(
+                    'INSERT OR IGNORE INTO frontier (url, shard, callback, playwright, state) VALUES (?, ?, ?, ?, ?)',
+                    (canonicalize_url(url), owner, callback, int(bool(playwright)), TAKEN if owner == self.shard else PENDING),
+                )
+                claimed.append(cursor.rowcount == 1)
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def take(self, limit=500):
+        """Returns (url, callback, playwright) handed over to this shard and marks them taken (and the worker busy)."""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self.db.execute(
+                'SELECT rowid, url, callback, playwright FROM frontier WHERE shard = ? AND state = ? LIMIT ?',
+                (self.shard, PENDING, limit),
+            ).fetchall()
+            if rows:
+                self.db.executemany('UPDATE frontier SET state = ? WHERE rowid = ?', [(TAKEN, row[0]) for row in rows])
+                self.db.execute('UPDATE workers SET busy = 1, updated = ? WHERE shard = ?', (time.time(), self.shard))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return [(url, callback, bool(playwright)) for _, url, callback, playwright in rows]
+
+    def heartbeat(self, busy):
+        self.db.execute(
+            'INSERT OR REPLACE INTO workers (shard, busy, updated) VALUES (?, ?, ?)', (self.shard, int(bool(busy)), time.time())
+        )
+
+    def sync(self, claims=(), busy=False, limit=500):
+        """
+        One poll of a worker: claims the (url, callback, playwright, owner) found since the last one,
+        takes the URLs handed over to it and sends the heartbeat. Returns (claimed flags, taken, finished).
+        """
+        claimed = self.claim_many(list(claims))
+        taken = self.take(limit)
+        if not taken:
+            self.heartbeat(busy)
+        return claimed, taken, self.finished()
+
+    def release(self):
+        """Worker side, on close: not busy any more, so the others don't wait for it."""
+        self.heartbeat(False)
+        self.close()
+
+    def finished(self):
+        """True once no live worker is busy and nothing is waiting to be taken by one."""
+        alive = time.time() - self.stale_after
+        busy = self.db.execute('SELECT COUNT(*) FROM workers WHERE busy = 1 AND updated >= ?', (alive,)).fetchone()[0]
+        if busy:
+            return False
+        pending = self.db.execute(
+            'SELECT COUNT(*) FROM frontier WHERE state = ? AND shard IN (SELECT shard FROM workers WHERE updated >= ?)',
+            (PENDING, alive),
+        ).fetchone()[0]
+        return pending == 0
+
+    def counts(self):
+        """(claimed, handed over and still pending) URLs."""
+        claimed = self.db.execute('SELECT COUNT(*) FROM frontier').fetchone()[0]
+        pending = self.db.execute('SELECT COUNT(*) FROM frontier WHERE state = ?', (PENDING,)).fetchone()[0]
+        return claimed, pending
+
+
+def assign_domains(domains, workers, split_domains=()):
+    """Deals the unsplit domains out round-robin, every worker also gets the split ones."""
+    whole = [d for d in domains if d not in split_domains]
+    return [whole[i::workers] + [d for d in domains if d in split_domains] for i in range(workers)]
+
+
+def _worker_path(path, shard):
+    # metrics.prom -> metrics.2.prom
+    root, ext = os.path.splitext(path)
+    return f'{root}.{shard}{ext}'
+
+
+def main(argv=None):
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser(prog='python -m ecom_crawler.sharding', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--domains', required=True)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--split', default='', help='domains crawled by every worker, split by URL hash')
+    parser.add_argument('--workdir', default='.shards', help='coordinator and per-worker segments')
+    parser.add_argument('--output', help='grouped JSON file, GROUPED_OUTPUT_FILE by default')
+    parser.add_argument('--keep', action='store_true', help='keep the workdir after merging')
+    parser.add_argument('-a', dest='spider_args', action='append', default=[], metavar='NAME=VALUE')
+    parser.add_argument('-s', dest='settings', action='append', default=[], metavar='NAME=VALUE')
+    args = parser.parse_args(argv)
+
+    settings = get_project_settings()
+    for value in args.settings:
+        name, _, setting = value.partition('=')
+        settings.set(name, setting, priority='cmdline')
+    domains = [d.strip() for d in args.domains.split(',') if d.strip()]
+    split_domains = [d.strip() for d in args.split.split(',') if d.strip()]
+    unknown = [d for d in split_domains if d not in domains]
+    if unknown:
+        parser.error(f"--split domains not in --domains: {', '.join(unknown)}")
+    workers = args.workers if split_domains else min(args.workers, len(domains))
+    assignments = assign_domains(domains, workers, split_domains)
+
+    shutil.rmtree(args.workdir, ignore_errors=True)
+    os.makedirs(args.workdir)
+    coordinator_path = os.path.join(args.workdir, 'coordinator.sqlite')
+    coordinator = ShardCoordinator(coordinator_path, shards=workers, split_domains=split_domains)
+    coordinator.reset()
+
+    processes = []
+    for shard, worker_domains in enumerate(assignments):
+        command = [sys.executable, '-m', 'scrapy', 'crawl', 'ecom_product_spider']
+        for value in args.spider_args:
+            name, _, path = value.partition('=')
+            if name == 'resume' and path:
+                # one crawl state per worker: a shared SQLite file would lock, and each worker resumes its own frontier
+                value = f'resume={_worker_path(path, shard)}'
+            command += ['-a', value]
+        for value in args.settings:
+            command += ['-s', value]
+        # the per-worker options come last so they win over a -a / -s of the same name
+        command += [
+            '-a', f"domains={','.join(worker_domains)}",
+            '-a', f'shard={shard}/{workers}',
+            '-a', f'coordinator={coordinator_path}',
+            '-a', f"split_domains={','.join(split_domains)}",
+            '-s', f"GROUPED_OUTPUT_FILE={os.path.join(args.workdir, f'worker-{shard}.json')}",
+            '-s', f"GROUPED_OUTPUT_SEGMENT_DIR={os.path.join(args.workdir, f'segments-{shard}')}",
+            '-s', 'GROUPED_OUTPUT_RESUME=True', # segments are kept for the merge below
+        ]
+        for name in ('METRICS_PROMETHEUS_FILE', 'METRICS_JSON_FILE'):
+            if settings.get(name):
+                command += ['-s', f'{name}={_worker_path(settings.get(name), shard)}']
+        if settings.get('RECRAWL_STATE_FILE'):
+            # one recrawl store per worker (no lock contention), a shard keeps its URLs as long as --workers doesn't change
+            command += ['-s', f"RECRAWL_STATE_FILE={_worker_path(settings.get('RECRAWL_STATE_FILE'), shard)}"]
+        command += ['-s', 'RECRAWL_DELTA_FILE='] # the delta is computed on the merged output below
+        logger.info(f"Starting worker {shard}: {', '.join(worker_domains)}")
+        processes.append(subprocess.Popen(command))
+
+    failed = []
+    for shard, process in enumerate(processes):
+        if process.wait() != 0:
+            failed.append(shard)
+    claimed, pending = coordinator.counts()
+    coordinator.close()
+    if failed:
+        print(f"Workers {', '.join(map(str, failed))} exited with an error, merging what they wrote", file=sys.stderr)
+    if pending:
+        print(f"{pending} handed-over URLs were never crawled (their worker died)", file=sys.stderr)
+
+    segment_files = {}
+    for shard in range(workers):
+        segment_dir = os.path.join(args.workdir, f'segments-{shard}')
+        for domain in segment_domains(segment_dir):
+            segment_files.setdefault(domain, []).append(segment_path(segment_dir, domain))
+    output = args.output or settings.get('GROUPED_OUTPUT_FILE', DEFAULT_OUTPUT_FILENAME)
+    delta = ProductDelta.from_settings(settings)
+    merge_segments(os.path.join(args.workdir, 'merge'), output, domains, settings.getint('GROUPED_OUTPUT_MERGE_RUN_SIZE', 100000),
+                   segment_files, track=delta.track if delta is not None else None)
+    if delta is not None:
+        for domain, (added, removed) in delta.write().items():
+            print(f"Product delta for {domain}: {added} added, {removed} removed")
+    print(f"Merged {workers} workers into {output} ({claimed} URLs of split domains claimed)")
+    if not args.keep:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import json
+import re
+from urllib.parse import parse_qs, urlsplit
+
+SHOPIFY = 'shopify'
+OTHER = 'other'
+
+# Markers Shopify storefronts put in their pages / robots.txt
+_BODY_MARKERS = re.compile(rb'cdn\.shopify\.com|Shopify\.theme|ShopifyAnalytics|\.myshopify\.com|we use Shopify as our ecommerce platform')
+_HEADER_MARKERS = (b'X-ShopId', b'X-Shopify-Stage', b'X-Sorting-Hat-ShopId')
+
+_COLLECTION_HANDLE = re.compile(r'/collections/([^/?#]+)')
+
+
+def detect_platform(response):
+    """Returns SHOPIFY when headers or body give the store away, None otherwise."""
+    headers = response.headers
+    if any(name in headers for name in _HEADER_MARKERS) or b'shopify' in (headers.get(b'Powered-By') or b'').lower():
+        return SHOPIFY
+    if _BODY_MARKERS.search(response.body):
+        return SHOPIFY
+    return None
+
+
+def site_root(url):
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def collection_handle(url):
+    m = _COLLECTION_HANDLE.search(url)
+    return m.group(1) if m else None
+
+
+def catalog_url(root, handle=None, page=1, limit=250):
+    """/products.json of the whole store, or /collections/<handle>/products.json of one collection."""
+    path = f'/collections/{handle}/products.json' if handle else '/products.json'
+    return f'{root}{path}?limit={limit}&page={page}'
+
+
+def parse_catalog_url(url):
+    """Inverse of catalog_url: (root, handle or None, page, limit)."""
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    page = int(query.get('page', ['1'])[0])
+    limit = int(query.get('limit', ['30'])[0])
+    return f'{parts.scheme}://{parts.netloc}', collection_handle(parts.path), page, limit
+
+
+def catalog_product_urls(body, root):
+    """
+    Product URLs of one products.json page and the number of products it held
+    (a full page means there may be another one). Raises ValueError when it isn't a catalog page.
+    """
+    data = json.loads(body)
+    products = data.get('products') if isinstance(data, dict) else None
+    if not isinstance(products, list):
+        raise ValueError('no products list in the response')
+    urls = [f'{root}/products/{product["handle"]}' for product in products if isinstance(product, dict) and product.get('handle')]
+    return urls, len(products)
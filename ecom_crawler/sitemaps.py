@@ -0,0 +1,129 @@
+import re
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from lxml import etree
+
+URLSET = 'urlset'
+SITEMAPINDEX = 'sitemapindex'
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# kind is 'url' (a page) or 'sitemap' (child of a sitemap index), lastmod is an aware datetime or None
+SitemapEntry = namedtuple('SitemapEntry', ['kind', 'loc', 'lastmod'])
+
+# robots.txt answers that mean "no robots.txt": parse_robots gets them and tries /sitemap.xml.
+# Redirects are not in the list, RedirectMiddleware still follows them (virgio.com -> www.virgio.com)
+ROBOTS_MISSING_STATUSES = [401, 403, 404, 410, 429, 500, 502, 503, 504]
+
+_ROBOTS_SITEMAP = re.compile(r'^\s*sitemap\s*:\s*(\S+)', re.IGNORECASE | re.MULTILINE)
+
+
+class SitemapTooLarge(Exception):
+    pass
+
+
+def robots_sitemaps(text):
+    """Sitemap URLs declared in a robots.txt body (Sitemap: lines), in order, without duplicates."""
+    seen = []
+    for url in _ROBOTS_SITEMAP.findall(text):
+        if url not in seen:
+            seen.append(url)
+    return seen
+
+
+def parse_lastmod(value):
+    """W3C datetime ('2024-05-01', '2024-05-01T10:00:00+05:30', ...Z) to an aware datetime, None if unparsable."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = datetime.strptime(value[:10], '%Y-%m-%d')
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _decompressed_chunks(body, chunk_size, max_size):
+    """Yields the (possibly gzipped) body in chunks of at most chunk_size bytes, gunzipping on the fly."""
+    if not body.startswith(GZIP_MAGIC):
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+        return
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    total = 0
+    for start in range(0, len(body), chunk_size):
+        data = body[start:start + chunk_size]
+        while data:
+            out = decompressor.decompress(data, chunk_size)
+            data = decompressor.unconsumed_tail
+            total += len(out)
+            if max_size and total > max_size:
+                raise SitemapTooLarge(f"sitemap larger than {max_size} bytes once decompressed")
+            if out:
+                yield out
+        if decompressor.eof:
+            break
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def iter_sitemap(body, chunk_size=64 * 1024, max_size=None):
+    """
+    Streams the entries of a sitemap or sitemap index (plain or gzipped XML).
+
+    The body is gunzipped and fed to an incremental parser chunk by chunk, every <url> /
+    <sitemap> element is yielded as a SitemapEntry and dropped right away, so memory stays
+    flat whatever the number of entries. Entity resolution and network access are off.
+    """
+    parser = etree.XMLPullParser(events=('end',), resolve_entities=False, no_network=True,
+                                 remove_comments=True, huge_tree=True)
+    for chunk in _decompressed_chunks(body, chunk_size, max_size):
+        parser.feed(chunk)
+        yield from _drain(parser)
+    parser.close()
+    yield from _drain(parser)
+
+
+def _drain(parser):
+    for _, element in parser.read_events():
+        kind = _local(element.tag)
+        if kind not in ('url', 'sitemap'):
+            continue
+        loc = lastmod = None
+        for child in element:
+            name = _local(child.tag)
+            if name == 'loc':
+                loc = (child.text or '').strip()
+            elif name == 'lastmod':
+                lastmod = parse_lastmod(child.text)
+        # free what was parsed so far
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+        if loc:
+            yield SitemapEntry(kind, loc, lastmod)
+
+
+def lastmod_priority(lastmod, now=None, window_days=365):
+    """Request priority from lastmod: fresher entries first, 0 for undated or older than window_days."""
+    if lastmod is None:
+        return 0
+    now = now or datetime.now(timezone.utc)
+    age_days = (now - lastmod).days
+    return max(0, min(window_days, window_days - age_days))
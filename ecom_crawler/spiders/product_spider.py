@@ -1,52 +1,31 @@
-import json
 import scrapy
-from scrapy.linkextractors import LinkExtractor
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.spiders import CrawlSpider, Rule
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 import re
 from ecom_crawler.items import ProductItem
 from w3lib.url import canonicalize_url
 import logging
 logger = logging.getLogger(__name__)
 from scrapy_playwright.page import PageMethod
-
-PRODUCT_PATH_PATTERNS = [
-    r'/p/', r'/product/', r'/products/[^/]+', r'/products/',
-    r'/.*/p-[^/]+$',#for tatacliq
-    r'/item/', r'/dp/', r'/goods/',
-    r'/[a-zA-Z0-9\-]+-p-\d+',
-    r'https?://(?:www\.)?westside\.com/products/[^/?#]+',
-    r'https?://(?:www\.)?tatacliq\.com/products/[^/?#]+',
-    r'https?://(?:www\.)?nykaafashion\.com/products/[^/?#]+',
-    r'https?://(?:www\.)?virgio\.com/products/[^/?#]+',
-]
-
-PRODUCT_PATH_REGEX = [re.compile(p, re.IGNORECASE) for p in PRODUCT_PATH_PATTERNS]
-
-LISTING_PATH_PATTERNS = [
-    r'/c/', r'/category/', r'/categories/', r'/collections/', r'/shop/', r'/all/',  r'/.*/c-[^/]+$'
-]
-LISTING_PATH_REGEX = [re.compile(p, re.IGNORECASE) for p in LISTING_PATH_PATTERNS]
-
-PATHS_CONTAINING_PRODUCTS_IN_SCRIPTS_PATTERNS = [r'/collections/']
-
-PATHS_CONTAINING_PRODUCTS_IN_SCRIPTS_REGEX = [re.compile(p, re.IGNORECASE) for p in PATHS_CONTAINING_PRODUCTS_IN_SCRIPTS_PATTERNS]
-
-ADD_TO_CART_SELECTORS = [
-    'button[id*="add-to-cart"]',
-    'button[class*="add-to-cart"]',
-    'button[data-action*="add-to-cart"]',
-    'input[type="submit"][value*="Add to Cart"]',
-    'button:contains("Add to Bag")', 
-    'button:contains("Buy Now")',
-    'form[action*="cart/add"]'
-]
-PRICE_SELECTORS = [
-    '[class*="price"]', '[id*="price"]',
-    '[itemprop="price"]',
-    '.product-price', '.Price--final', '.selling-price' # Add site-specific ones
-]
-PRODUCT_SCHEMA_SELECTOR = '[itemtype*="schema.org/Product"]'
+from ecom_crawler.url_classifier import LISTING, PRODUCT, UNKNOWN, classify_url, default_classifier, url_domain
+from ecom_crawler.product_detection import ProductDetector
+from ecom_crawler.crawl_state import CrawlState
+from ecom_crawler.dedup import DedupStore
+from ecom_crawler.sitemaps import ROBOTS_MISSING_STATUSES, SitemapTooLarge, iter_sitemap, lastmod_priority, robots_sitemaps
+from ecom_crawler.shopify import SHOPIFY, OTHER, catalog_product_urls, catalog_url, collection_handle, detect_platform, parse_catalog_url, site_root
+from ecom_crawler.rendering import PRODUCT_LINK_SELECTOR, ContextPool, harvest_product_links
+from ecom_crawler.render_policy import HTTP, SAMPLE, RenderPolicy, count_links
+from ecom_crawler.frontier import FrontierScorer
+from ecom_crawler.metrics import CrawlMetrics
+from ecom_crawler.sharding import ShardCoordinator
+from ecom_crawler.url_normalizer import UrlNormalizer
+from ecom_crawler.recrawl import RecrawlStore
+from ecom_crawler.link_extraction import PAGE, SITEMAP, PageLinkExtractor
+from twisted.internet import defer, task, threads
+from lxml import etree
+from datetime import datetime, timezone
 
 
 class EcomProductSpider(CrawlSpider):
@@ -65,190 +44,719 @@ class EcomProductSpider(CrawlSpider):
     # scrapy crawl ecom_product_spider -a domains="virgio.com,westside.com,tatacliq.com,nykaafashion.com" 
     # run above command to run on all 4 mentioned domains
     # add -s LOG_FILE=log.txt -s LOG_LEVEL=INFO at the end to check the logs from the log file and find denyable URL patterns
+    # add -a resume=crawl_state.sqlite to persist found products and the frontier, rerunning with the same file resumes the crawl
+    # add -a sitemaps=first to discover products from robots.txt / sitemap.xml before the link crawl,
+    # or -a sitemaps=only to skip the link crawl (it still runs for domains without a usable sitemap)
+    # to use every core, run python -m ecom_crawler.sharding --workers 4 --domains ... instead (see ecom_crawler/sharding.py)
 
     def __init__(self, *args, **kwargs):
         # Get domains from command line argument, split by comma
         self.domains_input = kwargs.pop('domains', '').split(',')
         self.allowed_domains = [d.strip() for d in self.domains_input if d.strip()]
         self.start_urls = [f"https://{d}" for d in self.allowed_domains]
-        self.visited_collections = set()
 
-        # We will be using Playwright to access JS-rendered links but we want to make sure to use this only for websites that have js-rendered product links
-        self.JS_RENDERED_DOMAINS = ["https://www.westside.com", "https://www.tatacliq.com"]        
+        # Playwright is only used for listing templates where it finds more product links than plain HTTP,
+        # see ecom_crawler/render_policy.py (decisions are learnt per domain / URL template and saved between runs)
         if not self.allowed_domains:
             raise ValueError("No domains provided. Use -a domains='domain1.com,domain2.com'")
+        self.sitemaps = kwargs.pop('sitemaps', None)
+        if self.sitemaps not in (None, 'first', 'only'):
+            raise ValueError("Unknown sitemaps mode. Use -a sitemaps=first or -a sitemaps=only")
+        # Sharded crawl worker, started by ecom_crawler/sharding.py: -a shard=1/4 -a coordinator=... -a split_domains=...
+        shard = kwargs.pop('shard', None)
+        coordinator_path = kwargs.pop('coordinator', None)
+        split_domains = [d.strip() for d in kwargs.pop('split_domains', '').split(',') if d.strip()]
 
         # --- Scrapy CrawlSpider Rules ---
-        EcomProductSpider.rules = (
+        # Both rules read their links from one pass over the page (ecom_crawler/link_extraction.py),
+        # links are filtered by the follow policy of the page type (LINK_FOLLOW_POLICIES)
+        self.link_extractor = PageLinkExtractor(
+            allow_domains=self.allowed_domains,
+            # Deny common non-product/non-category paths and more to come from logs of different sites on observation
+            deny=(
+                r'/customer/', r'/account/', r'/login', r'/cart', r'/checkout',
+                r'/policy', r'/terms', r'/about', r'/contact', r'/apps/buy/',
+                r'\.jpg$', r'\.png$', r'\.pdf$', r'\.css$', r'\.js$' # File types
+            ),
+        )
+        self.rules = (
             Rule(
-                LinkExtractor(
-                    allow_domains=self.allowed_domains,
-                    # Deny common non-product/non-category paths and more to come from logs of different sites on observation
-                    deny=(
-                        r'/customer/', r'/account/', r'/login', r'/cart', r'/checkout',
-                        r'/policy', r'/terms', r'/about', r'/contact', r'/apps/buy/',
-                        r'\.jpg$', r'\.png$', r'\.pdf$', r'\.css$', r'\.js$' # File types
-                    ),
-                    canonicalize=True, 
-                    unique=True
-                ),
+                self.link_extractor.view(PAGE),
                 callback='parse_page', 
-                follow=True # Keep following links from the followed pages
+                follow=True, # Keep following links from the followed pages
+                process_request='schedule_request'
             ),
             # Rule 2 (Very useful): Explicitly target sitemaps
             Rule(
-                LinkExtractor(allow=(r'sitemap.*\.xml',), allow_domains=self.allowed_domains),
+                self.link_extractor.view(SITEMAP),
                 callback='parse_sitemap',
                 # follow=True
+                process_request='schedule_request'
             ),
         )
         super(EcomProductSpider, self).__init__(*args, **kwargs)
         self.logger.info(f"Starting crawl for domains: {self.allowed_domains}")
-        self.found_products = {domain: set() for domain in self.allowed_domains} # Track unique URLs per domain
+        self.product_detector = ProductDetector()
+        self.sitemap_fallback_domains = set()
+        self.platforms = {} # domain -> SHOPIFY / OTHER, decided by the first page seen
+        self.shopify_catalog_done = set() # domains whose whole /products.json was harvested
+        self.context_pool = ContextPool()
+        self.render_policy = RenderPolicy()
+        self.frontier = FrontierScorer()
+        self.products_found = 0
+        self.metrics = CrawlMetrics()
+        self.url_normalizer = UrlNormalizer()
+        self.coordinator = None
+        self.shard_loop = None
+        self.shard_claims = [] # (request, owner shard, depth) waiting for the next poll
+        self.shard_polling = None # deferred of the poll running in a thread
+        self.shard_finished = False # what the last poll said about the other workers
+        self.recrawl = None # RecrawlStore of incremental recrawls (RECRAWL_STATE_FILE)
+        if coordinator_path:
+            index, count = (int(n) for n in (shard or '0/1').split('/'))
+            self.coordinator = ShardCoordinator(coordinator_path, index, count, split_domains)
 
+        # Resumable crawl: found products, rendered collections and the frontier live in a SQLite file
+        self.crawl_state = None
+        self.resumed = False # True when the state file had something to resume from
+        if getattr(self, 'resume', None):
+            self.crawl_state = CrawlState(self.resume)
+            self.resumed = not self.crawl_state.is_empty()
+        self.use_dedup_store(DedupStore())
+        if self.resumed:
+            products, pending = self.crawl_state.counts()
+            self.logger.info(f"Resuming from {self.resume}: {products} known products, {pending} pending requests")
 
-    # Override _parse_response to implement custom logic before rules are applied
-    # Or simply use parse_page as the primary callback
-    def parse_page(self, response):
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(EcomProductSpider, cls).from_crawler(crawler, *args, **kwargs)
+        # per-domain scoring overrides, see PRODUCT_DETECTION_POLICIES in settings.py
+        spider.product_detector = ProductDetector(crawler.settings.getdict('PRODUCT_DETECTION_POLICIES'))
+        spider.use_dedup_store(DedupStore.from_settings(crawler.settings))
+        spider.context_pool = ContextPool(
+            spider.contexts_per_domain(crawler.settings),
+            crawler.settings.getint('RENDER_CONTEXT_MAX_RENDERS', 40)
+        )
+        spider.render_policy = RenderPolicy.from_settings(crawler.settings)
+        spider.frontier = FrontierScorer.from_settings(crawler.settings)
+        spider.link_extractor.use_follow_policies(crawler.settings.getdict('LINK_FOLLOW_POLICIES'))
+        spider.url_normalizer = UrlNormalizer.from_settings(crawler.settings) if crawler.settings.getbool('URL_NORMALIZATION', True) else None
+        spider.recrawl = RecrawlStore.for_crawler(crawler)
+        # shared with the middlewares, which export it
+        spider.metrics = CrawlMetrics.for_crawler(crawler)
+        spider.product_detector.metrics = spider.metrics
+        if spider.coordinator is not None:
+            spider.coordinator.stale_after = crawler.settings.getfloat('SHARD_STALE_SECONDS', 60)
+            crawler.signals.connect(spider.shard_opened, signal=signals.spider_opened)
+            crawler.signals.connect(spider.shard_idle, signal=signals.spider_idle)
+        return spider
+
+    def contexts_per_domain(self, settings):
+        """RENDER_CONTEXTS_PER_DOMAIN, checked against the browser's PLAYWRIGHT_MAX_CONTEXTS budget."""
+        per_domain = max(1, settings.getint('RENDER_CONTEXTS_PER_DOMAIN', 2))
+        max_contexts = settings.getint('PLAYWRIGHT_MAX_CONTEXTS', 0)
+        if max_contexts and per_domain > max_contexts:
+            self.logger.warning(f"RENDER_CONTEXTS_PER_DOMAIN={per_domain} is over PLAYWRIGHT_MAX_CONTEXTS={max_contexts}, using {max_contexts}")
+            per_domain = max_contexts
+        if max_contexts and per_domain * len(self.allowed_domains) > max_contexts:
+            # contexts of a domain with nothing left to render are closed, the others wait for them
+            self.logger.info(f"At most {max_contexts // per_domain} of {len(self.allowed_domains)} domains render at once "
+                             f"(PLAYWRIGHT_MAX_CONTEXTS={max_contexts}, RENDER_CONTEXTS_PER_DOMAIN={per_domain})")
+        return per_domain
+
+    def use_dedup_store(self, store):
+        """Tracks found products (per domain), rendered collections and requested URLs as fingerprints in store."""
+        self.dedup = store
+        if self.crawl_state is None:
+            self.found_products = {domain: store.get(domain) for domain in self.allowed_domains} # Track unique URLs per domain
+            self.visited_collections = store.get('collections')
+        else:
+            self.found_products = {domain: self.crawl_state.product_set(domain, store.get(domain)) for domain in self.allowed_domains}
+            self.visited_collections = self.crawl_state.collection_set(store.get('collections'))
+
+    def start_requests(self):
+        for request in self.domain_start_requests():
+            # split domains are started by one shard only, the others get their URLs handed over
+            if self.coordinator is None or self.coordinator.starts(url_domain(request.url)):
+                yield request
+
+    def domain_start_requests(self):
+        # saved frontier first, then the domain roots (their links are filtered by schedule_request)
+        if self.crawl_state is not None:
+            for url, key, playwright in self.crawl_state.pending_requests():
+                request = self.request_from_frontier(url, key, playwright)
+                if request is not None:
+                    yield request
+        if self.sitemaps:
+            yield from self.sitemap_start_requests()
+        if self.sitemaps != 'only':
+            yield from super(EcomProductSpider, self).start_requests()
+
+    def closed(self, reason):
+        self.render_policy.save()
+        if getattr(self, 'crawler', None) is not None:
+            self.dedup.report(self.crawler.stats)
+            for decision, count in self.render_policy.decision_counts().items():
+                self.crawler.stats.set_value(f'render/templates_{decision or "sampling"}', count)
+        if self.crawl_state is not None:
+            self.crawl_state.close()
+        if self.coordinator is not None:
+            if self.shard_loop is not None and self.shard_loop.running:
+                self.shard_loop.stop()
+            # after the poll still running in its thread, if any
+            polling = self.shard_polling or defer.succeed(None)
+            polling.addBoth(lambda _: self.coordinator.release())
+            return polling
+
+    def frontier_key(self, request):
+        """Name a request is saved under in the frontier: 'rule:<index>' for CrawlSpider rules, else the callback name."""
+        if 'rule' in request.meta and getattr(request.callback, '__name__', None) == '_callback':
+            return f"rule:{request.meta['rule']}"
+        return getattr(request.callback, '__name__', 'parse')
+
+    def request_from_frontier(self, url, key, playwright):
+        if key.startswith('rule:'):
+            rule_index = int(key.split(':', 1)[1])
+            if rule_index >= len(self._rules):
+                return None
+            return scrapy.Request(url, callback=self._callback, errback=self._errback, meta={'rule': rule_index})
+        if playwright:
+            return self.collection_render_request(url)
+        callback = getattr(self, key, None)
+        if callback is None:
+            return None
+        return scrapy.Request(url, callback=callback)
+
+    def track_request(self, request, response=None):
         """
-        Primary callback for processing downloaded pages.
-        Decides if a page is a product page or just contains links to follow.
+        Records a request in the saved frontier. Requests that were already processed by a
+        previous run are dropped (returns None), which is also the Rule process_request contract.
         """
-        self.logger.debug(f"Parsing page: {response.url}")
-        is_potential_collection_page = any(regex.search(response.url) for regex in LISTING_PATH_REGEX)
-        if is_potential_collection_page and any(response.url.startswith(domain) for domain in self.JS_RENDERED_DOMAINS) and response.url not in self.visited_collections:
-          self.logger.debug(f"Going for Playwright crawling in URL: {response.url}")
-          self.visited_collections.add(response.url)
-          req = scrapy.Request(
-            response.url,
+        if self.crawl_state is None:
+            return request
+        key = self.frontier_key(request)
+        if self.crawl_state.is_done(request.url, key):
+            self.logger.debug(f"Skipping request done in a previous run: {request.url}")
+            return None
+        self.crawl_state.add_request(request.url, key, request.meta.get('playwright', False))
+        return request
+
+    def schedule_request(self, request, response=None, claimed=False, depth=None):
+        """
+        process_request of the crawl rules, also used for every page request the spider builds:
+        normalizes the URL and drops it when that was requested already, claims the URL with the
+        shard coordinator on split domains, enforces the domain budget, raises the priority by the
+        URL's product likelihood (see ecom_crawler/frontier.py) and records the request in the crawl state.
+        """
+        if self.url_normalizer is not None and not claimed:
+            request = self.normalize_request(request)
+            if request is None:
+                return None
+        if depth is None:
+            depth = response.meta.get('depth', 0) + 1 if response is not None else 0
+        if self.coordinator is not None and not claimed and not self.claim_request(request, depth):
+            return None
+        if not self.frontier.admit(request.url):
+            self.inc_stat('frontier/over_budget')
+            return None
+        kind, priority = self.frontier.score(request.url, depth)
+        request.priority += priority
+        self.inc_stat(f'frontier/scheduled/{kind}')
+        return self.track_request(request)
+
+    def normalize_request(self, request):
+        """
+        Rewrites the request to its normalized URL (see ecom_crawler/url_normalizer.py), None when
+        that URL was requested already. Drops of rewritten URLs the scheduler's dupefilter wouldn't
+        have caught are counted as saved fetches.
+        """
+        domain = url_domain(request.url)
+        url = self.url_normalizer.normalize(request.url, self.platforms.get(domain))
+        # raw and normalized URLs of the domain's page requests, sized for both
+        requested = self.dedup.get(f'requests:{domain}', scale=2)
+        if url == request.url:
+            if not requested.add(url):
+                self.request_rejected(domain, 'normalizer/duplicates')
+                return None
+            return request
+        self.inc_stat('normalizer/rewritten')
+        raw_is_new = requested.add(request.url)
+        if not requested.add(url):
+            self.request_rejected(domain, 'normalizer/fetches_saved' if raw_is_new else 'normalizer/duplicates')
+            if raw_is_new:
+                self.metrics.inc('fetches_saved', domain=domain)
+            return None
+        return request.replace(url=url)
+
+    def request_rejected(self, domain, stat):
+        # every request dropped as already requested, a saturated bloom set shows up as a jump here
+        self.inc_stat(stat)
+        self.inc_stat('dedup/requests_rejected')
+        self.metrics.inc('requests_rejected_duplicate', domain=domain)
+
+    def claim_request(self, request, depth):
+        """
+        Sharded crawls: requests of split domains are held back (False) until the next poll claims
+        them with the coordinator, the ones this shard owns and nobody saw yet are scheduled then.
+        """
+        owner = self.coordinator.owner(request.url)
+        if owner is None:
+            return True
+        self.shard_claims.append((request, owner, depth))
+        return False
+
+    def shard_opened(self, spider):
+        self.shard_loop = task.LoopingCall(self.shard_poll)
+        self.shard_loop.start(self.settings.getfloat('SHARD_POLL_INTERVAL', 1.0), now=False)
+
+    def shard_poll(self):
+        """
+        Claims the URLs found since the last poll, takes the ones other shards handed over and tells
+        the coordinator whether this worker is busy. The SQLite work runs in a thread, a write waiting
+        on another worker's lock doesn't hold the reactor up.
+        """
+        if self.shard_polling is not None:
+            return self.shard_polling
+        claims, self.shard_claims = self.shard_claims, []
+        rows = [(r.url, self.frontier_key(r), r.meta.get('playwright', False), owner) for r, owner, _ in claims]
+        busy = bool(claims) or not self.crawler.engine.spider_is_idle()
+        self.shard_polling = threads.deferToThread(self.coordinator.sync, rows, busy)
+        self.shard_polling.addCallback(self.shard_synced, claims)
+        self.shard_polling.addErrback(lambda failure: self.logger.error(f"Shard poll failed: {failure.getErrorMessage()}"))
+        self.shard_polling.addBoth(self.shard_poll_done)
+        return self.shard_polling
+
+    def shard_poll_done(self, _):
+        self.shard_polling = None
+
+    def shard_synced(self, result, claims):
+        claimed, taken, finished = result
+        scheduled = 0
+        for (request, owner, depth), new in zip(claims, claimed):
+            if not new:
+                self.inc_stat('shard/seen')
+            elif owner != self.coordinator.shard:
+                self.inc_stat('shard/handed_over')
+            else:
+                request = self.schedule_request(request, claimed=True, depth=depth)
+                if request is not None:
+                    self.crawler.engine.crawl(request)
+                    scheduled += 1
+        for url, key, playwright in taken:
+            request = self.request_from_frontier(url, key, playwright)
+            if request is not None and not playwright:
+                request = self.schedule_request(request, claimed=True)
+            if request is not None:
+                self.crawler.engine.crawl(request)
+        if taken:
+            self.inc_stat('shard/taken', len(taken))
+        self.shard_finished = finished and not taken and not scheduled
+
+    def shard_idle(self, spider):
+        # keep going while claims wait for a poll or another worker may still hand something over
+        if self.shard_polling is None and not self.shard_claims and self.shard_finished:
+            return
+        self.shard_poll()
+        raise DontCloseSpider
+
+    def mark_done(self, response):
+        if self.crawl_state is None:
+            return
+        key = self.frontier_key(response.request)
+        self.crawl_state.mark_done(response.request.url, key)
+        for url in response.meta.get('redirect_urls', ()):
+            self.crawl_state.mark_done(url, key)
+
+    def inc_stat(self, key, count=1):
+        if getattr(self, 'crawler', None) is not None:
+            self.crawler.stats.inc_value(key, count)
+
+    def collection_request(self, url, response=None):
+        """
+        Request listing the products of a collection page: its products.json on Shopify stores
+        (up to 250 products per request), else a Playwright render when the render policy says
+        the browser finds more than plain HTTP for this URL template. None means the HTTP page
+        is enough. When the policy is still sampling and the HTTP response is given, the render
+        carries the HTTP link count so both can be compared.
+        """
+        domain = url_domain(url)
+        handle = collection_handle(url)
+        if self.platforms.get(domain) == SHOPIFY and handle and classify_url(url).has_script_products and self.settings.getbool('SHOPIFY_CATALOG', True):
+            if domain in self.shopify_catalog_done:
+                self.logger.debug(f"Skipping {url}, the whole {domain} catalog was already harvested")
+                return None
+            return self.shopify_catalog_request(catalog_url(site_root(url), handle, limit=self.settings.getint('SHOPIFY_PAGE_SIZE', 250)))
+        # only a plain HTTP page gives the render something to be compared with
+        decision = self.render_policy.decide(url, can_sample=response is not None)
+        if decision == HTTP:
+            self.inc_stat('render/skipped_http')
+            return None
+        req = self.collection_render_request(url)
+        if req is not None and decision == SAMPLE:
+            req.meta['render_sample_http_links'] = count_links(response.url, response.css(PRODUCT_LINK_SELECTOR).xpath('@href').getall())
+            self.render_policy.sample_started(url)
+        return req
+
+    def collection_render_request(self, url):
+        """
+        Playwright request that renders a collection page so the JS-rendered product links show up.
+        Runs in one of the domain's pooled contexts and scrolls / clicks "load more" until the
+        listing stops growing, the page is handed to the callback so it can be closed (and its
+        context recycled) right after. Returns None when the crawl state says it was done already.
+        """
+        req = self.track_request(scrapy.Request(
+            url,
             meta={
                 "playwright": True,
                 "playwright_page_methods": [
-                    PageMethod("wait_for_selector", 'a[href*="/p-"], a[href*="/product/"], a[href*="/products/"], a[href*="productId"]', timeout=5000)
+                    PageMethod("wait_for_selector", PRODUCT_LINK_SELECTOR, timeout=5000),
+                    PageMethod(
+                        harvest_product_links,
+                        max_rounds=self.settings.getint('RENDER_SCROLL_MAX_ROUNDS', 20),
+                        idle_rounds=self.settings.getint('RENDER_SCROLL_IDLE_ROUNDS', 2),
+                        wait_ms=self.settings.getint('RENDER_SCROLL_WAIT_MS', 800)
+                    ),
                 ],
-                "playwright_context": "default",
+                "playwright_include_page": True,
             },
             dont_filter=True,
-            callback=self.parse_collections_playwright
-        )
-          self.logger.debug(f"Yielding Playwright request for: {response.url}")
-          yield req
+            callback=self.parse_collections_playwright,
+            errback=self.render_failed
+        ))
+        if req is not None:
+            req.meta["playwright_context"] = self.context_pool.acquire(url_domain(url))
+        return req
+
+    def harvested_links(self, response):
+        for page_method in response.meta.get('playwright_page_methods', ()):
+            if getattr(page_method, 'method', None) is harvest_product_links and isinstance(page_method.result, list):
+                return page_method.result
+        return None
+
+    async def close_render_page(self, page, context):
+        await page.close()
+        self.context_pool.opened(context, page.context)
+        await self.close_contexts(self.context_pool.release(context))
+
+    async def close_contexts(self, contexts):
+        """Closes browser contexts the pool gave back (retired, or their domain has nothing left to render)."""
+        for browser_context in contexts:
+            self.inc_stat('playwright/contexts_recycled')
+            await browser_context.close()
+
+    async def render_failed(self, failure):
+        request = failure.request
+        self.logger.warning(f"Render failed for {request.url}: {failure.getErrorMessage()}")
+        if request.meta.get('render_sample_http_links') is not None:
+            # typically the wait for product anchors timed out, the browser found nothing more
+            self.render_policy.record(request.url, request.meta['render_sample_http_links'], 0)
+        page = request.meta.get('playwright_page')
+        if page is not None:
+            await self.close_render_page(page, request.meta.get('playwright_context'))
+        else:
+            await self.close_contexts(self.context_pool.release(request.meta.get('playwright_context')))
+
+    # Override _parse_response to implement custom logic before rules are applied
+    # Or simply use parse_page as the primary callback
+    def parse_page(self, response):
+        """
+        Primary callback for processing downloaded pages.
+        Decides if a page is a product page or just contains links to follow.
+        """
+        self.logger.debug(f"Parsing page: {response.url}")
+        self.mark_done(response)
+        self.frontier.record_fetch(response.url)
+        if response.status == 304:
+            # known product, not modified since the last run (see recrawl.py): no body to classify or follow
+            self.inc_stat('recrawl/classification_skipped')
+            response.meta['page_type'] = PRODUCT
+            item = self.new_product_item(response.url)
+            if item is not None:
+                self.frontier.record_product(response.url, self.referrer(response))
+                yield item
+            return
+        yield from self.check_platform(response)
+        url_class = classify_url(response.url)
+        # hits of every classifier regex, classify() itself stops at the first match of each kind
+        for pattern_name in default_classifier.matching_patterns(response.url):
+            kind, pattern = default_classifier.pattern_source(pattern_name)
+            self.metrics.inc('url_classifier_hits', kind=kind, pattern=pattern)
+        is_potential_collection_page = url_class.is_listing
+        if is_potential_collection_page and response.url not in self.visited_collections:
+          req = self.collection_request(response.url, response)
+          if req is not None:
+            self.visited_collections.add(response.url)
+            self.logger.debug(f"Yielding collection request for: {response.url}")
+            yield req
 
         # Check 1: Check URL Pattern against the product pattern defined earlier
-        is_potential_product_by_url = any(regex.search(response.url) for regex in PRODUCT_PATH_REGEX)
+        is_potential_product_by_url = url_class.is_product
 
         # Check 2: HTML Content Analysis (if potentially product or unknown)
         is_confirmed_product_by_html = False
-        if is_potential_product_by_url or not any(regex.search(response.url) for regex in LISTING_PATH_REGEX): # If URL looks like product OR not clearly a listing page
+        known_verdict = self.recrawl.is_product(response.url) if self.recrawl is not None and response.meta.get('recrawl_unchanged') else None
+        if known_verdict is not None:
+             # same body as last run, same verdict
+             self.inc_stat('recrawl/classification_skipped')
+             is_confirmed_product_by_html = known_verdict
+        elif is_potential_product_by_url or not is_potential_collection_page: # If URL looks like product OR not clearly a listing page
              if self.is_product_page(response):
                   is_confirmed_product_by_html = True
+             if self.recrawl is not None:
+                  self.recrawl.record_verdict(response.url, is_confirmed_product_by_html)
+
+        # page type picks which of its links are followed (see LINK_FOLLOW_POLICIES)
+        response.meta['page_type'] = PRODUCT if is_confirmed_product_by_html else LISTING if is_potential_collection_page else UNKNOWN
 
         # Decision: Yield item if confirmed product
         if is_confirmed_product_by_html:
-          domain = urlparse(response.url).netloc.replace('www.', '')
-          if domain not in self.found_products:
-            self.logger.warning(f"Domain {domain} from URL {response.url} not in tracked domains.")
-            return  # good practice to early return to reduce nesting 
-
-          # Check uniqueness before yielding
-          canonical_url = canonicalize_url(response.url)
-
-          if canonical_url in self.found_products[domain]:
-              self.logger.debug(f"Duplicate product item skipped: {response.url}")
-              return
-
-          self.logger.info(f"Found product: {response.url}")
-          item = ProductItem()
-          item['domain'] = domain
-          item['url'] = response.url
-          self.found_products[domain].add(canonical_url)
-          yield item
-
-    def extract_json_ld_product(self, response):
-      """
-      Checks if the page contains JSON-LD structured data indicating a Product.
-      """
-      scripts = response.css('script[type="application/ld+json"]::text').getall()
-      for script in scripts:
-          try:
-              data = json.loads(script)
-              # Handle both list and dict JSON-LD formats
-              if isinstance(data, list):
-                  for entry in data:
-                      if isinstance(entry, dict) and entry.get('@type') == 'Product':
-                          self.logger.debug(f"JSON-LD Product found on {response.url}")
-                          return True
-              elif isinstance(data, dict) and data.get('@type') == 'Product':
-                  self.logger.debug(f"JSON-LD Product found on {response.url}")
-                  return True
-          except json.JSONDecodeError:
-              continue
-      return False
-    
+          item = self.new_product_item(response.url)
+          if item is not None:
+            self.frontier.record_product(response.url, self.referrer(response))
+            yield item
+
+    def referrer(self, response):
+        # page that linked to this one (RefererMiddleware), credited by the frontier's yield feedback
+        referrer = response.request.headers.get('Referer') if response.request is not None else None
+        return referrer.decode('latin-1') if referrer else None
+
+    def new_product_item(self, url):
+        """ProductItem for url, or None when its domain isn't tracked or the product was already found."""
+        domain = urlparse(url).netloc.replace('www.', '')
+        if domain not in self.found_products:
+          self.logger.warning(f"Domain {domain} from URL {url} not in tracked domains.")
+          return None
+
+        # Check uniqueness before yielding
+        canonical_url = canonicalize_url(url)
+
+        if canonical_url in self.found_products[domain]:
+            self.logger.debug(f"Duplicate product item skipped: {url}")
+            self.metrics.inc('duplicates_skipped', domain=domain)
+            return None
+
+        self.logger.info(f"Found product: {url}")
+        item = ProductItem()
+        item['domain'] = domain
+        item['url'] = url
+        self.found_products[domain].add(canonical_url)
+        self.products_found += 1
+        if self.products_found in (10, 100, 1000, 10000) and getattr(self, 'crawler', None) is not None:
+            start_time = self.crawler.stats.get_value('start_time')
+            if start_time is not None:
+                elapsed = (datetime.now(timezone.utc) - start_time).total_seconds()
+                self.crawler.stats.set_value(f'products/seconds_to_first_{self.products_found}', round(elapsed, 1))
+        return item
+
     def is_product_page(self, response):
         """
         Analyzes HTML content to determine if it's likely a product page.
-        Returns True if indicators are found, False otherwise.
+        Returns a ProductVerdict, truthy when the weighted signals reach the domain's threshold.
         """
-        # Check for Schema.org Product markup (strong indicator)
-        if response.css(PRODUCT_SCHEMA_SELECTOR):
-            self.logger.debug(f"Product Schema found on {response.url}")
-            return True
+        with self.metrics.timer('phase_seconds', phase='is_product_page'):
+            verdict = self.product_detector.detect(response)
+        if verdict:
+            self.logger.debug(f"Product signals {verdict.signals} (score {verdict.score}) on {response.url}")
+        else:
+            self.logger.debug(f"No definitive product indicators found on {response.url} (signals {verdict.signals})")
+        return verdict
 
-        if self.extract_json_ld_product(response):
-          return True
-        # Check for "Add to Cart" button (strong indicator) => most likely to contain product link
-        for selector in ADD_TO_CART_SELECTORS:
-             # Handle :contains pseudo-class if needed (requires specific setup or library update)
-            if ":contains" in selector:
-                # Requires parsel >= 1.7 or custom implementation
-                element_text = selector.split(':contains(')[1].strip(')"\'')
-                button_selector = selector.split(':contains(')[0]
-                if response.css(button_selector).xpath(f'.//text()[contains(., "{element_text}")]'):
-                    self.logger.debug(f"Add to Cart text match found on {response.url} with {selector}")
-                    return True
-            elif response.css(selector):
-                self.logger.debug(f"Add to Cart selector match found on {response.url} with {selector}")
-                return True
-
-        # Check for price element (medium indicator - can be on listing pages too)
-        # Combine with other checks for better accuracy
-        has_price = False
-        for selector in PRICE_SELECTORS:
-            if response.css(selector):
-                has_price = True
-                break
-
-        h1_text = response.css('h1::text').get()
-        # Simple check: title exists and isn't too generic like "Search Results"
-        has_plausible_title = h1_text and len(h1_text.split()) > 1 and len(h1_text.split()) < 15
-
-        # Combine weaker indicators (e.g., price AND plausible title)
-        if has_price and has_plausible_title:
-             self.logger.debug(f"Price and plausible title found on {response.url}")
-             return True
-
-        # If none of the strong indicators match, assume not a product page
-        self.logger.debug(f"No definitive product indicators found on {response.url}")
-        return False
+    def parse_start_url(self, response):
+        return self.check_platform(response)
+
+    def check_platform(self, response, decisive=True):
+        """
+        Decides the platform of a domain from its first page. Shopify stores get their
+        /products.json catalog harvested right away. Not decisive responses (robots.txt)
+        only ever confirm Shopify.
+        """
+        domain = url_domain(response.url)
+        if domain not in self.found_products or domain in self.platforms:
+            return []
+        platform = detect_platform(response)
+        if platform is None:
+            if decisive:
+                self.platforms[domain] = OTHER
+            return []
+        self.platforms[domain] = platform
+        self.logger.info(f"{domain} runs on {platform}")
+        self.inc_stat(f'platform/{platform}')
+        if not self.settings.getbool('SHOPIFY_CATALOG', True):
+            return []
+        if self.coordinator is not None and not self.coordinator.starts(domain):
+            return [] # the shard that started the domain harvests its catalog
+        req = self.shopify_catalog_request(catalog_url(site_root(response.url), limit=self.settings.getint('SHOPIFY_PAGE_SIZE', 250)))
+        return [req] if req is not None else []
+
+    def shopify_catalog_request(self, url):
+        return self.track_request(scrapy.Request(url, callback=self.parse_shopify_catalog, errback=self.shopify_catalog_failed, priority=500))
+
+    def parse_shopify_catalog(self, response):
+        """Emits products straight from a products.json page and requests the next page while pages are full."""
+        self.mark_done(response)
+        root, handle, page, limit = parse_catalog_url(response.url)
+        try:
+            urls, count = catalog_product_urls(response.body, root)
+        except ValueError as e:
+            self.logger.warning(f"Not a Shopify catalog page {response.url}: {e}")
+            yield from self.shopify_fallback(response.url)
+            return
+        self.inc_stat('shopify/catalog_pages')
+        self.inc_stat('shopify/products', len(urls))
+        for url in urls:
+            item = self.new_product_item(url)
+            if item is not None:
+                yield item
+        if count >= limit and page < self.settings.getint('SHOPIFY_MAX_PAGES', 200):
+            req = self.shopify_catalog_request(catalog_url(root, handle, page + 1, limit))
+            if req is not None:
+                yield req
+        elif handle is None:
+            self.logger.info(f"Harvested the whole Shopify catalog of {root} ({page} pages)")
+            self.shopify_catalog_done.add(url_domain(root))
+
+    def shopify_catalog_failed(self, failure):
+        self.logger.warning(f"Shopify catalog request failed {failure.request.url}: {failure.getErrorMessage()}")
+        return self.shopify_fallback(failure.request.url)
+
+    def shopify_fallback(self, url):
+        # a collection whose JSON is unavailable is rendered like before, a failed store-wide
+        # catalog just leaves the domain to the link crawl
+        self.inc_stat('shopify/fallbacks')
+        root, handle, _, _ = parse_catalog_url(url)
+        collection_url = f'{root}/collections/{handle}' if handle else None
+        if collection_url and self.render_policy.decide(collection_url) != HTTP:
+            req = self.collection_render_request(collection_url)
+            return [req] if req is not None else []
+        return []
+
+    def sitemap_start_requests(self):
+        for domain in self.allowed_domains:
+            yield scrapy.Request(
+                f"https://{domain}/robots.txt",
+                callback=self.parse_robots,
+                errback=self.sitemap_discovery_failed,
+                # a missing robots.txt (404 / 5xx) still reaches parse_robots, which tries /sitemap.xml then
+                meta={'sitemap_domain': domain, 'handle_httpstatus_list': ROBOTS_MISSING_STATUSES},
+                dont_filter=True,
+                priority=1000
+            )
+
+    def parse_robots(self, response):
+        """Schedules the sitemaps declared in robots.txt, or /sitemap.xml when there are none."""
+        domain = response.meta['sitemap_domain']
+        sitemap_urls = []
+        if response.status == 200:
+            yield from self.check_platform(response, decisive=False)
+            sitemap_urls = robots_sitemaps(response.text)
+        if not sitemap_urls:
+            sitemap_urls = [f"https://{domain}/sitemap.xml"]
+        self.logger.info(f"Sitemaps for {domain}: {sitemap_urls}")
+        for url in sitemap_urls:
+            yield scrapy.Request(
+                url,
+                callback=self.parse_sitemap,
+                errback=self.sitemap_discovery_failed,
+                meta={'sitemap_domain': domain, 'sitemap_depth': 0},
+                priority=1000
+            )
+
+    def sitemap_discovery_failed(self, failure):
+        domain = failure.request.meta['sitemap_domain']
+        self.logger.warning(f"Sitemap discovery failed for {domain} ({failure.request.url}): {failure.getErrorMessage()}")
+        return self.sitemap_fallback(domain)
+
+    def sitemap_fallback(self, domain):
+        # sitemaps=only found nothing usable, crawl the link graph of this domain instead
+        if self.sitemaps != 'only' or domain in self.sitemap_fallback_domains:
+            return []
+        self.sitemap_fallback_domains.add(domain)
+        self.logger.info(f"No usable sitemap for {domain}, falling back to the link crawl")
+        return [scrapy.Request(f"https://{domain}", dont_filter=True)]
+
+    def _requests_to_follow(self, response):
+        # CrawlSpider's link extraction (all rules share one pass), timed for the crawl metrics
+        with self.metrics.timer('phase_seconds', phase='link_extraction'):
+            requests = list(super(EcomProductSpider, self)._requests_to_follow(response))
+        return iter(requests)
 
     def parse_sitemap(self, response):
         """
-        Parses XML sitemaps (if found by the rule).
-        Yields requests for URLs found within the sitemap.
+        Parses sitemaps and sitemap indexes (plain or .xml.gz), found through robots.txt or by Rule 2.
+        Entries are streamed, child sitemaps are followed up to SITEMAP_MAX_DEPTH and page URLs
+        are only scheduled when the URL patterns say they are products (see sitemap_page_request).
         """
         self.logger.info(f"Parsing sitemap: {response.url}")
-        sitemap = scrapy.utils.sitemap.Sitemap(response.body)
-        for entry in sitemap:
-            url = entry['loc']       
-            yield scrapy.Request(url, callback=self.parse_page)
+        self.mark_done(response)
+        depth = response.meta.get('sitemap_depth', 0)
+        domain = response.meta.get('sitemap_domain')
+        now = datetime.now(timezone.utc)
+        entries = 0
+        try:
+            for entry in iter_sitemap(response.body, max_size=self.settings.getint('DOWNLOAD_MAXSIZE')):
+                entries += 1
+                if entry.kind == 'sitemap':
+                    req = self.sitemap_child_request(entry, domain, depth)
+                else:
+                    req = self.sitemap_page_request(entry, now)
+                if req is not None:
+                    yield req
+        except (etree.XMLSyntaxError, SitemapTooLarge) as e:
+            self.logger.warning(f"Could not parse sitemap {response.url}: {e}")
+        self.inc_stat('sitemap/entries', entries)
+        if not entries and depth == 0 and domain:
+            yield from self.sitemap_fallback(domain)
+
+    def sitemap_child_request(self, entry, domain, depth):
+        if depth + 1 > self.settings.getint('SITEMAP_MAX_DEPTH', 3):
+            self.logger.debug(f"Sitemap index too deep, skipping {entry.loc}")
+            return None
+        if any(re.search(pattern, entry.loc) for pattern in self.settings.getlist('SITEMAP_SKIP_PATTERNS')):
+            self.inc_stat('sitemap/skipped_sitemaps')
+            return None
+        self.inc_stat('sitemap/sitemaps')
+        return self.track_request(scrapy.Request(
+            entry.loc,
+            callback=self.parse_sitemap,
+            meta={'sitemap_domain': domain, 'sitemap_depth': depth + 1},
+            priority=1000
+        ))
+
+    def sitemap_page_request(self, entry, now):
+        url_class = classify_url(entry.loc)
+        if not (url_class.is_product or (url_class.is_listing and self.settings.getbool('SITEMAP_FOLLOW_LISTINGS'))):
+            self.inc_stat('sitemap/skipped_not_product')
+            return None
+        max_age = self.settings.getint('SITEMAP_MAX_AGE_DAYS', 0)
+        if max_age and entry.lastmod is not None and (now - entry.lastmod).days > max_age:
+            self.inc_stat('sitemap/skipped_old')
+            return None
+        known = self.found_products.get(url_domain(entry.loc))
+        if known is not None and canonicalize_url(entry.loc) in known:
+            return None
+        self.inc_stat('sitemap/scheduled')
+        # fresher lastmod first
+        return self.schedule_request(scrapy.Request(entry.loc, callback=self.parse_page, priority=lastmod_priority(entry.lastmod, now)))
 
-    def parse_collections_playwright(self,response):
+    async def parse_collections_playwright(self,response):
         self.logger.info(f"Parsing collection page: {response.url}")
+        # the HTML is already in the response, give the page (and maybe its context) back first
+        page = response.meta.get('playwright_page')
+        if page is not None:
+            await self.close_render_page(page, response.meta.get('playwright_context'))
+        else: # replayed (ecom_crawler/replay.py), no browser page behind it
+            await self.close_contexts(self.context_pool.release(response.meta.get('playwright_context')))
+        self.mark_done(response)
 
-        # Select all product anchor tags
-        product_links = response.css('a[href*="/p-"], a[href*="/product/"], a[href*="/products/"], a[href*="productId"]')
-        product_links = [a.attrib['href'] for a in product_links if 'href' in a.attrib]
+        # Links collected while scrolling, or the anchors of the final HTML when the harvester didn't run
+        product_links = self.harvested_links(response)
+        if product_links is None:
+            product_links = response.css(PRODUCT_LINK_SELECTOR)
+            product_links = [a.attrib['href'] for a in product_links if 'href' in a.attrib]
+        http_links = response.meta.get('render_sample_http_links')
+        if http_links is not None:
+            self.inc_stat('render/samples')
+            self.render_policy.record(response.url, http_links, count_links(response.url, product_links))
         if not product_links:
             self.logger.warning(f"No product links found on {response.url}")
             return
@@ -256,25 +764,18 @@ class EcomProductSpider(CrawlSpider):
             if link not in self.visited_collections:    
               abs_url = response.urljoin(link)
               self.logger.info(f"Found product link: {abs_url}")
-              is_potential_collection_page = any(regex.search(abs_url) for regex in LISTING_PATH_REGEX)
+              is_potential_collection_page = classify_url(abs_url).is_listing
               if is_potential_collection_page and abs_url not in self.visited_collections:
-                self.visited_collections.add(abs_url)
-                self.logger.debug(f"Yielding Playwright request for: {response.url}")
-                yield scrapy.Request(
-                  response.url,
-                  meta={
-                      "playwright": True,
-                      "playwright_page_methods": [
-                          PageMethod("wait_for_selector", 'a[href*="/p-"], a[href*="/product/"], a[href*="/products/"], a[href*="productId"]',timeout=5000)
-                      ],
-                      "playwright_context": "default",
-                  },
-                  dont_filter=True,
-                  callback=self.parse_collections_playwright
-                  )
+                self.logger.debug(f"Yielding collection request for: {abs_url}")
+                req = self.collection_request(abs_url)
+                if req is not None:
+                  self.visited_collections.add(abs_url)
+                else:
+                  # plain HTTP page when the render policy doesn't want the browser for it (yet),
+                  # parse_page renders it from there if a sample of its template is due
+                  req = self.schedule_request(scrapy.Request(abs_url, callback=self.parse_page), response)
               else:
-                  yield scrapy.Request(
-                  abs_url,
-                  callback=self.parse_page
-              )
+                req = self.schedule_request(scrapy.Request(abs_url, callback=self.parse_page), response)
+              if req is not None:
+                yield req
             
\ No newline at end of file
@@ -0,0 +1,188 @@
+import re
+try:
+    import re._constants as sre_constants
+    import re._parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_constants
+    import sre_parse
+from collections import namedtuple
+from functools import lru_cache
+
+PRODUCT_PATH_PATTERNS = [
+    r'/p/', r'/product/', r'/products/[^/]+', r'/products/',
+    r'/.*/p-[^/]+$',#for tatacliq
+    r'/item/', r'/dp/', r'/goods/',
+    r'/[a-zA-Z0-9\-]+-p-\d+',
+    r'https?://(?:www\.)?westside\.com/products/[^/?#]+',
+    r'https?://(?:www\.)?tatacliq\.com/products/[^/?#]+',
+    r'https?://(?:www\.)?nykaafashion\.com/products/[^/?#]+',
+    r'https?://(?:www\.)?virgio\.com/products/[^/?#]+',
+]
+
+LISTING_PATH_PATTERNS = [
+    r'/c/', r'/category/', r'/categories/', r'/collections/', r'/shop/', r'/all/',  r'/.*/c-[^/]+$'
+]
+
+PATHS_CONTAINING_PRODUCTS_IN_SCRIPTS_PATTERNS = [r'/collections/']
+
+PRODUCT = 'product'
+LISTING = 'listing'
+UNKNOWN = 'unknown'
+
+# kind is the single verdict (product wins over listing), the flags keep the raw matches
+# because a URL like /collections/x/products/y is both and callers care about each side.
+# patterns holds the name of the first entry that matched for each kind
+UrlClass = namedtuple('UrlClass', ['kind', 'is_product', 'is_listing', 'has_script_products', 'patterns'])
+
+# Patterns that start with a literal scheme + host only ever apply to that host,
+# e.g. r'https?://(?:www\.)?westside\.com/products/[^/?#]+'
+_HOST_BOUND_PATTERN = re.compile(r'^https\?://\(\?:www\\\.\)\?((?:[a-z0-9\-]+\\\.)+[a-z]+)/', re.IGNORECASE)
+
+_GROUPS = (
+    ('product', 'p', PRODUCT_PATH_PATTERNS),
+    ('listing', 'l', LISTING_PATH_PATTERNS),
+    ('script', 's', PATHS_CONTAINING_PRODUCTS_IN_SCRIPTS_PATTERNS),
+)
+
+
+def pattern_domain(pattern):
+    """Returns the host a pattern is bound to, or None for generic path patterns."""
+    m = _HOST_BOUND_PATTERN.match(pattern)
+    if not m:
+        return None
+    return m.group(1).replace('\\.', '.').lower()
+
+
+def url_domain(url):
+    """Cheap host extraction (no urlparse), with www. and port stripped."""
+    parts = url.split('/', 3)
+    host = parts[2].lower() if len(parts) > 2 else ''
+    if '@' in host:
+        host = host.rsplit('@', 1)[1]
+    if ':' in host:
+        host = host.split(':', 1)[0]
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def required_literal(pattern):
+    """
+    Returns (literal, is_pure) for a pattern: the longest run of literal characters every
+    match must contain (lowercased), and whether the pattern is nothing but that literal.
+    """
+    parsed = sre_parse.parse(pattern)
+    runs, current = [], []
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            current.append(chr(av))
+        elif current:
+            runs.append(''.join(current))
+            current = []
+    if current:
+        runs.append(''.join(current))
+    if not runs:
+        return '', False
+    literal = max(runs, key=len)
+    return literal.lower(), len(runs) == 1 and len(parsed) == len(literal)
+
+
+class UrlClassifier:
+    """
+    Classifies URLs as product / listing / unknown in a single pass over one matcher table.
+
+    Pure literal patterns ('/products/', '/collections/', ...) of a kind are folded into one
+    alternation that runs against the lowercased URL, the remaining patterns are gated on
+    the longest literal they require so their regex only runs when it can match. Host-bound
+    patterns are only placed in the table of their own domain, and once a kind has matched
+    the remaining entries of that kind are skipped. Results are cached on the exact URL, some
+    patterns ('$' anchored ones) see the query string too.
+    """
+
+    def __init__(self, groups=_GROUPS, cache_size=65536):
+        self._groups = groups
+        self._pattern_names = {}  # entry name -> (kind, pattern source)
+        generic = []
+        by_domain = {}
+        for kind, prefix, patterns in groups:
+            for i, pattern in enumerate(patterns):
+                name = f'{prefix}{i}'
+                self._pattern_names[name] = (kind, pattern)
+                literal, is_pure = required_literal(pattern)
+                entry = (kind, name, literal, is_pure, pattern)
+                domain = pattern_domain(pattern)
+                if domain is None:
+                    generic.append(entry)
+                else:
+                    by_domain.setdefault(domain, []).append(entry)
+
+        # every pattern on its own, for hit counts (matching_patterns)
+        self._all_patterns = tuple((name, re.compile(pattern, re.IGNORECASE)) for name, (_, pattern) in self._pattern_names.items())
+        self._default_table = self._build_table(generic)
+        self._tables = {domain: self._build_table(generic + extra) for domain, extra in by_domain.items()}
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _build_table(self, entries):
+        """One (kind, literal alternation, literal names, gated regexes) row per kind, in declared order."""
+        table = []
+        for kind, _, _ in self._groups:
+            literals = [(name, literal) for k, name, literal, is_pure, _ in entries if k == kind and is_pure]
+            gated = tuple(
+                (name, literal, re.compile(pattern, re.IGNORECASE))
+                for k, name, literal, is_pure, pattern in entries if k == kind and not is_pure
+            )
+            alternation = None
+            names = {}
+            if literals:
+                # no capture groups here, they switch sre off its fast literal search
+                alternation = re.compile('|'.join(re.escape(literal) for _, literal in literals))
+                for name, literal in literals:
+                    names.setdefault(literal, name)
+            table.append((kind, alternation, names, gated))
+        return tuple(table)
+
+    def table_for(self, url):
+        return self._tables.get(url_domain(url), self._default_table)
+
+    def _classify(self, url):
+        lowered = url.lower()
+        matched = {}
+        for kind, alternation, names, gated in self.table_for(url):
+            if alternation is not None:
+                m = alternation.search(lowered)
+                if m:
+                    matched[kind] = names[m.group()]
+                    continue
+            for name, literal, regex in gated:
+                if literal in lowered and regex.search(url):
+                    matched[kind] = name
+                    break
+        is_product = 'product' in matched
+        is_listing = 'listing' in matched
+        if is_product:
+            kind = PRODUCT
+        elif is_listing:
+            kind = LISTING
+        else:
+            kind = UNKNOWN
+        return UrlClass(kind, is_product, is_listing, 'script' in matched, tuple(matched.values()))
+
+    def matching_patterns(self, url):
+        """Names of every pattern that matches url, also those classify() skipped after a kind had matched."""
+        return tuple(name for name, regex in self._all_patterns if regex.search(url))
+
+    def pattern_source(self, name):
+        """Maps a matched entry name (e.g. 'p3') back to (kind, pattern source)."""
+        return self._pattern_names[name]
+
+    def cache_info(self):
+        return self.classify.cache_info()
+
+
+# Shared instance. Requests are normalized before they are scheduled (url_normalizer.py), so
+# tracking-parameter variants of a page rarely reach it as response.url
+default_classifier = UrlClassifier()
+
+
+def classify_url(url):
+    return default_classifier.classify(url)
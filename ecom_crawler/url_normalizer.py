@@ -0,0 +1,81 @@
+import re
+from fnmatch import fnmatchcase
+from urllib.parse import urlsplit, urlunsplit
+
+from ecom_crawler.url_classifier import url_domain
+
+# Applied on every domain: trackers and variant selectors that never change which product a page shows
+DEFAULT_RULES = {
+    '*': {
+        'strip_params': [
+            'utm_*', 'variant', '_pos', '_sid', '_ss', '_psq', '_fid', 'fbclid', 'gclid', 'srsltid',
+        ],
+    },
+    # Shopify serves /collections/<handle>/products/<product> and /products/<product> as the same page
+    'shopify': {
+        'rewrite': [[r'^/collections/[^/]+/products/', '/products/']],
+    },
+}
+
+
+class UrlNormalizer:
+    """
+    Request-time URL normalization, so one product reached through a tracking link, a variant
+    link and a collection-scoped link is downloaded once.
+
+    Rules are keyed by '*' (every domain), a platform name (e.g. 'shopify', see shopify.py) or
+    a domain, and combined in that order: strip_params is a list of query parameter names
+    (fnmatch globs), rewrite a list of [regex, replacement] applied to the path. The fragment
+    is always dropped. URLs come back untouched when no rule changes them.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = {}
+        for key, rule in {**DEFAULT_RULES, **(rules or {})}.items():
+            self.rules[key] = {
+                'strip_params': list(rule.get('strip_params') or []),
+                'rewrite': [(re.compile(pattern), replacement) for pattern, replacement in rule.get('rewrite') or []],
+            }
+        self._combined = {} # (domain, platform) -> (strip_params, rewrites)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.getdict('URL_NORMALIZATION_RULES'))
+
+    def rules_for(self, domain, platform=None):
+        key = (domain, platform)
+        combined = self._combined.get(key)
+        if combined is None:
+            strip, rewrites = [], []
+            for name in ('*', platform, domain):
+                rule = self.rules.get(name) if name else None
+                if rule:
+                    strip += rule['strip_params']
+                    rewrites += rule['rewrite']
+            # exact names in a set, only real globs go through fnmatch
+            exact = frozenset(p for p in strip if not any(c in p for c in '*?['))
+            globs = tuple(p for p in strip if p not in exact)
+            combined = self._combined[key] = (exact, globs, rewrites)
+        return combined
+
+    def normalize(self, url, platform=None):
+        exact, globs, rewrites = self.rules_for(url_domain(url), platform)
+        parts = urlsplit(url)
+        path = parts.path
+        for pattern, replacement in rewrites:
+            path = pattern.sub(replacement, path)
+        query = parts.query
+        if query and (exact or globs):
+            kept = [
+                pair for pair in query.split('&')
+                if pair and not _stripped(pair.split('=', 1)[0], exact, globs)
+            ]
+            query = '&'.join(kept)
+        if path == parts.path and query == parts.query and not parts.fragment:
+            return url
+        return urlunsplit((parts.scheme, parts.netloc, path, query, ''))
+
+
+def _stripped(name, exact, globs):
+    name = name.lower()
+    return name in exact or any(fnmatchcase(name, glob) for glob in globs)
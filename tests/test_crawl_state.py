@@ -0,0 +1,32 @@
+from ecom_crawler.crawl_state import CrawlState
+from ecom_crawler.dedup import FingerprintSet
+
+
+def test_state_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    state = CrawlState(path, commit_every=1000, commit_interval=3600) # only close() commits
+    assert state.is_empty()
+    products = state.product_set('virgio.com')
+    products.add('https://virgio.com/products/a')
+    products.add('https://virgio.com/products/a')
+    state.add_collection('https://virgio.com/collections/dresses')
+    state.add_request('https://virgio.com/collections/dresses', 'parse_collection', playwright=True)
+    state.add_request('https://virgio.com/products/a', 'parse_product')
+    state.add_request('https://virgio.com/products/b', 'parse_product')
+    state.mark_done('https://virgio.com/products/a', 'parse_product')
+    state.close()
+
+    state = CrawlState(path)
+    assert not state.is_empty()
+    assert list(state.pending_requests(batch_size=1)) == [
+        ('https://virgio.com/collections/dresses', 'parse_collection', True),
+        ('https://virgio.com/products/b', 'parse_product', False),
+    ]
+    assert state.is_done('https://virgio.com/products/a', 'parse_product')
+    assert not state.is_done('https://virgio.com/products/a', 'parse_collection')
+    products = state.product_set('virgio.com', FingerprintSet())
+    assert 'https://virgio.com/products/a' in products and len(products) == 1
+    assert len(state.product_set('westside.com')) == 0
+    assert 'https://virgio.com/collections/dresses' in state.collection_set()
+    assert state.counts() == (1, 2)
+    state.close()
@@ -0,0 +1,62 @@
+from scrapy import Request
+
+from ecom_crawler.dedup import BLOOM, DedupStore, FingerprintSet
+from ecom_crawler.spiders.product_spider import EcomProductSpider
+
+
+def test_requested_urls_are_kept_per_domain():
+    spider = EcomProductSpider(domains='virgio.com,westside.com')
+    spider.use_dedup_store(DedupStore(mode=BLOOM, capacity=1000))
+    for domain in ('virgio.com', 'westside.com'):
+        for i in range(1000):
+            # raw + normalized URL of every request: 2 entries each
+            url = f'https://{domain}/products/item-{i}'
+            assert spider.normalize_request(Request(f'{url}?utm_source=x')).url == url
+    sets = {name: urls for name, urls in spider.dedup.sets.items() if name.startswith('requests:')}
+    assert sorted(sets) == ['requests:virgio.com', 'requests:westside.com']
+    assert all(len(urls) <= urls.capacity for urls in sets.values())
+    assert spider.normalize_request(Request('https://virgio.com/products/item-1')) is None
+
+
+def test_over_capacity_is_reported():
+    store = DedupStore(mode=BLOOM, capacity=10)
+    for i in range(30):
+        store.add('virgio.com', f'https://virgio.com/products/item-{i}')
+    stats = {}
+
+    class Stats:
+        def set_value(self, key, value):
+            stats[key] = value
+
+    store.report(Stats())
+    assert stats['dedup/virgio.com/over_capacity'] > 0
+
+
+def test_fingerprint_set_grows():
+    urls = FingerprintSet(capacity=4)
+    assert urls.memory_bytes() == 8 * 8
+    added = [urls.add(f'https://virgio.com/products/item-{i}') for i in range(1000)]
+    assert all(added) and len(urls) == 1000
+    assert len(urls._slots) * urls.max_load >= 1000 and urls.memory_bytes() == len(urls._slots) * 8
+    # every URL is still found after the rehashes, and only once
+    assert all(f'https://virgio.com/products/item-{i}' in urls for i in range(1000))
+    assert not urls.add('https://virgio.com/products/item-0')
+    assert 'https://virgio.com/products/item-1000' not in urls
+
+
+def test_bloom_filter_within_capacity():
+    store = DedupStore(mode=BLOOM, capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        store.add('virgio.com', f'https://virgio.com/products/item-{i}')
+    urls = store.get('virgio.com')
+    false_positives = sum(f'https://virgio.com/products/other-{i}' in urls for i in range(1000))
+    assert false_positives < 30
+    stats = {}
+
+    class Stats:
+        def set_value(self, key, value):
+            stats[key] = value
+
+    store.report(Stats())
+    assert 'dedup/virgio.com/over_capacity' not in stats
+    assert stats['dedup/virgio.com/entries'] == len(urls) and stats['dedup/memory_bytes'] == urls.memory_bytes()
@@ -0,0 +1,38 @@
+from ecom_crawler.frontier import FrontierScorer, url_kind
+from ecom_crawler.url_classifier import LISTING, PRODUCT, UNKNOWN
+
+
+def test_kinds_rank_products_then_listings():
+    scorer = FrontierScorer()
+    urls = ['https://virgio.com/pages/about', 'https://virgio.com/collections/dresses', 'https://virgio.com/products/linen-dress']
+    ranked = sorted(urls, key=lambda url: scorer.score(url)[1], reverse=True)
+    assert [url_kind(url) for url in ranked] == [PRODUCT, LISTING, UNKNOWN]
+    assert url_kind('https://virgio.com/search?page=2') == LISTING
+
+
+def test_products_credit_the_listing_they_were_found_on():
+    scorer = FrontierScorer()
+    listing = 'https://virgio.com/collections/dresses'
+    before = scorer.score('https://virgio.com/collections/tops')[1]
+    scorer.record_fetch(listing)
+    for i in range(20):
+        product = f'https://virgio.com/products/dress-{i}'
+        scorer.record_fetch(product)
+        scorer.record_product(product, referrer=listing)
+    assert scorer.yield_rate('virgio.com', LISTING) == 2 / 3 # the listing counts once
+    assert scorer.score('https://virgio.com/collections/tops')[1] > before
+    assert scorer.score('https://westside.com/collections/tops')[1] == before
+
+
+def test_barren_kind_stays_at_its_base_and_depth_costs():
+    scorer = FrontierScorer()
+    for i in range(20):
+        scorer.record_fetch(f'https://virgio.com/pages/info-{i}')
+    assert scorer.score('https://virgio.com/pages/other')[1] < scorer.score('https://westside.com/pages/other')[1]
+    assert scorer.score('https://virgio.com/products/x', depth=3)[1] == scorer.score('https://virgio.com/products/x')[1] - 3
+
+
+def test_domain_budget():
+    scorer = FrontierScorer(domain_budget=2)
+    assert [scorer.admit(f'https://virgio.com/products/{i}') for i in range(3)] == [True, True, False]
+    assert scorer.admit('https://westside.com/products/1')
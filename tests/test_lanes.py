@@ -0,0 +1,44 @@
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from ecom_crawler.lanes import BROWSER, HTTP, DownloadLaneMiddleware, lane_slot_key
+
+
+def lane_middleware(**settings):
+    crawler = get_crawler(settings_dict={'CONCURRENT_REQUESTS_PER_DOMAIN': 6, 'AUTOTHROTTLE_ENABLED': True, **settings})
+    return DownloadLaneMiddleware.from_crawler(crawler)
+
+
+def test_lane_slot_keys():
+    assert lane_slot_key(Request('https://www.virgio.com/products/linen-dress')) == 'virgio.com:http'
+    assert lane_slot_key(Request('https://virgio.com/collections/dresses', meta={'playwright': True})) == 'virgio.com:browser'
+
+
+def test_lanes_take_their_limits_from_the_settings():
+    mw = lane_middleware(DOWNLOAD_LANES={'browser': {'concurrency': 3}})
+    assert mw.lanes[HTTP].concurrency == 6
+    assert mw.lanes[BROWSER].concurrency == 3
+    assert mw.lanes[BROWSER].target_latency == 20.0
+
+
+def test_requests_get_the_slot_of_their_lane():
+    mw = lane_middleware()
+    request = Request('https://virgio.com/collections/dresses')
+    mw.assign(request)
+    assert request.meta['download_slot'] == request.meta['lane_slot'] == 'virgio.com:http'
+    assert request.meta['autothrottle_dont_adjust_delay']
+    # a render of the same page built from the original keeps its meta, the lane is picked again
+    render = request.replace(meta={**request.meta, 'playwright': True})
+    mw.assign(render)
+    assert render.meta['download_slot'] == 'virgio.com:browser'
+    redirected = render.replace(url='https://westside.com/collections/dresses')
+    mw.assign(redirected)
+    assert redirected.meta['download_slot'] == 'westside.com:browser'
+
+
+def test_own_download_slot_is_left_alone():
+    mw = lane_middleware(AUTOTHROTTLE_ENABLED=False)
+    request = Request('https://virgio.com/sitemap.xml', meta={'download_slot': 'sitemaps'})
+    mw.assign(request)
+    assert request.meta['download_slot'] == 'sitemaps'
+    assert 'lane_slot' not in request.meta and 'autothrottle_dont_adjust_delay' not in request.meta
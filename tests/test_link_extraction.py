@@ -0,0 +1,56 @@
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from ecom_crawler.link_extraction import PAGE, SITEMAP, PageLinkExtractor
+
+LINKS = b"""<html><body>
+<nav><a href="/collections/dresses">Dresses</a> <a href="/pages/about">About</a></nav>
+<a href="/products/linen-dress">Linen dress</a>
+<a href="/products/silk-top#reviews">Silk top</a>
+<a href="/products/linen-dress">Linen dress, again</a>
+<a href="/collections/dresses?page=2">Next</a>
+<a href="/cdn/lookbook.pdf">Lookbook</a>
+<a href="https://instagram.com/virgio">Instagram</a>
+<a href="/sitemap_products_1.xml">Sitemap</a>
+</body></html>"""
+
+
+def page(url, **meta):
+    return HtmlResponse(url, body=LINKS, encoding='utf-8', request=Request(url, meta=meta))
+
+
+def page_links(extractor, response):
+    return [link.url for link in extractor.extract_links(response, PAGE)]
+
+
+def test_listing_pages_follow_everything_on_the_site():
+    extractor = PageLinkExtractor(['virgio.com'])
+    response = page('https://virgio.com/collections/tops')
+    assert page_links(extractor, response) == [
+        'https://virgio.com/collections/dresses',
+        'https://virgio.com/pages/about',
+        'https://virgio.com/products/linen-dress',
+        'https://virgio.com/products/silk-top',
+        'https://virgio.com/collections/dresses?page=2',
+    ]
+    assert [link.url for link in extractor.extract_links(response, SITEMAP)] == ['https://virgio.com/sitemap_products_1.xml']
+
+
+def test_product_pages_follow_products_and_pagination():
+    extractor = PageLinkExtractor(['virgio.com'])
+    assert page_links(extractor, page('https://virgio.com/products/cotton-shirt')) == [
+        'https://virgio.com/products/linen-dress',
+        'https://virgio.com/products/silk-top',
+        'https://virgio.com/collections/dresses?page=2',
+    ]
+    # the callback's page type wins over the URL's
+    assert len(page_links(extractor, page('https://virgio.com/pages/lookbook', page_type='product'))) == 3
+
+
+def test_follow_policies_from_settings():
+    extractor = PageLinkExtractor(['virgio.com'], follow_policies={'unknown': ['listing']})
+    assert page_links(extractor, page('https://virgio.com/pages/about')) == [
+        'https://virgio.com/collections/dresses',
+        'https://virgio.com/collections/dresses?page=2',
+    ]
+    assert len(page_links(extractor, page('https://virgio.com/collections/tops'))) == 5 # defaults for the rest
@@ -0,0 +1,66 @@
+import gzip
+
+import pytest
+from scrapy import Request
+from scrapy.exceptions import StopDownload
+from scrapy.http import Headers
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from ecom_crawler import settings
+from ecom_crawler.middlewares import EarlyAbortDownloaderMiddleware
+
+
+def middleware(tail_bytes=100):
+    stats = MemoryStatsCollector(get_crawler())
+    return EarlyAbortDownloaderMiddleware(stats, settings.EARLY_ABORT_ALLOWED_TYPES, {'listing': 1000}, tail_bytes)
+
+
+def html_headers(**headers):
+    return Headers({'Content-Type': 'text/html; charset=utf-8', **headers})
+
+
+def test_other_content_types_stop_at_the_headers():
+    mw = middleware()
+    request = Request('https://virgio.com/cdn/shop/files/dress.jpg')
+    with pytest.raises(StopDownload) as e:
+        mw.headers_received(Headers({'Content-Type': 'image/jpeg'}), 50000, request, None)
+    assert not e.value.fail
+    assert request.meta['early_abort'] == 'content_type'
+    sitemap = Request('https://virgio.com/sitemap.xml.gz')
+    mw.headers_received(Headers({'Content-Type': 'application/x-gzip'}), 50000, sitemap, None)
+    assert 'early_abort' not in sitemap.meta
+
+
+def test_listing_is_cut_at_its_byte_cap():
+    mw = middleware()
+    request = Request('https://virgio.com/collections/dresses')
+    mw.headers_received(html_headers(), None, request, None)
+    mw.bytes_received(b'x' * 600, request, None)
+    with pytest.raises(StopDownload):
+        mw.bytes_received(b'x' * 600, request, None)
+    assert request.meta['early_abort'] == 'byte_cap/listing'
+    assert mw.stats.get_value('early_abort/bytes_read') == 1200
+
+
+def test_product_stops_after_the_signal_tail():
+    mw = middleware()
+    request = Request('https://virgio.com/products/linen-dress')
+    body = (b'<html><head>' + b' ' * 1000
+            + b'<script type="application/ld+json">{"@type": "Product", "name": "Linen dress"}</script>'
+            + b'<h1>Linen dress</h1>' + b' ' * 10000)
+    mw.headers_received(html_headers(**{'Content-Encoding': 'gzip'}), None, request, None)
+    data = gzip.compress(body)
+    with pytest.raises(StopDownload):
+        for i in range(0, len(data), 7): # token and script end split over chunks
+            mw.bytes_received(data[i:i + 7], request, None)
+    assert request.meta['early_abort'] == 'product_signals'
+    assert mw.stats.get_value('early_abort/bytes_read') < len(body)
+
+
+def test_product_url_without_signals_reads_on():
+    mw = middleware()
+    request = Request('https://virgio.com/products/linen-dress')
+    mw.headers_received(html_headers(), None, request, None)
+    mw.bytes_received(b'<html><h1>Linen dress</h1>' + b' ' * 5000, request, None)
+    assert 'early_abort' not in request.meta
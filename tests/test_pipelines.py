@@ -0,0 +1,68 @@
+from twisted.internet import defer
+
+from ecom_crawler import pipelines
+from ecom_crawler.crawl_state import CrawlState
+from ecom_crawler.pipelines import StreamingGroupedOutputPipeline, segment_domains
+from ecom_crawler.spiders.product_spider import EcomProductSpider
+
+
+class SlowWriter:
+    """Stands in for the writer thread: batches are written only when write_all() is called."""
+
+    def __init__(self):
+        self.queued = []
+
+    def __call__(self, func, *args):
+        d = defer.Deferred()
+        self.queued.append((d, func, args))
+        return d
+
+    def write_all(self):
+        while self.queued:
+            d, func, args = self.queued.pop(0)
+            d.callback(func(*args))
+
+
+def test_items_are_held_back_while_the_writer_lags(tmp_path, monkeypatch):
+    writer = SlowWriter()
+    monkeypatch.setattr(pipelines.threads, 'deferToThread', writer)
+    pipeline = StreamingGroupedOutputPipeline(segment_dir=str(tmp_path / 'segments'), flush_items=1, max_pending_batches=2)
+    pipeline.open_spider(None)
+    results = [pipeline.process_item({'domain': 'virgio.com', 'url': f'https://virgio.com/products/{i}'}, None)
+               for i in range(4)]
+    assert [isinstance(r, defer.Deferred) for r in results] == [False, False, True, True]
+    assert len(writer.queued) == 1 # the rest waits behind the first batch on the chain
+    held = []
+    for d in results[2:]:
+        d.addCallback(held.append)
+    writer.write_all()
+    assert pipeline.pending_batches == 0
+    assert [item['url'] for item in held] == ['https://virgio.com/products/2', 'https://virgio.com/products/3']
+    with open(tmp_path / 'segments' / 'virgio.com.jsonl') as f:
+        assert len(f.read().splitlines()) == 4
+
+
+def old_segments(tmp_path):
+    segment_dir = tmp_path / 'segments'
+    segment_dir.mkdir()
+    (segment_dir / 'virgio.com.jsonl').write_text('"https://virgio.com/products/old"\n')
+    return segment_dir
+
+
+def test_new_state_file_starts_with_new_segments(tmp_path):
+    segment_dir = old_segments(tmp_path)
+    spider = EcomProductSpider(domains='virgio.com', resume=str(tmp_path / 'fresh.sqlite'))
+    StreamingGroupedOutputPipeline(segment_dir=str(segment_dir)).open_spider(spider)
+    spider.crawl_state.close()
+    assert segment_domains(str(segment_dir)) == []
+
+
+def test_resumed_state_keeps_its_segments(tmp_path):
+    segment_dir = old_segments(tmp_path)
+    state = CrawlState(str(tmp_path / 'state.sqlite'))
+    state.add_product('virgio.com', 'https://virgio.com/products/old')
+    state.close()
+    spider = EcomProductSpider(domains='virgio.com', resume=str(tmp_path / 'state.sqlite'))
+    StreamingGroupedOutputPipeline(segment_dir=str(segment_dir)).open_spider(spider)
+    spider.crawl_state.close()
+    assert segment_domains(str(segment_dir)) == ['virgio.com']
@@ -0,0 +1,68 @@
+import importlib.util
+import os
+
+import pytest
+from scrapy.http import HtmlResponse
+
+from ecom_crawler.product_detection import JSON_LD, ProductDetector
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+
+# the old selector cascade, kept verbatim in the benchmark as the baseline
+_spec = importlib.util.spec_from_file_location(
+    'bench_product_detection', os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'bench_product_detection.py'))
+bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench)
+
+# pages the old cascade got wrong on purpose-built fixtures, the engine is expected to differ there
+IMPROVED = {'graph_product.html'} # JSON-LD Product inside @graph with a list @type
+
+EXPECTED = {
+    'shopify_dawn_product.html': True,
+    'microdata_product.html': True,
+    'json_ld_list_product.html': True,
+    'add_to_cart_input.html': True,
+    'buy_now_button.html': True,
+    'graph_product.html': True,
+    'tatacliq_listing.html': True, # price + a two-word heading, same as the old cascade
+    'react_pdp_price_title.html': False, # first h1 is the one-word brand
+    'collection_single_word_heading.html': False,
+    'blog_article.html': False,
+    'home_page.html': False,
+    'not_found.html': False,
+}
+
+
+def page(name):
+    with open(os.path.join(PAGES_DIR, name), 'rb') as f:
+        return HtmlResponse(f'https://example.com/{name}', body=f.read(), encoding='utf-8')
+
+
+def test_every_fixture_has_an_expected_verdict():
+    assert sorted(EXPECTED) == sorted(name for name in os.listdir(PAGES_DIR) if name.endswith('.html'))
+
+
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_verdict_matches_the_old_cascade(name):
+    verdict = ProductDetector().detect(page(name))
+    assert bool(verdict) == EXPECTED[name]
+    if name in IMPROVED:
+        assert bench.old_is_product_page(page(name)) != EXPECTED[name]
+    else:
+        assert bench.old_is_product_page(page(name)) == EXPECTED[name]
+
+
+def test_synthetic_benchmark_pages_agree():
+    detector = ProductDetector()
+    for _, url, body in bench.synthetic_pages():
+        response = HtmlResponse(url, body=body, encoding='utf-8')
+        assert bool(detector.detect(response)) == bench.old_is_product_page(response)
+
+
+def test_signals_and_domain_policy():
+    response = page('shopify_dawn_product.html')
+    assert ProductDetector().detect(response).signals == (JSON_LD, 'add_to_cart', 'price', 'title')
+    # a domain whose cart forms sit on every page can require more than the form alone
+    strict = ProductDetector({'example.com': {'weights': {'add_to_cart': 0.5}}})
+    assert not strict.detect(page('add_to_cart_input.html'))
+    assert strict.detect(response)
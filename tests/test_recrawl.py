@@ -0,0 +1,40 @@
+import json
+
+from ecom_crawler.recrawl import ProductDelta, diff_sorted
+
+
+def test_diff_sorted():
+    previous = ['https://virgio.com/products/a', 'https://virgio.com/products/b', 'https://virgio.com/products/d']
+    current = ['https://virgio.com/products/b', 'https://virgio.com/products/c', 'https://virgio.com/products/d', 'https://virgio.com/products/e']
+    assert list(diff_sorted(previous, current)) == [
+        ('removed', 'https://virgio.com/products/a'),
+        ('added', 'https://virgio.com/products/c'),
+        ('added', 'https://virgio.com/products/e'),
+    ]
+    assert list(diff_sorted([], current[:1])) == [('added', current[0])]
+    assert list(diff_sorted(previous[:1], [])) == [('removed', previous[0])]
+
+
+def run(tmp_path, products):
+    delta = ProductDelta(str(tmp_path / 'snapshots'), str(tmp_path / 'delta.json'))
+    for domain, urls in products.items():
+        assert list(delta.track(domain, iter(urls))) == urls # passes the merge through
+    counts = delta.write()
+    with open(tmp_path / 'delta.json') as f:
+        return counts, json.load(f)
+
+
+def test_delta_against_the_previous_run(tmp_path):
+    run(tmp_path, {'virgio.com': ['https://virgio.com/products/a', 'https://virgio.com/products/b']})
+    counts, delta = run(tmp_path, {'virgio.com': ['https://virgio.com/products/b', 'https://virgio.com/products/c']})
+    assert counts == {'virgio.com': (1, 1)}
+    assert delta == {'virgio.com': {'added': ['https://virgio.com/products/c'], 'removed': ['https://virgio.com/products/a']}}
+
+
+def test_empty_domain_keeps_its_snapshot(tmp_path):
+    run(tmp_path, {'virgio.com': ['https://virgio.com/products/a'], 'westside.com': ['https://westside.com/products/a']})
+    counts, delta = run(tmp_path, {'virgio.com': [], 'westside.com': ['https://westside.com/products/a']})
+    assert counts == {'westside.com': (0, 0)} and delta == {'westside.com': {'added': [], 'removed': []}}
+    # the failed domain diffs against its last good snapshot next time
+    counts, delta = run(tmp_path, {'virgio.com': ['https://virgio.com/products/a', 'https://virgio.com/products/b']})
+    assert delta == {'virgio.com': {'added': ['https://virgio.com/products/b'], 'removed': []}}
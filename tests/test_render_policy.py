@@ -0,0 +1,41 @@
+from ecom_crawler.render_policy import BROWSER, HTTP, SAMPLE, RenderPolicy, count_links
+
+
+def listings(n):
+    return [f'https://www.virgio.com/collections/dresses-{i}' for i in range(n)]
+
+
+def test_many_listings_of_one_template_render_at_most_samples():
+    policy = RenderPolicy(samples=2)
+    renders = []
+    for url in listings(50):
+        if policy.decide(url) == SAMPLE:
+            policy.sample_started(url)
+            renders.append(url)
+    assert len(renders) == 2
+
+
+def test_template_is_decided_from_its_samples():
+    policy = RenderPolicy(samples=2, resample_every=0)
+    urls = listings(10)
+    for url in urls[:2]:
+        assert policy.decide(url) == SAMPLE
+        policy.sample_started(url)
+    assert policy.decide(urls[2]) == HTTP # both samples still in flight
+    policy.record(urls[0], 10, 40)
+    policy.record(urls[1], 12, 44)
+    assert [policy.decide(url) for url in urls[2:]] == [BROWSER] * 8
+    assert policy.pending == {}
+
+
+def test_no_sample_without_an_http_page():
+    policy = RenderPolicy(samples=2)
+    assert policy.decide(listings(1)[0], can_sample=False) == HTTP
+    assert policy.pending == {}
+
+
+def test_http_and_browser_links_are_counted_alike():
+    page = 'https://www.virgio.com/collections/dresses'
+    http_hrefs = ['/products/a', 'https://www.virgio.com/products/a', '/products/b#reviews', ' /products/b', '', '/products/c']
+    browser_links = ['https://www.virgio.com/products/a', 'https://www.virgio.com/products/b', 'https://www.virgio.com/products/c']
+    assert count_links(page, http_hrefs) == count_links(page, browser_links) == 3
@@ -0,0 +1,72 @@
+from ecom_crawler.rendering import ContextPool
+
+
+class FakeContext:
+    def __init__(self, browser, name):
+        self.browser = browser
+        self.name = name
+
+    def close(self):
+        del self.browser.open[self.name]
+
+
+class FakeBrowser:
+    """Stands in for scrapy-playwright: a context is created on first use, at most max_contexts at once."""
+
+    def __init__(self, max_contexts):
+        self.max_contexts = max_contexts
+        self.open = {}
+
+    def context(self, name):
+        if name not in self.open:
+            # scrapy-playwright would wait here, with no timeout, for a context to be closed
+            assert len(self.open) < self.max_contexts, f"no free context for {name}, open: {sorted(self.open)}"
+            self.open[name] = FakeContext(self, name)
+        return self.open[name]
+
+
+def render(pool, browser, names):
+    for name in names:
+        pool.opened(name, browser.context(name))
+    for name in names:
+        for context in pool.release(name):
+            context.close()
+
+
+def test_more_domains_than_context_budget():
+    browser = FakeBrowser(max_contexts=6)
+    pool = ContextPool(contexts_per_domain=2, max_renders=40)
+    domains = [f'shop{i}.com' for i in range(8)] # 16 context names for 6 slots
+    for _ in range(3):
+        for first in range(0, len(domains), 3):
+            batch = domains[first:first + 3]
+            # a few renders per domain in flight at once, then the domains go quiet
+            render(pool, browser, [pool.acquire(domain) for domain in batch for _ in range(3)])
+            assert browser.open == {}
+    assert pool.in_flight == {}
+    assert pool.domain_in_flight == {}
+
+
+def test_contexts_stay_open_while_the_domain_renders():
+    browser = FakeBrowser(max_contexts=6)
+    pool = ContextPool(contexts_per_domain=2, max_renders=40)
+    first = pool.acquire('virgio.com')
+    second = pool.acquire('virgio.com')
+    pool.opened(first, browser.context(first))
+    pool.opened(second, browser.context(second))
+    assert pool.release(first) == []
+    assert sorted(browser.open) == sorted([first, second])
+    for context in pool.release(second):
+        context.close()
+    assert browser.open == {}
+
+
+def test_retired_context_is_closed_after_its_last_render():
+    browser = FakeBrowser(max_contexts=6)
+    pool = ContextPool(contexts_per_domain=1, max_renders=2)
+    names = [pool.acquire('virgio.com') for _ in range(3)]
+    assert names[0] == names[1] != names[2]
+    for name in names:
+        pool.opened(name, browser.context(name))
+    closed = pool.release(names[0]) + pool.release(names[1])
+    assert [c.name for c in closed] == [names[0]]
@@ -0,0 +1,36 @@
+import os
+
+from ecom_crawler.replay import ArchiveWriter, iter_archive
+
+
+def record_run(path, urls):
+    writer = ArchiveWriter(path)
+    for url in urls:
+        writer.write(url, 200, {'Content-Type': 'text/html'}, f'<html>{url}</html>'.encode() * 50)
+    writer.close()
+
+
+def test_runs_after_a_crashed_one_are_read(tmp_path):
+    path = str(tmp_path / 'fixtures.warc.gz')
+    record_run(path, [f'https://virgio.com/products/a-{i}' for i in range(3)])
+    size = os.path.getsize(path)
+    record_run(path, [f'https://virgio.com/products/b-{i}' for i in range(3)])
+    # the second run crashed: its member lost the trailer and the end of its last record
+    with open(path, 'r+b') as f:
+        f.truncate(size + (os.path.getsize(path) - size) // 2)
+    record_run(path, [f'https://virgio.com/products/c-{i}' for i in range(3)])
+    urls = [header['url'].rsplit('/', 1)[1] for header, _ in iter_archive(path)]
+    assert urls[:3] == ['a-0', 'a-1', 'a-2']
+    assert urls[-3:] == ['c-0', 'c-1', 'c-2']
+    assert all(url.startswith('b-') for url in urls[3:-3])
+
+
+def test_bodies_round_trip(tmp_path):
+    path = str(tmp_path / 'fixtures.warc.gz')
+    writer = ArchiveWriter(path)
+    writer.write('https://virgio.com/', 200, {'Content-Type': 'text/html'}, b'<html>\n\n</html>')
+    writer.alias('https://virgio.com/old', 'https://virgio.com/')
+    writer.close()
+    records = list(iter_archive(path))
+    assert records[0][1] == b'<html>\n\n</html>'
+    assert records[1][0]['alias_of'] == 'https://virgio.com/'
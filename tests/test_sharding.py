@@ -0,0 +1,62 @@
+from ecom_crawler import sharding
+from ecom_crawler.sharding import ShardCoordinator
+
+
+def coordinators(tmp_path, shards=2):
+    path = str(tmp_path / 'coordinator.sqlite')
+    ShardCoordinator(path, shards=shards).reset()
+    return [ShardCoordinator(path, shard, shards, ['westside.com']) for shard in range(shards)]
+
+
+def owned_by(coordinator, shard):
+    for i in range(100):
+        url = f'https://westside.com/products/item-{i}'
+        if coordinator.owner(url) == shard:
+            return url
+
+
+def test_url_is_claimed_once_and_handed_over_to_its_owner(tmp_path):
+    first, second = coordinators(tmp_path)
+    url = owned_by(first, 1)
+    assert first.claim(url, 'parse_page')
+    assert not second.claim(url, 'parse_page') # seen already
+    assert first.take() == []
+    assert second.take() == [(url, 'parse_page', False)]
+    assert second.take() == []
+
+
+def test_workers_wait_for_each_other(tmp_path):
+    first, second = coordinators(tmp_path)
+    claimed, taken, finished = first.sync([(owned_by(first, 1), 'parse_page', False, None)])
+    assert claimed == [True] and taken == [] and not finished # the second worker hasn't taken it yet
+    claimed, taken, finished = second.sync()
+    assert len(taken) == 1 and not finished # busy with it
+    second.release()
+    assert first.sync()[2]
+
+
+def test_unsplit_domains_are_not_claimed(tmp_path):
+    first, _ = coordinators(tmp_path)
+    assert first.owner('https://virgio.com/products/x') is None
+    assert first.sync([]) == ([], [], False)
+
+
+def test_worker_options_win_over_the_users(tmp_path, monkeypatch):
+    commands = []
+
+    class Process:
+        def __init__(self, command):
+            commands.append(command)
+
+        def wait(self):
+            return 0
+
+    monkeypatch.setattr(sharding.subprocess, 'Popen', Process)
+    workdir = str(tmp_path / 'shards')
+    sharding.main(['--workers', '2', '--domains', 'virgio.com,westside.com', '--workdir', workdir,
+                   '--output', str(tmp_path / 'out.json'), '-s', 'GROUPED_OUTPUT_FILE=user.json', '-a', 'resume=state.sqlite'])
+    for shard, command in enumerate(commands):
+        settings = dict(command[i + 1].split('=', 1) for i, arg in enumerate(command) if arg == '-s')
+        spider_args = dict(command[i + 1].split('=', 1) for i, arg in enumerate(command) if arg == '-a')
+        assert settings['GROUPED_OUTPUT_FILE'].endswith(f'worker-{shard}.json')
+        assert spider_args['resume'] == f'state.{shard}.sqlite'
@@ -0,0 +1,40 @@
+from scrapy.downloadermiddlewares.redirect import RedirectMiddleware
+from scrapy.http import Request, TextResponse
+from scrapy.spidermiddlewares.httperror import HttpErrorMiddleware
+from scrapy.utils.test import get_crawler
+
+from ecom_crawler.spiders.product_spider import EcomProductSpider
+
+
+def robots_response(request, status, body=b''):
+    return TextResponse(request.url, status=status, body=body, encoding='utf-8', request=request)
+
+
+def test_missing_robots_txt_falls_back_to_sitemap_xml():
+    spider = EcomProductSpider(domains='virgio.com')
+    request = next(spider.sitemap_start_requests())
+    response = robots_response(request, 404, b'<html>Not found</html>')
+    # HttpErrorMiddleware lets the 404 through to parse_robots
+    HttpErrorMiddleware(get_crawler(EcomProductSpider).settings).process_spider_input(response, spider)
+    requests = [r for r in request.callback(response) if isinstance(r, Request)]
+    assert [r.url for r in requests] == ['https://virgio.com/sitemap.xml']
+
+
+def test_robots_txt_sitemaps_are_followed():
+    spider = EcomProductSpider(domains='virgio.com')
+    request = next(spider.sitemap_start_requests())
+    response = robots_response(request, 200, b'User-agent: *\nSitemap: https://virgio.com/sitemap_index.xml\n')
+    requests = [r for r in request.callback(response) if isinstance(r, Request)]
+    assert [r.url for r in requests] == ['https://virgio.com/sitemap_index.xml']
+
+
+def test_robots_txt_redirect_is_followed():
+    spider = EcomProductSpider(domains='virgio.com')
+    request = next(spider.sitemap_start_requests())
+    response = robots_response(request, 301)
+    response.headers['Location'] = 'https://www.virgio.com/robots.txt'
+    crawler = get_crawler(EcomProductSpider)
+    redirected = RedirectMiddleware.from_crawler(crawler).process_response(request, response, spider)
+    assert isinstance(redirected, Request)
+    assert redirected.url == 'https://www.virgio.com/robots.txt'
+    assert redirected.callback == spider.parse_robots
@@ -0,0 +1,27 @@
+from ecom_crawler.url_classifier import LISTING, PRODUCT, UNKNOWN, UrlClassifier
+
+
+def test_cache_is_keyed_on_the_exact_url():
+    classifier = UrlClassifier(cache_size=8)
+    # '$' anchored pattern: the query string is part of what it matches
+    assert classifier.classify('https://shop.com/men/shirts').kind == UNKNOWN
+    assert classifier.classify('https://shop.com/men/shirts?variant=/p-123').kind == PRODUCT
+    assert classifier.cache_info().currsize == 2
+
+
+def test_product_wins_over_listing():
+    classifier = UrlClassifier()
+    url_class = classifier.classify('https://www.virgio.com/collections/dresses/products/linen-dress')
+    assert url_class.kind == PRODUCT and url_class.is_listing
+    assert classifier.classify('https://www.virgio.com/collections/dresses').kind == LISTING
+
+
+def test_every_matching_pattern_is_reported():
+    classifier = UrlClassifier()
+    url = 'https://www.virgio.com/collections/dresses/products/linen-dress'
+    sources = [classifier.pattern_source(name) for name in classifier.matching_patterns(url)]
+    # classify() stops at the first product pattern that matches, the others still count
+    assert ('product', r'/products/') in sources
+    assert ('product', r'https?://(?:www\.)?virgio\.com/products/[^/?#]+') not in sources # not under /collections/
+    assert ('listing', r'/collections/') in sources
+    assert len([kind for kind, _ in sources if kind == 'product']) > len([n for n in classifier.classify(url).patterns if n.startswith('p')])
@@ -0,0 +1,54 @@
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from ecom_crawler.spiders.product_spider import EcomProductSpider
+from ecom_crawler.url_normalizer import UrlNormalizer
+
+
+def test_trackers_and_variants_are_stripped():
+    normalizer = UrlNormalizer()
+    url = 'https://virgio.com/products/linen-dress?utm_source=ig&UTM_medium=story&variant=123&color=red&fbclid=x#reviews'
+    assert normalizer.normalize(url) == 'https://virgio.com/products/linen-dress?color=red'
+    assert normalizer.normalize('https://virgio.com/products/linen-dress?variant=123') == 'https://virgio.com/products/linen-dress'
+
+
+def test_unchanged_url_is_returned_as_is():
+    normalizer = UrlNormalizer()
+    url = 'https://virgio.com/collections/dresses?page=2&sort_by=price'
+    assert normalizer.normalize(url) is url
+
+
+def test_shopify_collection_products_are_rewritten():
+    normalizer = UrlNormalizer()
+    url = 'https://virgio.com/collections/dresses/products/linen-dress'
+    assert normalizer.normalize(url, platform='shopify') == 'https://virgio.com/products/linen-dress'
+    assert normalizer.normalize(url) is url # only on Shopify stores
+
+
+def test_trailing_slash_is_kept_unless_a_domain_rule_strips_it():
+    url = 'https://westside.com/products/linen-shirt/'
+    assert UrlNormalizer().normalize(url) is url
+    normalizer = UrlNormalizer({'westside.com': {'rewrite': [[r'(?<=.)/$', '']]}})
+    assert normalizer.normalize(url) == 'https://westside.com/products/linen-shirt'
+    assert normalizer.normalize('https://westside.com/') == 'https://westside.com/'
+    assert normalizer.normalize('https://virgio.com/products/linen-dress/').endswith('/')
+
+
+def test_duplicates_are_dropped_and_counted():
+    crawler = get_crawler(EcomProductSpider)
+    crawler.stats.open_spider(None)
+    spider = EcomProductSpider.from_crawler(crawler, domains='virgio.com')
+    urls = [
+        'https://virgio.com/products/linen-dress',
+        'https://virgio.com/products/linen-dress?utm_source=ig', # saved: the dupefilter would have fetched it
+        'https://virgio.com/products/linen-dress?utm_source=ig', # the dupefilter catches this one anyway
+        'https://virgio.com/products/linen-dress',
+        'https://virgio.com/products/silk-top?variant=1',
+    ]
+    kept = [spider.normalize_request(Request(url)) for url in urls]
+    assert [r and r.url for r in kept] == [urls[0], None, None, None, 'https://virgio.com/products/silk-top']
+    stats = crawler.stats.get_stats()
+    assert stats['normalizer/rewritten'] == 3
+    assert stats['normalizer/fetches_saved'] == 1
+    assert stats['normalizer/duplicates'] == 2
+    assert stats['dedup/requests_rejected'] == 3